@@ -2,18 +2,209 @@
 import math
 import cv2
 from time import time
+from itertools import islice
+from collections import deque
 import numpy as np
-import mediapipe as mp
-import matplotlib.pyplot as plt
+from enum import IntEnum
+from video_io import FramePool, FrameReader, FrameWriter, FFmpegWriter, SizedWriter, ffmpegAvailable
+from landmark_tracks import LandmarkTrackWriter
+from annotations import AnnotationWriter
+from scoring import PhaseScorer
+from smoothing import LandmarkSmoother
+from pose_rules import defaultPoseRules, loadPoseRules
+from metrics import FRAME_BUCKETS, Histogram, timed, timed_iter
 
-# Initializing mediapipe pose class
-mp_pose = mp.solutions.pose
+# Function to import the mediapipe pose and drawing classes
+def loadMediapipe():
+    '''
+    MediaPipe takes about a second to import, matplotlib included, so it is only imported once a Pose
+    function is built or landmarks are drawn. The service and the tools only using the settings start fast.
+    Returns:
+        mp_pose: The mediapipe pose class.
+        mp_drawing: The mediapipe drawing class.
+    '''
+    import mediapipe as mp
+    return mp.solutions.pose, mp.solutions.drawing_utils
+
+# The mediapipe classes stay available as mp_pose and mp_drawing, imported on first use.
+def __getattr__(name):
+    if name in ('mp_pose', 'mp_drawing'):
+        return loadMediapipe()[name == 'mp_drawing']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# The pose landmarks used by the analysis, numbered like mediapipe's PoseLandmark
+class PoseLandmark(IntEnum):
+    LEFT_SHOULDER = 11
+    RIGHT_SHOULDER = 12
+    LEFT_ELBOW = 13
+    RIGHT_ELBOW = 14
+    LEFT_WRIST = 15
+    RIGHT_WRIST = 16
+    LEFT_HIP = 23
+    RIGHT_HIP = 24
+    LEFT_KNEE = 25
+    RIGHT_KNEE = 26
+    LEFT_ANKLE = 27
+    RIGHT_ANKLE = 28
+
+# Pose model settings for the selectable inference modes. Only one model runs per frame.
+POSE_MODES = {
+    # Tracking mode: the lighter model, reusing the previous frame's landmarks between frames.
+    'tracking': dict(static_image_mode=False, min_detection_confidence=0.5, model_complexity=1),
+    # Accurate mode: the heavy model, detecting from scratch on every frame.
+    'accurate': dict(static_image_mode=True, min_detection_confidence=0.3, model_complexity=2),
+    # Lite mode: the smallest model, used to find the vault in a video before analysing it.
+    'lite': dict(static_image_mode=False, min_detection_confidence=0.5, model_complexity=0),
+}
+
+# Number of frames between two progress reports of VaultAnalyzer.analyze
+PROGRESS_INTERVAL = 30
+
+# Version of the analysis output. Bump it whenever a change alters the output of an analysis,
+# so that previously cached results are not reused.
+ANALYZER_VERSION = 5
+
+# Function to build the Pose function for an inference mode
+def buildPose(mode='tracking'):
+    '''
+    Args:
+        mode: One of the keys of POSE_MODES ('tracking', 'accurate' or 'lite').
+    Returns:
+        pose: The pose build function needed to carry out the pose detection.
+    '''
+    if mode not in POSE_MODES:
+        raise ValueError(f"Unknown pose mode '{mode}', expected one of {sorted(POSE_MODES)}")
+    mp_pose, _ = loadMediapipe()
+    return mp_pose.Pose(**POSE_MODES[mode])
+
+# Output video encoders: 'opencv' is cv2.VideoWriter with the mp4v codec. The others pipe the frames to ffmpeg
+# and can write to a pipe that is streamed: 'ffmpeg' with the same MPEG-4 codec, 'h264' and 'h265' with
+# libx264 and libx265.
+ENCODERS = ('opencv', 'ffmpeg', 'h264', 'h265')
+
+# Settings of the ffmpeg encoders: output height, constant rate factor, bitrate, speed preset and fast start,
+# see video_io.FFmpegWriter
+ENCODING_OPTIONS = ('height', 'crf', 'bitrate', 'preset', 'faststart')
+
+# Padding added on each side of the gymnast's bounding box in ROI mode, as a fraction of the box size
+ROI_PADDING = 0.3
+
+# Smallest width and height of an ROI crop in pixels
+ROI_MIN_SIZE = 96
+
+# Average landmark visibility below which the gymnast counts as lost in the ROI crop
+ROI_MIN_VISIBILITY = 0.5
+
+# States of the vault state machine in which frames may be skipped by AdaptiveSampler: the run-up
+# before the Jump and the stillness after Complete. Every frame is inferred from the Jump to the 2nd Flight.
+SAMPLED_STATES = (0, 5)
 
-# Building the Pose function.
-pose = mp_pose.Pose(static_image_mode=True, min_detection_confidence=0.3, model_complexity=2)
+# Largest landmark movement between two sampled frames, in torso lengths per frame, for which the
+# frames in between are interpolated. Faster movement has them inferred after all.
+SAMPLE_MAX_MOTION = 0.15
 
-# Initializing mediapipe drawing class
-mp_drawing = mp.solutions.drawing_utils
+# Ways of writing the output of a two-pass analysis, see findVaultWindow: 'trim' writes only the
+# analysed window of the video, 'overlay' the whole video with the analysis drawn on the window.
+SEGMENT_OUTPUTS = ('trim', 'overlay')
+
+# Pose mode, frame height and frames per inferred frame of the first pass finding the vault
+SEGMENT_MODE = 'lite'
+SEGMENT_HEIGHT = 320
+SEGMENT_INTERVAL = 3
+
+# Seconds analysed before the Jump and after the Complete pose found by the first pass
+SEGMENT_PADDING = 1.0
+
+# One Euro filter of the landmarks when smoothing, see smoothing.LandmarkSmoother: cutoff frequency in Hz
+# at standstill, its increase in Hz per pixel per second of speed, and cutoff frequency of the speed.
+# Tuned on frames of 640 pixels high, as returned by prepareFrame.
+SMOOTHING_MIN_CUTOFF = 1.5
+SMOOTHING_BETA = 0.05
+SMOOTHING_D_CUTOFF = 1.0
+
+# When smoothing, the state machine only advances once the next pose was matched in TRANSITION_FRAMES
+# of the last TRANSITION_WINDOW frames with a gymnast, see TransitionHysteresis
+TRANSITION_FRAMES = 2
+TRANSITION_WINDOW = 3
+
+# Function to describe the settings that determine the output of an analysis
+def analyzerSettings(mode='tracking', encoder='opencv', roi=False, sample_interval=1, segment=None, encoding=None,
+                     render=True, smoothing=False, rules=None):
+    '''
+    Args:
+        mode: Pose inference mode, one of the keys of POSE_MODES.
+        encoder: Output video encoder, one of ENCODERS.
+        roi: Whether the pose is detected in a crop around the gymnast, see ROIPoseDetector.
+        sample_interval: Frames per inferred frame in the calm phases, see AdaptiveSampler.
+        segment: Output of the two-pass analysis, one of SEGMENT_OUTPUTS, or None to analyse every frame.
+        encoding: Optional dict of ffmpeg encoder settings, with keys of ENCODING_OPTIONS.
+        render: Whether the analysis is drawn on an output video, rather than only saved as annotations.
+        smoothing: Whether the landmarks are smoothed and the phase transitions need several frames.
+        rules: Path of the pose rule table, the default one when None.
+    Returns:
+        settings: Dict of the analyzer version and settings, used to key cached results.
+    '''
+    settings = {'version': ANALYZER_VERSION, 'mode': mode, 'pose': POSE_MODES[mode], 'encoder': encoder}
+
+    # Only added when enabled, so the keys of results cached without them stay valid.
+    if roi:
+        settings['roi'] = {'padding': ROI_PADDING, 'min_size': ROI_MIN_SIZE, 'min_visibility': ROI_MIN_VISIBILITY}
+    if sample_interval > 1:
+        settings['sampling'] = {'interval': sample_interval, 'states': SAMPLED_STATES, 'max_motion': SAMPLE_MAX_MOTION}
+    if segment is not None:
+        settings['segment'] = {'output': segment, 'mode': SEGMENT_MODE, 'height': SEGMENT_HEIGHT,
+                               'interval': SEGMENT_INTERVAL, 'padding': SEGMENT_PADDING}
+    if encoding:
+        settings['encoding'] = dict(encoding)
+    if not render:
+        settings['render'] = False
+    if smoothing:
+        settings['smoothing'] = {'min_cutoff': SMOOTHING_MIN_CUTOFF, 'beta': SMOOTHING_BETA,
+                                 'd_cutoff': SMOOTHING_D_CUTOFF, 'transition': [TRANSITION_FRAMES, TRANSITION_WINDOW]}
+
+    # The rules are identified by their content, so editing the table does not reuse stale results.
+    settings['rules'] = (loadPoseRules(rules) if rules else defaultPoseRules()).digest()
+    return settings
+
+# Function to check the settings of an analysis, raising a ValueError for unsupported ones
+def checkSettings(encoder='opencv', segment=None, encoding=None, joined=False):
+    '''
+    Args:
+        encoder: Output video encoder, one of ENCODERS.
+        segment: Output of the two-pass analysis, one of SEGMENT_OUTPUTS, or None.
+        encoding: Optional dict of ffmpeg encoder settings, with keys of ENCODING_OPTIONS.
+        joined: Whether the output video is joined from chunks with ffmpeg, see sharded.ShardedAnalyzer,
+                which needs ffmpeg whatever the encoder.
+    '''
+    if encoder not in ENCODERS:
+        raise ValueError(f"Unknown encoder '{encoder}', expected one of {ENCODERS}")
+    if encoding and encoder == 'opencv':
+        raise ValueError("Encoding settings need one of the ffmpeg encoders")
+    unknown = set(encoding or ()) - set(ENCODING_OPTIONS)
+    if unknown:
+        raise ValueError(f"Unknown encoding settings {sorted(unknown)}, expected some of {ENCODING_OPTIONS}")
+    if segment is not None and segment not in SEGMENT_OUTPUTS:
+        raise ValueError(f"Unknown segment output '{segment}', expected one of {SEGMENT_OUTPUTS}")
+    if joined and not ffmpegAvailable():
+        raise ValueError("Joining the chunks of the output video needs ffmpeg, which was not found. "
+                         "Install it, set FFMPEG_BINARY, or analyse without rendering.")
+
+# Function to open the writer of the output video
+def openWriter(output_path, fps, frame_size, encoder='opencv', encoding=None):
+    '''
+    Args:
+        output_path: Path of the output video, or of a named pipe for the ffmpeg encoders.
+        fps: Frame rate of the output video.
+        frame_size: (width, height) of the frames that will be written.
+        encoder: Output video encoder, one of ENCODERS.
+        encoding: Optional dict of ffmpeg encoder settings, with keys of ENCODING_OPTIONS.
+    Returns:
+        out: The opened cv2.VideoWriter or video_io.FFmpegWriter.
+    '''
+    if encoder == 'opencv':
+        return cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, frame_size)
+    codec = 'mpeg4' if encoder == 'ffmpeg' else encoder
+    return FFmpegWriter(output_path, fps, frame_size, codec, **(encoding or {}))
 
 # Function to classify a gymnast pose
 def classifyPose(prev_state, landmarks, output_image, display=False):
@@ -21,7 +212,7 @@ def classifyPose(prev_state, landmarks, output_image, display=False):
     This function will classify vault gymnast poses on the basis of the angles of various body joints.
     Args:
         prev_state: keeps the value of the last previous state attained.
-        landmarks: Record of detected landmarks of the gymnast whose pose needs to be classified.
+        landmarks: (33, 3) array of the detected landmarks of the gymnast whose pose needs to be classified.
         output_image: Gymnast image with the detected pose landmarks drawn.
         display: When true, this function displays the resultant image with the pose label
         written on it and returns nothing.
@@ -31,142 +222,65 @@ def classifyPose(prev_state, landmarks, output_image, display=False):
         label: Classified pose label of the gymnast.
 
     '''
-    # Initializing the unknown state value with '0'
-    state = 0
+    # Calculating the essential required angles in one vectorized call, see ANGLE_TRIPLETS.
+    angles = calculateAngles(landmarks)
 
-    # Initializing the pose label. It is unknown at this stage.
-    label = '   '
-    color = (0, 0, 255)
-    
-    # Calculating the essential required angles.
-    #----------------------------------------------------------------------------------------------------------------
-    
-    # Angle of left elbow means the angle between the left shoulder, elbow and wrist points.
-    left_elbow_angle = calculateAngle(landmarks[mp_pose.PoseLandmark.LEFT_SHOULDER.value],
-                                      landmarks[mp_pose.PoseLandmark.LEFT_ELBOW.value],
-                                      landmarks[mp_pose.PoseLandmark.LEFT_WRIST.value])
-    
-    # Angle of right elbow means the angle between the right shoulder, elbow and wrist points.
-    right_elbow_angle = calculateAngle(landmarks[mp_pose.PoseLandmark.RIGHT_SHOULDER.value],
-                                       landmarks[mp_pose.PoseLandmark.RIGHT_ELBOW.value],
-                                       landmarks[mp_pose.PoseLandmark.RIGHT_WRIST.value])
-    
-    # Angle of left shoulder means the angle between the left elbow, shoulder and hip points.
-    left_shoulder_angle = calculateAngle(landmarks[mp_pose.PoseLandmark.LEFT_ELBOW.value],
-                                         landmarks[mp_pose.PoseLandmark.LEFT_SHOULDER.value],
-                                         landmarks[mp_pose.PoseLandmark.LEFT_HIP.value])
-
-    # Angle of right shoulder means the angle between the right hip, shoulder and elbow points.
-    right_shoulder_angle = calculateAngle(landmarks[mp_pose.PoseLandmark.RIGHT_HIP.value],
-                                          landmarks[mp_pose.PoseLandmark.RIGHT_SHOULDER.value],
-                                          landmarks[mp_pose.PoseLandmark.RIGHT_ELBOW.value])
-
-    # Angle of left knee means the angle between the left hip, knee and ankle points.
-    left_knee_angle = calculateAngle(landmarks[mp_pose.PoseLandmark.LEFT_HIP.value],
-                                     landmarks[mp_pose.PoseLandmark.LEFT_KNEE.value],
-                                     landmarks[mp_pose.PoseLandmark.LEFT_ANKLE.value])
-
-    # Angle of right knee means the angle between the right hip, knee and ankle points
-    right_knee_angle = calculateAngle(landmarks[mp_pose.PoseLandmark.RIGHT_HIP.value],
-                                      landmarks[mp_pose.PoseLandmark.RIGHT_KNEE.value],
-                                      landmarks[mp_pose.PoseLandmark.RIGHT_ANKLE.value])
-    
-    # Angle of left hip means the angle between the left shoulder, hip and knee points.
-    left_hip_angle = calculateAngle(landmarks[mp_pose.PoseLandmark.LEFT_SHOULDER.value],
-                                    landmarks[mp_pose.PoseLandmark.LEFT_HIP.value],
-                                    landmarks[mp_pose.PoseLandmark.LEFT_KNEE.value])
-    
-    # Angle of right hip means the angle between the right shoulder, hip and knee points
-    right_hip_angle = calculateAngle(landmarks[mp_pose.PoseLandmark.RIGHT_SHOULDER.value],
-                                    landmarks[mp_pose.PoseLandmark.RIGHT_HIP.value],
-                                    landmarks[mp_pose.PoseLandmark.RIGHT_KNEE.value])
-    
-    #----------------------------------------------------------------------------------------------------------------
-    
-    
-    # Check if the range of elbow and shoulder angles differ from '0' to '360' degree.
-    if left_elbow_angle > 0 and left_elbow_angle < 360 and right_elbow_angle > 0 and right_elbow_angle < 360:
-
-        # Check if shoulders are at the required angle.
-        if left_shoulder_angle > 0 and left_shoulder_angle < 360 and right_shoulder_angle > 0 and right_shoulder_angle < 360:
-
-    # Checking if it is the Jump pose.
-    #----------------------------------------------------------------------------------------------------------------
+    # Advance the state machine and calculate the deductions of the classified pose.
+    prev_state, label = classifyState(prev_state, angles)
+    deductions = poseDeductions(label, landmarks, angles)
 
-            # Check if 360-knee_angle is less than 150 degrees.
-            if left_knee_angle > 210  and left_knee_angle < 360 or right_knee_angle > 210 and right_knee_angle < 360:
-
-                # Specify the state of the pose that is Jump pose.
-                state = 1
-                        
-    #----------------------------------------------------------------------------------------------------------------
+    # Write the label and the deductions on the output image.
+    drawPoseLabels(output_image, landmarks, label, deductions)
     
-    # Check if the both arms are at the required angle.
-    if left_elbow_angle > 0 and left_elbow_angle < 360 and right_elbow_angle > 0 and right_elbow_angle < 360:
-
-        # Check if shoulders are straight down.
-        if left_shoulder_angle > 0 and left_shoulder_angle < 20 and right_shoulder_angle > 0 and right_shoulder_angle < 20:
-
-    # Check if it is the 2nd flight pose.
-    #----------------------------------------------------------------------------------------------------------------
-
-            # Check if both the legs are free.
-            if left_knee_angle > 0  and left_knee_angle < 360 or right_knee_angle > 0 and right_knee_angle < 360:
-
-                # Specify the state of the pose that is 2nd flight pose.
-                state = 4
-    #----------------------------------------------------------------------------------------------------------------
+    # Check if the resultant image can be displayed.
+    if display:
     
-    # Check if both arms are at the required angles.
-    if left_elbow_angle > 145 and left_elbow_angle < 215 and right_elbow_angle > 145 and right_elbow_angle < 215:
-
-    # Check if it is the 1st flight pose.
-    #----------------------------------------------------------------------------------------------------------------
+        # Displaying the resultant image.
+        import matplotlib.pyplot as plt
+        plt.figure(figsize=[10,10])
+        plt.imshow(output_image[:,:,::-1]);plt.title("Output Image");plt.axis('off');
         
-        # Check if both the shoulders are straight.
-        if left_shoulder_angle > 145 and left_shoulder_angle < 170 and right_shoulder_angle > 65:
-            # Check if one leg is straight.
-            if left_knee_angle > 165 and left_knee_angle < 195 or right_knee_angle > 165 and right_knee_angle < 195:
-
-                # Specify the state of the pose that is 1st Flight pose.
-                state = 2
-    #----------------------------------------------------------------------------------------------------------------
-    
-    # Check if it is the repulsion pose.
-    #----------------------------------------------------------------------------------------------------------------
-    
-    # Check if both the legs are straight.
-    if left_knee_angle > 170 and left_knee_angle < 190 and right_knee_angle > 170 and right_knee_angle < 190:
-    #----------------------------------------------------------------------------------------------------------------
-
-        # Check if one of the shoulders is greater than 180 degrees.
-        if left_shoulder_angle > 180 or right_shoulder_angle > 180:
-            # Check if one elbow is at the required angle.
-            if left_elbow_angle > 120 and left_elbow_angle < 190 or right_elbow_angle > 120 and right_elbow_angle < 190:
-
-                # Specify the state of the pose that is Repulsion pose.
-                state = 3
-    #----------------------------------------------------------------------------------------------------------------
-    
-    
-    # Check if both the arms are straight.
-    if left_elbow_angle > 165 and left_elbow_angle < 195 and right_elbow_angle > 165 and right_elbow_angle < 195:
+    else:
+        
+        # Returning the output image and the classified label.
+        return prev_state, output_image, label
 
-        # Check if shoulders are at the required angle.
-        if left_shoulder_angle > 85 and left_shoulder_angle < 195 and right_shoulder_angle > 85 and right_shoulder_angle < 195:
+# Function to advance the vault state machine by one frame
+def classifyState(prev_state, angles, hysteresis=None, rules=None):
+    '''
+    Args:
+        prev_state: keeps the value of the last previous state attained.
+        angles: The joint angles of the frame, as returned by calculateAngles.
+        hysteresis: Optional TransitionHysteresis of the video, which only lets the state advance once the
+                    next pose was seen in enough of the recent frames. Without it a single frame is enough.
+        rules: The PoseRules the poses are matched with, the default rule table when None.
+    Returns:
+        prev_state: keeps the value of the latest last previous state attained.
+        label: Classified pose label of the gymnast.
+    '''
+    return advanceState(prev_state, candidateState(angles, rules), hysteresis)
 
-    # Check if it is the ending pose.
-    #----------------------------------------------------------------------------------------------------------------
+# Function to advance the vault state machine to the pose matched by a frame
+def advanceState(prev_state, state, hysteresis=None):
+    '''
+    Args:
+        prev_state: keeps the value of the last previous state attained.
+        state: The state of the pose the frame matches, as returned by candidateState.
+        hysteresis: Optional TransitionHysteresis of the video, see classifyState.
+    Returns:
+        prev_state: keeps the value of the latest last previous state attained.
+        label: Classified pose label of the gymnast.
+    '''
+    # Initializing the pose label. It is unknown at this stage.
+    label = '   '
 
-            # Check if one leg is straight.
-            if left_knee_angle > 135 and left_knee_angle < 180 or right_knee_angle > 135 and right_knee_angle < 180:
+    # Only the next pose of the vault moves the state machine on.
+    advance = state == prev_state + 1
+    if hysteresis is not None:
+        advance = hysteresis.update(advance)
 
-                # Specify the state of the pose that is ending pose.
-                state = 5
-    #-----------------------------------------------------------------------------------------------------------------------
-    
     # If the next state is required, increment the previous state to the next state, otherwise ignore the next state
-    if state == prev_state + 1:
+    if advance:
         prev_state = state
     else:
         state = prev_state
@@ -187,15 +301,113 @@ def classifyPose(prev_state, landmarks, output_image, display=False):
     else:
         label = '   '
 
-    # Check if the pose is classified successfully
-    if label != '   ':
-        
-        # Update the color (to green) with which the label will be written on the image.
-        color = (0, 255, 0)
+    return prev_state, label
+
+# N-of-M hysteresis of the vault state machine
+class TransitionHysteresis:
+    '''
+    Lets the state machine advance only once the next pose was matched in `required` of the last `window`
+    frames, so a single frame of jitter does not move the vault on to the next phase. The frames need not
+    be consecutive, a pose matched with one jittery frame in between still counts.
+    Args:
+        required: Frames the next pose must be matched in.
+        window: Number of recent frames looked at.
+    '''
+
+    def __init__(self, required=TRANSITION_FRAMES, window=TRANSITION_WINDOW):
+        if not 1 <= required <= window:
+            raise ValueError(f"Expected 1 <= required <= window, got {required} of {window}")
+        self.required = required
+        self.recent = deque(maxlen=window)
+
+    def reset(self):
+        self.recent.clear()
+
+    def update(self, matched):
+        '''
+        Args:
+            matched: Whether the frame matched the next pose of the state machine.
+        Returns:
+            advance: Whether the state machine advances on this frame.
+        '''
+        self.recent.append(matched)
+        if sum(self.recent) < self.required:
+            return False
+
+        # The frames of this pose do not count towards the next one.
+        self.recent.clear()
+        return True
+
+# Function to find the vault pose the joint angles of a frame match
+def candidateState(angles, rules=None):
+    '''
+    Args:
+        angles: The joint angles of the frame, as returned by calculateAngles.
+        rules: The PoseRules to match the angles with, the default rule table when None.
+    Returns:
+        state: The state of the matched pose, 1 Jump, 2 1st Flight, 3 Repulsion, 4 2nd Flight, 5 Complete,
+               or 0 when none matches. classifyState only advances to it when it is the next state.
+    '''
+    # The poses are described by the rule table, see pose_rules.json.
+    return (rules or defaultPoseRules()).classify(angles)
+
+# Function to calculate the deductions shown for a classified pose
+def poseDeductions(label, landmarks, angles):
+    '''
+    Args:
+        label: Classified pose label of the gymnast.
+        landmarks: (33, 3) array of the detected landmarks of the gymnast.
+        angles: The joint angles of the frame, as returned by calculateAngles.
+    Returns:
+        deductions: Dict of the deductions that apply to the pose, in the order they are written
+                    on the image. Keys are 'bent_knees', 'leg_separation', 'shoulder_angle',
+                    'body_alignment' and 'layout_failure'.
+    '''
+    (left_elbow_angle, right_elbow_angle, left_shoulder_angle, right_shoulder_angle,
+     left_knee_angle, right_knee_angle, left_hip_angle, right_hip_angle) = angles
+
+    deductions = {}
+
+    # Calculate the 'Bent knees' and 'Leg separation' deductions during the flight phases.
+    if (label =='1st Flight' or label == 'Repulsion' or label == '2nd Flight'):
+        deductions['bent_knees'] = bent_knees(min(left_knee_angle,right_knee_angle))
+
+        shoulder_sep = distance((landmarks[PoseLandmark.RIGHT_SHOULDER.value]),(landmarks[PoseLandmark.LEFT_SHOULDER.value]))
+        leg_sep = distance((landmarks[PoseLandmark.RIGHT_ANKLE.value]),(landmarks[PoseLandmark.LEFT_ANKLE.value]))
+        deductions['leg_separation'] = leg_d(shoulder_sep, leg_sep)
+
+    # Calculate the 'Shoulder Angle' deduction
+    if (label == 'Repulsion'):
+        deductions['shoulder_angle'] = shoulder_ang(min(left_shoulder_angle,right_shoulder_angle))
+
+    # Calculate the 'Body Alignment' deduction
+    if (label == '2nd Flight'):
+        if (left_elbow_angle < 165 or left_elbow_angle > 195) or (right_elbow_angle < 165 or right_elbow_angle < 195):
+            deductions['body_alignment'] = 0.1
+
+    # Calculate the 'Layout failure' deduction
+    if(label=='Complete' and ((left_knee_angle > 165 and left_knee_angle < 195) or (right_knee_angle > 165 and right_knee_angle < 195)) and ((left_hip_angle > 135
+    and left_hip_angle < 195) or (right_hip_angle > 135 and right_hip_angle < 195))):
+        deductions['layout_failure'] = 0.1
+
+    return deductions
+
+# Function to write the pose label and its deductions on the image
+def drawPoseLabels(output_image, landmarks, label, deductions):
+    '''
+    Args:
+        output_image: Gymnast image the label is written on, in place.
+        landmarks: (33, 3) array of the detected landmarks of the gymnast.
+        label: Classified pose label of the gymnast.
+        deductions: Dict of the deductions, as returned by poseDeductions.
+    '''
+
+    # The label is written in red until the pose is classified successfully, then in green.
+    color = (0, 255, 0) if label != '   ' else (0, 0, 255)
     
     # centre of torso of the gymnast body
-    left_torso = landmarks[mp_pose.PoseLandmark.LEFT_HIP.value]
-    right_torso = landmarks[mp_pose.PoseLandmark.RIGHT_HIP.value]
+    left_torso = landmarks[PoseLandmark.LEFT_HIP.value]
+    right_torso = landmarks[PoseLandmark.RIGHT_HIP.value]
     cog = centreoftorso(left_torso, right_torso)
     r1, r2, _ = cog
 
@@ -203,62 +415,41 @@ def classifyPose(prev_state, landmarks, output_image, display=False):
     cv2.putText(output_image, label, tuple(np.multiply([r1+30, r2-80], [1, 1]).astype(int)) ,cv2.FONT_HERSHEY_PLAIN, 2, color, 2)
 
     # Write the calculated 'Bent knees' and 'Leg separation' label on the output image in white and cyan color.
-    if (label =='1st Flight' or label == 'Repulsion' or label == '2nd Flight'):
-        n = bent_knees(min(left_knee_angle,right_knee_angle))
-        cv2.putText(output_image, "Bent knees:"+" "+ str(n), tuple(np.multiply([r1+30, r2-30], [1, 1]).astype(int)) ,cv2.FONT_HERSHEY_PLAIN, 2, (255, 255, 255), 2)
-
-        shoulder_sep = distance((landmarks[mp_pose.PoseLandmark.RIGHT_SHOULDER.value]),(landmarks[mp_pose.PoseLandmark.LEFT_SHOULDER.value]))
-        leg_sep = distance((landmarks[mp_pose.PoseLandmark.RIGHT_ANKLE.value]),(landmarks[mp_pose.PoseLandmark.LEFT_ANKLE.value]))
-        leg = leg_d(shoulder_sep, leg_sep)
-        cv2.putText(output_image, "Leg Separation:"+" "+ str(leg), tuple(np.multiply([r1+30, r2], [1, 1]).astype(int)) ,cv2.FONT_HERSHEY_PLAIN, 2, (255, 255, 0), 2)
+    if 'bent_knees' in deductions:
+        cv2.putText(output_image, "Bent knees:"+" "+ str(deductions['bent_knees']), tuple(np.multiply([r1+30, r2-30], [1, 1]).astype(int)) ,cv2.FONT_HERSHEY_PLAIN, 2, (255, 255, 255), 2)
+    if 'leg_separation' in deductions:
+        cv2.putText(output_image, "Leg Separation:"+" "+ str(deductions['leg_separation']), tuple(np.multiply([r1+30, r2], [1, 1]).astype(int)) ,cv2.FONT_HERSHEY_PLAIN, 2, (255, 255, 0), 2)
 
     # Write the calculated 'Shoulder Angle' label on the output image
-    if (label == 'Repulsion'):
-        pos = shoulder_ang(min(left_shoulder_angle,right_shoulder_angle))
-        cv2.putText(output_image, "Shoulder angle:"+" "+ str(pos), tuple(np.multiply([r1+30, r2+30], [1, 1]).astype(int)) ,cv2.FONT_HERSHEY_PLAIN, 2, (255, 255, 255), 2)
+    if 'shoulder_angle' in deductions:
+        cv2.putText(output_image, "Shoulder angle:"+" "+ str(deductions['shoulder_angle']), tuple(np.multiply([r1+30, r2+30], [1, 1]).astype(int)) ,cv2.FONT_HERSHEY_PLAIN, 2, (255, 255, 255), 2)
 
     # Write the calculated 'Body Alignment' label on the output image
-    if (label == '2nd Flight'):
-        if (left_elbow_angle < 165 or left_elbow_angle > 195) or (right_elbow_angle < 165 or right_elbow_angle < 195):
-            cv2.putText(output_image, "Body alignment:"+" "+ str(0.1), tuple(np.multiply([r1+30, r2+30], [1, 1]).astype(int)) ,cv2.FONT_HERSHEY_PLAIN, 2, (255, 255, 255), 2)
+    if 'body_alignment' in deductions:
+        cv2.putText(output_image, "Body alignment:"+" "+ str(deductions['body_alignment']), tuple(np.multiply([r1+30, r2+30], [1, 1]).astype(int)) ,cv2.FONT_HERSHEY_PLAIN, 2, (255, 255, 255), 2)
 
     # Write the calculated 'Layout failure' label on the output image
-    if(label=='Complete' and ((left_knee_angle > 165 and left_knee_angle < 195) or (right_knee_angle > 165 and right_knee_angle < 195)) and ((left_hip_angle > 135
-    and left_hip_angle < 195) or (right_hip_angle > 135 and right_hip_angle < 195))):
-
+    if 'layout_failure' in deductions:
         cv2.putText(output_image, "Failure to maintain", (640, 90) ,cv2.FONT_HERSHEY_PLAIN, 2, (255, 255, 255), 2)
         cv2.putText(output_image, "layout(pike down):", (640, 130) ,cv2.FONT_HERSHEY_PLAIN, 2, (255, 255, 255), 2)
-        cv2.putText(output_image, str(0.1), (640, 170) ,cv2.FONT_HERSHEY_PLAIN, 2, (0, 255, 255), 2)
-    
-    # Check if the resultant image can be displayed.
-    if display:
-    
-        # Displaying the resultant image.
-        plt.figure(figsize=[10,10])
-        plt.imshow(output_image[:,:,::-1]);plt.title("Output Image");plt.axis('off');
-        
-    else:
-        
-        # Returning the output image and the classified label.
-        return prev_state, output_image, label
+        cv2.putText(output_image, str(deductions['layout_failure']), (640, 170) ,cv2.FONT_HERSHEY_PLAIN, 2, (0, 255, 255), 2)
 
-# Function for finding the centre of torso in body
+# Function for finding the centre of torso in body, for single landmarks or (N, 3) arrays of them
 def centreoftorso(landmark1, landmark2):
-    x1, y1, _ = landmark1
-    x2, y2, _ = landmark2
+    landmark1 = np.asarray(landmark1, dtype=np.float64)
+    landmark2 = np.asarray(landmark2, dtype=np.float64)
 
-    x3 = (x1+x2)/2
-    y3 = (y1+y2)/2
-    landmark9 = x3, y3, _
+    # Midpoint of x and y, the depth is kept from the second landmark.
+    landmark9 = np.concatenate(((landmark1[..., :2] + landmark2[..., :2]) / 2, landmark2[..., 2:]), axis=-1)
 
     return landmark9
 
-# Function to calculate the distance between 2 body landmark points
+# Function to calculate the distance between 2 body landmark points, for single landmarks or (N, 3) arrays of them
 def distance(landmark1, landmark2):
-    x1, y1, _ = landmark1
-    x2, y2, _ = landmark2
+    landmark1 = np.asarray(landmark1, dtype=np.float64)
+    landmark2 = np.asarray(landmark2, dtype=np.float64)
 
-    d = (abs((x1**2)-(x2**2)) + abs((y1**2)-(y2**2)))**(0.5)
+    d = np.sqrt(np.abs(np.square(landmark1[..., :2]) - np.square(landmark2[..., :2])).sum(axis=-1))
     return d
 
 # Function to calculate the deduction due to leg separation
@@ -326,24 +517,64 @@ def calculateAngle(landmark1, landmark2, landmark3):
     # Return the calculated angle.
     return angle
 
+# The (first, middle, last) landmarks of each joint angle, in the order of pose_rules.ANGLE_NAMES. The angle is
+# measured at the middle landmark.
+ANGLE_TRIPLETS = np.array([
+    (PoseLandmark.LEFT_SHOULDER.value, PoseLandmark.LEFT_ELBOW.value, PoseLandmark.LEFT_WRIST.value),
+    (PoseLandmark.RIGHT_SHOULDER.value, PoseLandmark.RIGHT_ELBOW.value, PoseLandmark.RIGHT_WRIST.value),
+    (PoseLandmark.LEFT_ELBOW.value, PoseLandmark.LEFT_SHOULDER.value, PoseLandmark.LEFT_HIP.value),
+    (PoseLandmark.RIGHT_HIP.value, PoseLandmark.RIGHT_SHOULDER.value, PoseLandmark.RIGHT_ELBOW.value),
+    (PoseLandmark.LEFT_HIP.value, PoseLandmark.LEFT_KNEE.value, PoseLandmark.LEFT_ANKLE.value),
+    (PoseLandmark.RIGHT_HIP.value, PoseLandmark.RIGHT_KNEE.value, PoseLandmark.RIGHT_ANKLE.value),
+    (PoseLandmark.LEFT_SHOULDER.value, PoseLandmark.LEFT_HIP.value, PoseLandmark.LEFT_KNEE.value),
+    (PoseLandmark.RIGHT_SHOULDER.value, PoseLandmark.RIGHT_HIP.value, PoseLandmark.RIGHT_KNEE.value),
+], dtype=np.intp)
+
+# Function calculates all the joint angles of ANGLE_TRIPLETS at once
+def calculateAngles(landmarks, triplets=ANGLE_TRIPLETS):
+    '''
+    Args:
+        landmarks: (33, 3) array of the landmarks of one frame, or (N, 33, 3) array for a whole clip.
+        triplets: (K, 3) array of the (first, middle, last) landmark indices of each angle.
+    Returns:
+        angles: (K,) array of angles in degrees for one frame, or (N, K) for a whole clip, in [0, 360).
+    '''
+    landmarks = np.asarray(landmarks, dtype=np.float64)
+
+    # Obtaining the x and y coordinates of the three landmarks of every angle.
+    first = landmarks[..., triplets[:, 0], :2]
+    middle = landmarks[..., triplets[:, 1], :2]
+    last = landmarks[..., triplets[:, 2], :2]
+
+    # Calculating the angles between the three points, the same way as calculateAngle.
+    angles = np.degrees(np.arctan2(last[..., 1] - middle[..., 1], last[..., 0] - middle[..., 0])
+                        - np.arctan2(first[..., 1] - middle[..., 1], first[..., 0] - middle[..., 0]))
+
+    # Add 360 to the angles less than zero.
+    return np.where(angles < 0, angles + 360, angles)
+
 # Function to perform pose detection on an image
-def detectPose(image, pose, display=True):
+def detectPose(image, pose, display=True, visibility=False, draw=True, rgb=None):
     '''
     Args:
         image: The input image with a gymnast whose pose landmarks are to be detected.
         pose: The pose build function needed to carry out the pose detection.
         display: If it is true, the function displays the original input image, the resultant image,
                  and the pose landmarks in 3D plot and returns nothing.
+        visibility: If it is true, the visibility of each landmark is returned as a fourth column.
+        draw: If it is false, nothing is drawn and the input image itself is returned as the output image.
+        rgb: Optional array of the shape of the image the RGB image is converted into, reused between frames.
     Returns:
         output_image: The input image with the detected pose landmarks drawn.
-        landmarks: Record of detected landmarks converted into their original scale.
+        landmarks: (33, 3) array of the detected landmarks converted into their original scale,
+                   (33, 4) with the visibility, empty when no gymnast is detected.
     '''
     
     # Create a copy of the input image.
-    output_image = image.copy()
+    output_image = image.copy() if draw else image
     
     # Convert the image from BGR into RGB format.
-    imageRGB = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    imageRGB = cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=rgb)
     
     # Do the Pose Detection.
     results = pose.process(imageRGB)
@@ -351,27 +582,33 @@ def detectPose(image, pose, display=True):
     # Obtain the height and width of the input image
     height, width, _ = image.shape
     
-    # Initialize a list to store the detected landmarks
-    landmarks = []
+    mp_pose, mp_drawing = loadMediapipe()
+
+    # Initialize an empty array for the detected landmarks
+    landmarks = np.empty((0, 4 if visibility else 3))
     
     # Check if any landmarks are detected
     if results.pose_landmarks:
     
         # Draw Pose landmarks on the output image
-        mp_drawing.draw_landmarks(image=output_image, landmark_list=results.pose_landmarks,
-                                  connections=mp_pose.POSE_CONNECTIONS)
+        if draw:
+            mp_drawing.draw_landmarks(image=output_image, landmark_list=results.pose_landmarks,
+                                      connections=mp_pose.POSE_CONNECTIONS)
         
-        # Repeating over the detected landmarks.
-        for landmark in results.pose_landmarks.landmark:
-            
-            # Append the landmark into the list.
-            landmarks.append((int(landmark.x * width), int(landmark.y * height),
-                                  (landmark.z * width)))
+        # Scale the normalized landmarks to pixels, x and y are truncated to whole pixels.
+        landmarks = np.array([(landmark.x, landmark.y, landmark.z)
+                              for landmark in results.pose_landmarks.landmark]) * (width, height, width)
+        landmarks[:, :2] = np.trunc(landmarks[:, :2])
+
+        # Append the visibility of the landmarks if requested.
+        if visibility:
+            landmarks = np.column_stack((landmarks, [landmark.visibility for landmark in results.pose_landmarks.landmark]))
     
     # Check if the original input image and the resultant image are specified to be displayed.
     if display:
     
         # Display the original input image and the resultant image.
+        import matplotlib.pyplot as plt
         plt.figure(figsize=[22,22])
         plt.subplot(121);plt.imshow(image[:,:,::-1]);plt.title("Original Image");plt.axis('off');
         plt.subplot(122);plt.imshow(output_image[:,:,::-1]);plt.title("Output Image");plt.axis('off');
@@ -385,67 +622,751 @@ def detectPose(image, pose, display=True):
         # Return the output image and the found landmarks.
         return output_image, landmarks
 
+# Function to draw landmarks that were not returned by the Pose function, like interpolated ones
+def drawLandmarks(image, landmarks):
+    '''
+    Args:
+        image: The image the landmarks are drawn on, in place.
+        landmarks: (33, 4) array of the landmarks in pixels of the image with their visibility.
+    '''
+    from mediapipe.framework.formats import landmark_pb2
+    mp_pose, mp_drawing = loadMediapipe()
+    height, width, _ = image.shape
 
-# Build Pose function for video.
-pose_video = mp_pose.Pose(static_image_mode=False, min_detection_confidence=0.5, model_complexity=1)
-
-prev_state = 0
-
-# Initialize the VideoCapture object to read from the webcam.
-video = cv2.VideoCapture("Input Videos/input.mp4")
-output_file = 'Output Videos/output_video.mp4'
-
+    # Normalize the landmarks again, the way the Pose function returns them. The pixel centres are
+    # drawn at the same pixels as the landmarks the Pose function returned.
+    landmark_list = landmark_pb2.NormalizedLandmarkList()
+    for x, y, z, visibility in landmarks:
+        landmark_list.landmark.add(x=(x + 0.5) / width, y=(y + 0.5) / height, z=z / width, visibility=visibility)
 
-fps = video.get(cv2.CAP_PROP_FPS)
-width = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
-height = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    mp_drawing.draw_landmarks(image=image, landmark_list=landmark_list, connections=mp_pose.POSE_CONNECTIONS)
 
-# Define the codec and create VideoWriter object
-fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-out = cv2.VideoWriter(output_file, fourcc, fps, (width, height))
 
-# Repeat until the video is accessed successfully.
-while video.isOpened():
-    
-    # Read a frame.
-    ok, frame = video.read()
-    
-    # Check if frame is not read properly.
-    if not ok:
-        # Break the loop.
-        break
-        
-    # Convert the image to RGB and process it with MediaPipe Pose
-    image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    results = pose.process(image)
+# Function to prepare a decoded frame for the pose detection
+def prepareFrame(frame, allocate=None):
+    '''
+    Args:
+        frame: A decoded video frame.
+        allocate: Optional function returning the array of a given shape to resize the frame into, like
+                  video_io.FramePool.acquire. The decoded frame is then flipped in place rather than copied.
+    Returns:
+        frame: The frame flipped horizontally and resized to a height of 640 pixels.
+    '''
 
     # Flip the frame horizontally for better visualization and analysis.
-    frame = cv2.flip(frame, 1)
+    frame = cv2.flip(frame, 1, dst=frame if allocate is not None else None)
 
     # Get the width and height of the frame
     frame_height, frame_width, _ = frame.shape
-    
+
     # Resize the frame while keeping the aspect ratio.
-    frame = cv2.resize(frame, (int(frame_width * (640 / frame_height)), 640))
-    
-    # Perform Pose landmark detection.
-    frame, landmarks = detectPose(frame, pose_video, display=False)
+    width, height = preparedSize(frame_width, frame_height)
+    return cv2.resize(frame, (width, height), dst=allocate((height, width, 3)) if allocate is not None else None)
 
-    # Check if the landmarks are detected.
-    if landmarks:
-        # Perform the Pose Classification.
-        prev_state, frame, pose_class = classifyPose(prev_state, landmarks, frame, display=False)
-        
-        # Draw the results on the frame
-        cv2.putText(frame, pose_class, (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2, cv2.LINE_AA)
+# Function to calculate the size of the frames returned by prepareFrame
+def preparedSize(width, height):
+    '''
+    Args:
+        width: Width of the decoded frames.
+        height: Height of the decoded frames.
+    Returns:
+        size: (width, height) of the prepared frames.
+    '''
+    return (int(width * (640 / height)) if height else 0, 640)
+
+# Function to calculate the region of a frame to look for the gymnast in
+def landmarkBox(landmarks, frame_size, padding=ROI_PADDING, min_size=ROI_MIN_SIZE):
+    '''
+    Args:
+        landmarks: (33, 3) or (33, 4) array of the landmarks in pixels of the frame.
+        frame_size: (width, height) of the frame.
+        padding: Padding added on each side of the landmarks' bounding box, as a fraction of its size.
+        min_size: Smallest width and height of the region in pixels.
+    Returns:
+        box: (x0, y0, x1, y1) pixel bounds of the padded bounding box clipped to the frame,
+             or None when nothing of it lies within the frame.
+    '''
+    width, height = frame_size
+    (x0, y0), (x1, y1) = landmarks[:, :2].min(axis=0), landmarks[:, :2].max(axis=0)
+
+    # Pad the box, and grow it evenly to the minimum size.
+    pad_x = max((x1 - x0) * padding, (min_size - (x1 - x0)) / 2)
+    pad_y = max((y1 - y0) * padding, (min_size - (y1 - y0)) / 2)
+    box = (int(max(x0 - pad_x, 0)), int(max(y0 - pad_y, 0)), int(min(x1 + pad_x, width)), int(min(y1 + pad_y, height)))
+
+    # The landmarks may all be predicted outside the frame.
+    if box[2] - box[0] < 2 or box[3] - box[1] < 2:
+        return None
+    return box
+
+
+# Pose detection in a region around the gymnast
+class ROIPoseDetector:
+    '''
+    Detects the pose in a padded crop around the landmarks of the previous frame, so the model
+    sees the gymnast at a higher resolution and fewer pixels are converted per frame. The whole
+    frame is searched when there is no previous gymnast or the crop loses them.
+    Args:
+        pose: The Pose function used on whole frames.
+        mode: Pose inference mode of the Pose function used on the crops.
+        padding: Padding around the gymnast, see landmarkBox.
+        min_size: Smallest crop size in pixels, see landmarkBox.
+        min_visibility: Average landmark visibility below which the crop has lost the gymnast.
+        draw: When false, the landmarks are not drawn on the output image, see detectPose.
+    '''
+
+    def __init__(self, pose, mode='tracking', padding=ROI_PADDING, min_size=ROI_MIN_SIZE, min_visibility=ROI_MIN_VISIBILITY,
+                 draw=True):
+        self.pose = pose
+        self.padding = padding
+        self.min_size = min_size
+        self.min_visibility = min_visibility
+        self.draw = draw
+
+        # The crops get their own graph, as the tracking between frames assumes a steady image.
+        self.roi_pose = buildPose(mode)
+        self.box = None
+
+        # Number of frames detected in a crop and in the whole frame
+        self.roi_frames = 0
+        self.full_frames = 0
+
+    def reset(self):
+        '''
+        Forgets the gymnast of the previous frame, before a new video.
+        '''
+        self.roi_pose.reset()
+        self.box = None
+        self.roi_frames = 0
+        self.full_frames = 0
+
+    def close(self):
+        '''
+        Releases the Pose function used on the crops.
+        '''
+        if self.roi_pose is not None:
+            self.roi_pose.close()
+            self.roi_pose = None
+
+    def detect(self, image):
+        '''
+        Args:
+            image: The flipped and resized frame with a prominent person whose pose landmarks needs to be detected.
+        Returns:
+            output_image: The frame with the detected pose landmarks drawn.
+            landmarks: (33, 4) array of the landmarks in pixels of the frame with their visibility,
+                       or an empty array when no gymnast was found.
+        '''
+        height, width, _ = image.shape
+
+        if self.box is not None:
+            x0, y0, x1, y1 = self.box
+            crop_image, landmarks = detectPose(image[y0:y1, x0:x1], self.roi_pose, display=False, visibility=True,
+                                               draw=self.draw)
+
+            # Keep following the gymnast while the crop still shows them clearly.
+            if len(landmarks) and landmarks[:, 3].mean() >= self.min_visibility:
+                output_image = image
+                if self.draw:
+                    output_image = image.copy()
+                    output_image[y0:y1, x0:x1] = crop_image
+
+                # Move the landmarks from crop to frame pixels. z is scaled like x, which is unchanged by the move.
+                landmarks[:, :2] += (x0, y0)
+                self.box = landmarkBox(landmarks, (width, height), self.padding, self.min_size)
+                self.roi_frames += 1
+                return output_image, landmarks
+
+            # The gymnast was lost, start tracking from scratch once they are found again.
+            self.roi_pose.reset()
+
+        # Search the whole frame.
+        output_image, landmarks = detectPose(image, self.pose, display=False, visibility=True, draw=self.draw)
+        self.box = landmarkBox(landmarks, (width, height), self.padding, self.min_size) if len(landmarks) else None
+        self.full_frames += 1
+        return output_image, landmarks
+
+
+# Function to measure how far the gymnast moved between two frames
+def landmarkMotion(landmarks1, landmarks2):
+    '''
+    Args:
+        landmarks1: (33, 3) or (33, 4) array of the landmarks of the first frame.
+        landmarks2: (33, 3) or (33, 4) array of the landmarks of the second frame.
+    Returns:
+        motion: Largest distance a landmark moved, in torso lengths of the first frame.
+    '''
+    shoulders = centreoftorso(landmarks1[PoseLandmark.LEFT_SHOULDER.value],
+                              landmarks1[PoseLandmark.RIGHT_SHOULDER.value])
+    hips = centreoftorso(landmarks1[PoseLandmark.LEFT_HIP.value], landmarks1[PoseLandmark.RIGHT_HIP.value])
+
+    # Euclidean distances in the image, distance() measures differences of squares for the deductions.
+    torso = max(np.linalg.norm(shoulders[:2] - hips[:2]), 1.0)
+    motion = np.linalg.norm(landmarks1[..., :2] - landmarks2[..., :2], axis=-1)
+    return float(motion.max() / torso)
+
+
+# Adaptive frame sampling
+class AdaptiveSampler:
+    '''
+    Runs the pose detection on every frame while the vault is in progress, but only on every
+    interval-th frame in the phases where the state machine cannot change much: the run-up and
+    the end of the vault (SAMPLED_STATES). The landmarks of the frames in between are
+    interpolated for the overlay. The skipped frames are still inferred, in order, when the
+    sampled frame would advance the state machine, when the gymnast moved faster than
+    SAMPLE_MAX_MOTION, or when the sampled frame has no gymnast, and the result of the sampled frame
+    is kept, so no frame is inferred twice. The tracking of detect then sees the sampled frame before
+    the frames it skipped. Frames are not skipped while there is no gymnast.
+    A pose held only between two sampled frames, while the gymnast barely moves, can still be missed.
+    Args:
+        detect: Function returning (output_image, landmarks) for a frame, with (33, 4) landmarks
+                including the visibility or an empty array.
+        interval: Frames per inferred frame in the sampled phases, 1 infers every frame.
+        max_motion: Largest movement in torso lengths per frame for which frames are interpolated.
+        draw: When false, the interpolated landmarks are not drawn on the skipped frames.
+    '''
+
+    def __init__(self, detect, interval=1, max_motion=SAMPLE_MAX_MOTION, draw=True):
+        self.detect = detect
+        self.interval = interval
+        self.max_motion = max_motion
+        self.draw = draw
+
+        # Number of frames inferred and interpolated
+        self.inferred = 0
+        self.interpolated = 0
+
+    def _infer(self, frame):
+        self.inferred += 1
+        return self.detect(frame)
+
+    def run(self, frames, sampled, advances):
+        '''
+        Args:
+            frames: Iterable of the flipped and resized frames.
+            sampled: Function returning True while the current phase allows skipping frames.
+            advances: Function returning True when the landmarks of a frame would advance the state machine.
+        Yields:
+            (output_image, landmarks): For every frame in order, as returned by detect.
+        '''
+        previous = None
+        skipped = []
+        frames = iter(frames)
+        for frame in frames:
+
+            # Infer the first frame, the frames without a gymnast and every frame outside of the sampled phases.
+            if self.interval <= 1 or previous is None or not (skipped or (len(previous) and sampled())):
+                output_image, previous = self._infer(frame)
+                yield output_image, previous
+                continue
+
+            # Hold the frames back until the next sampled frame.
+            if len(skipped) < self.interval - 1:
+                skipped.append(frame)
+                continue
+
+            previous = yield from self._sample(previous, skipped, frame, advances)
+            skipped = []
+
+        # The last held back frame is sampled at the end of the video.
+        if skipped:
+            yield from self._sample(previous, skipped[:-1], skipped[-1], advances)
+
+    def _sample(self, previous, skipped, frame, advances):
+        # Yields the results of the skipped frames and of the sampled frame, and returns the landmarks of the latter.
+        output_image, landmarks = self._infer(frame)
+
+        # Interpolate the skipped frames while the gymnast moves slowly and nothing happens.
+        if (len(previous) and len(landmarks) and not advances(landmarks)
+                and landmarkMotion(previous, landmarks) <= self.max_motion * (len(skipped) + 1)):
+            weights = np.arange(1, len(skipped) + 1) / (len(skipped) + 1)
+            for skipped_frame, weight in zip(skipped, weights):
+                interpolated = previous + (landmarks - previous) * weight
+                interpolated[:, :2] = np.trunc(interpolated[:, :2])
+                if self.draw:
+                    drawLandmarks(skipped_frame, interpolated)
+                self.interpolated += 1
+                yield skipped_frame, interpolated
+            yield output_image, landmarks
+            return landmarks
+
+        # Otherwise infer the skipped frames after all, in order, and keep the result of the sampled frame.
+        for skipped_frame in skipped:
+            yield self._infer(skipped_frame)
+        yield output_image, landmarks
+        return landmarks
+
+
+# Function to find the frames from the Jump to the Complete pose with a quick pass over a video
+def findVaultWindow(input_path, pose, interval=SEGMENT_INTERVAL, height=SEGMENT_HEIGHT, padding=SEGMENT_PADDING,
+                    rules=None):
+    '''
+    Args:
+        input_path: Path of the video with the gymnast to be analysed. It is read once more by the
+                    analysis, so it cannot be a pipe.
+        pose: The Pose function of the quick pass, usually built for SEGMENT_MODE.
+        interval: Only every interval-th frame is inferred.
+        height: Height the inferred frames are resized to. The joint angles do not depend on it.
+        padding: Seconds added before the Jump and after the Complete pose.
+        rules: The PoseRules the poses are matched with, the default rule table when None.
+    Returns:
+        window: (first, last) indices of the frames to analyse, with last None when the vault was
+                not completed before the end of the video, or None when no Jump was found.
+    '''
+    pose.reset()
+
+    video = cv2.VideoCapture(input_path)
+    if not video.isOpened():
+        raise IOError(f"Could not open video '{input_path}'")
+    fps = video.get(cv2.CAP_PROP_FPS) or 30
+
+    prev_state = 0
+    jump = complete = None
+    index = 0
+    decoded = None
+    try:
+        while True:
+
+            # The frames in between are only grabbed, which skips converting them into images.
+            if index % interval:
+                if not video.grab():
+                    break
+                index += 1
+                continue
+
+            # Every frame is decoded into the same array.
+            ok, decoded = video.read(decoded)
+            if not ok:
+                break
+            frame_height, frame_width, _ = decoded.shape
+            frame = cv2.resize(cv2.flip(decoded, 1, dst=decoded), (int(frame_width * (height / frame_height)), height))
+
+            # Follow the state machine over the inferred frames.
+            _, landmarks = detectPose(frame, pose, display=False)
+            if len(landmarks):
+                prev_state, _ = classifyState(prev_state, calculateAngles(landmarks), rules=rules)
+                if prev_state >= 1 and jump is None:
+                    jump = index
+                if prev_state == 5:
+                    complete = index
+                    break
+            index += 1
+    finally:
+        video.release()
+
+    if jump is None:
+        return None
+
+    # The Jump may have started right after the previously inferred frame.
+    pad = int(round(padding * fps))
+    first = max(jump - interval + 1 - pad, 0)
+    last = complete + pad if complete is not None else None
+    return first, last
+
+
+# Reusable vault analysis engine
+class VaultAnalyzer:
+    '''
+    Loads the Pose model once and analyses any number of videos with it. Frames are decoded
+    and encoded on their own threads while the pose inference runs.
+    Args:
+        mode: Pose inference mode, one of the keys of POSE_MODES.
+        queue_size: Maximum number of frames waiting between the decode, inference and encode stages.
+        encoder: Output video encoder, one of ENCODERS. Use one of the ffmpeg encoders when the output path is a pipe.
+        roi: When true, the pose is detected in a crop around the gymnast, see ROIPoseDetector.
+        sample_interval: Frames per inferred frame in the run-up and after the vault, see AdaptiveSampler.
+        segment: When set, a quick first pass finds the vault (see findVaultWindow) and only that window
+                 is analysed. One of SEGMENT_OUTPUTS, to write only the window ('trim') or the whole
+                 video ('overlay').
+        encoding: Optional dict of settings of the ffmpeg encoders, with keys of ENCODING_OPTIONS, like
+                  {'height': 480, 'crf': 26}.
+        render: When false, nothing is drawn and no output video is encoded. The analysis then only
+                produces the annotations and the landmark track, for the app to draw over the original video.
+        smoothing: When true, the landmarks are smoothed over time before they are classified (see
+                   smoothing.LandmarkSmoother) and the phase transitions need the next pose in several
+                   frames (see TransitionHysteresis), so jitter neither skips nor fakes a transition.
+        rules: Path of a .json or .yaml pose rule table (see pose_rules.PoseRules), to tune the poses
+               without changing the code. The default table pose_rules.json when None.
+        frame_memory: Optional bytes of memory of the frames held by the analysis at a time. The frames
+                      are kept in buffers allocated once (see video_io.FramePool), by default as many as
+                      the queues and the sampler can hold, and fewer within the budget.
+    '''
+
+    def __init__(self, mode='tracking', queue_size=8, encoder='opencv', roi=False, sample_interval=1, segment=None,
+                 encoding=None, render=True, smoothing=False, rules=None, frame_memory=None):
+        checkSettings(encoder, segment, encoding)
+        self.mode = mode
+        self.queue_size = queue_size
+        self.encoder = encoder
+        self.roi = roi
+        self.sample_interval = sample_interval
+        self.segment = segment
+        self.encoding = encoding
+        self.render = render
+        self.smoothing = smoothing
+        self.rules_path = rules
+
+        # The pose rules are compiled once, an invalid table fails here rather than in the middle of a video.
+        self.rules = loadPoseRules(rules) if rules else defaultPoseRules()
+
+        self.frame_memory = frame_memory
+
+        # The frames of every video are prepared, drawn on and encoded in the same buffers. The decoder,
+        # the sampler and the encoder each need frames in flight, below that the analysis would stall.
+        self.frame_pool = FramePool(2 * queue_size + sample_interval + 3, min_count=sample_interval + 3,
+                                    max_bytes=frame_memory)
+        self.rgb_buffer = None
+
+        # Build the single Pose function used for every frame of every video.
+        self.pose = buildPose(mode)
+
+        # In ROI mode the Pose function only searches whole frames when the gymnast is lost.
+        self.roi_detector = ROIPoseDetector(self.pose, mode, draw=False) if roi else None
+
+        # The first pass of the two-pass analysis has a Pose function of its own.
+        self.segment_pose = buildPose(SEGMENT_MODE) if segment is not None else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def settings(self):
+        '''
+        Returns:
+            settings: Dict of the analyzer version and settings, see analyzerSettings.
+        '''
+        return analyzerSettings(self.mode, self.encoder, self.roi, self.sample_interval, self.segment, self.encoding,
+                                self.render, self.smoothing, self.rules_path)
+
+    def close(self):
+        '''
+        Releases the Pose model.
+        '''
+        if self.segment_pose is not None:
+            self.segment_pose.close()
+            self.segment_pose = None
+        if self.roi_detector is not None:
+            self.roi_detector.close()
+            self.roi_detector = None
+        if self.pose is not None:
+            self.pose.close()
+            self.pose = None
+
+    def detect(self, frame):
+        '''
+        Args:
+            frame: A frame prepared by prepareFrame.
+        Returns:
+            frame: The frame itself, nothing is drawn on it.
+            landmarks: (33, 4) array of the detected landmarks with their visibility, empty without a gymnast.
+        '''
+        if self.roi_detector is not None:
+            return self.roi_detector.detect(frame)
+        if self.rgb_buffer is None or self.rgb_buffer.shape != frame.shape:
+            self.rgb_buffer = np.empty_like(frame)
+        return detectPose(frame, self.pose, display=False, visibility=True, draw=False, rgb=self.rgb_buffer)
+
+    def analyze(self, input_path, output_path, progress=None, track_path=None, annotations_path=None):
+        '''
+        Args:
+            input_path: Path of the video with the gymnast to be analysed.
+            output_path: Path where the annotated video is written, unused when the analyzer does not render.
+            progress: Optional function called as progress(frames_done, frames_total) every
+                      PROGRESS_INTERVAL frames and once at the end.
+            track_path: Optional path of a .npz file the landmarks of every frame are saved to,
+                        see landmark_tracks.py.
+            annotations_path: Optional path of a .json or .json.gz file the label, landmarks and deductions
+                              of every frame are saved to, see annotations.py.
+        Returns:
+            stats: Number of frames processed, elapsed seconds, frames per second, number of
+                   frames the pose detection ran on, the analysed window of a two-pass analysis,
+                   the 'frame_timings' histogram snapshot of the seconds per frame of each stage and
+                   the score 'report' of the attempt, see scoring.PhaseScorer.
+        '''
+        start_time = time()
+
+        # Find the vault with a quick first pass, the whole video is analysed when it is not found.
+        window = None
+        if self.segment is not None:
+            window = findVaultWindow(input_path, self.segment_pose, rules=self.rules)
+
+        # Restart the graph so no tracking state leaks from the previous video.
+        self.pose.reset()
+        if self.roi_detector is not None:
+            self.roi_detector.reset()
+
+        prev_state = 0
+        frames = 0
+
+        # Initialize the VideoCapture object to read from the video file.
+        video = cv2.VideoCapture(input_path)
+        if not video.isOpened():
+            raise IOError(f"Could not open video '{input_path}'")
+
+        fps = video.get(cv2.CAP_PROP_FPS)
+        width = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        frames_total = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+
+        # Frames decoded before the window, and the number of frames in it.
+        first, length = 0, None
+        skipped = 0
+        if window is not None:
+            first, last = window
+            length = None if last is None else last - first + 1
+            skipped = first
+
+            # A trimmed video starts at the window, the frames before it are not even decoded if possible.
+            if self.segment == 'trim':
+                if video.set(cv2.CAP_PROP_POS_FRAMES, first):
+                    skipped = 0
+                frames_total = min(frames_total - first, length or frames_total)
+
+        # Create the writer of the output video. It is opened on the first frame and sized to it,
+        # as the frames are resized by prepareFrame and may be rotated by the decoder.
+        out = writer = None
+        if self.render:
+            out = SizedWriter(lambda frame_size: openWriter(output_path, fps, frame_size, self.encoder, self.encoding),
+                              preparedSize(width, height))
+
+        # Smooth the landmarks and hold back the phase transitions until they are seen in several frames.
+        smoother = hysteresis = None
+        if self.smoothing:
+            smoother = LandmarkSmoother(SMOOTHING_MIN_CUTOFF, SMOOTHING_BETA, SMOOTHING_D_CUTOFF)
+            hysteresis = TransitionHysteresis(TRANSITION_FRAMES, TRANSITION_WINDOW)
+
+        # Collect the landmarks of every frame if a track file is requested.
+        track = None
+        if track_path is not None:
+            track = LandmarkTrackWriter(track_path, fps, preparedSize(width, height),
+                                        transition=(TRANSITION_FRAMES, TRANSITION_WINDOW) if self.smoothing else None)
+
+        # Collect what is drawn on every frame if an annotations file is requested.
+        annotations = None
+        if annotations_path is not None:
+            annotations = AnnotationWriter(annotations_path, fps, preparedSize(width, height), (width, height),
+                                           loadMediapipe()[0].POSE_CONNECTIONS)
+
+        # The deductions are aggregated per phase as the frames are classified.
+        scorer = PhaseScorer(fps)
+
+        # Decode and encode on their own threads, the queues between them keep the frame order. The frames
+        # are buffers of the pool, given back once encoded, or once analysed when nothing is encoded.
+        pool = self.frame_pool
+        pool.reset()
+        reader = FrameReader(video, preprocess=prepareFrame, max_queued=self.queue_size, pool=pool)
+        if out is not None:
+            writer = FrameWriter(out, max_queued=self.queue_size, release=pool.release)
+
+        # The time spent on each frame is aggregated per stage, rather than logged per frame.
+        frame_timings = Histogram('vault_frame_stage_seconds', buckets=FRAME_BUCKETS)
+
+        # Perform Pose landmark detection. This is the only inference run on the frame. Nothing is drawn
+        # yet, the landmarks are drawn on the frame itself once it is classified.
+        def detect(frame):
+            with timed(frame_timings, stage='inference'):
+                return self.detect(frame)
+
+        # Frames are only skipped in the run-up and after the vault, where the state machine cannot
+        # advance without the sampler noticing.
+        def sampled():
+            return prev_state in SAMPLED_STATES
+
+        def advances(landmarks):
+            return candidateState(calculateAngles(landmarks[:, :3]), self.rules) == prev_state + 1
+
+        sampler = AdaptiveSampler(detect, self.sample_interval, draw=False)
+
+        # Queue a frame for the output video and report the progress every few frames.
+        def write(frame):
+            nonlocal frames
+            if writer is not None:
+                with timed(frame_timings, stage='encode'):
+                    writer.write(frame)
+            else:
+                pool.release(frame)
+            frames += 1
+            if progress is not None and frames % PROGRESS_INTERVAL == 0:
+                progress(frames, max(frames, frames_total))
+
+        completed = False
+        try:
+            # Frames outside of the window are written as they are, or left out of a trimmed video.
+            decoded = timed_iter(reader, frame_timings, stage='decode')
+            for frame in islice(decoded, skipped):
+                if self.segment == 'overlay':
+                    write(frame)
+                else:
+                    pool.release(frame)
+
+            # Repeat for every decoded, flipped and resized frame, with its detected or interpolated landmarks.
+            for analysed, (frame, landmarks) in enumerate(sampler.run(islice(decoded, length), sampled, advances)):
+
+                # Draw the detected or interpolated landmarks on the frame.
+                if self.render and len(landmarks):
+                    with timed(frame_timings, stage='overlay'):
+                        drawLandmarks(frame, landmarks)
+
+                # Smooth the landmarks over time, the drawing on the frame keeps the detected ones.
+                if smoother is not None:
+                    landmarks = smoother(landmarks, (first + analysed) / (fps or 30))
+
+                # Record the landmarks of the frame in the track.
+                if track is not None:
+                    track.append(first + analysed, landmarks)
+
+                # Check if the landmarks are detected.
+                label = deductions = None
+                if len(landmarks):
+                    with timed(frame_timings, stage='classify'):
+                        # Perform the Pose Classification, like classifyPose.
+                        angles = calculateAngles(landmarks[:, :3])
+                        prev_state, label = classifyState(prev_state, angles, hysteresis, self.rules)
+                        deductions = poseDeductions(label, landmarks[:, :3], angles)
+                        scorer.add(first + analysed, label, deductions)
+
+                        # Draw the results on the frame
+                        if self.render:
+                            drawPoseLabels(frame, landmarks[:, :3], label, deductions)
+                            cv2.putText(frame, label, (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2, cv2.LINE_AA)
+
+                # Record what is drawn on the frame in the annotations.
+                if annotations is not None:
+                    annotations.append(first + analysed, landmarks, label, deductions)
+
+                write(frame)
+
+            if self.segment == 'overlay':
+                for frame in decoded:
+                    write(frame)
+            completed = True
+        finally:
+            reader.close()
+            try:
+                if writer is not None:
+                    writer.close()
+            finally:
+                # Release the VideoWriter and VideoCapture objects, also when the analysis failed.
+                if out is not None:
+                    out.release(completed)
+                video.release()
+
+        elapsed = time() - start_time
+
+        # Save the landmark track and the annotations.
+        if track is not None:
+            track.close()
+        if annotations is not None:
+            annotations.close()
+
+        if progress is not None:
+            progress(frames, frames)
+
+        return {'frames': frames, 'seconds': elapsed, 'fps': frames / elapsed if elapsed > 0 else 0.0,
+                'inferred': sampler.inferred, 'window': window, 'frame_timings': frame_timings.snapshot(),
+                'report': scorer.report()}
+
+
+# Function to run the vault analysis over a single video
+def processVideo(input_file, output_file, mode='tracking', track_path=None, encoder='opencv', roi=False,
+                 sample_interval=1, segment=None, encoding=None, render=True, annotations_path=None, smoothing=False,
+                 rules=None, frame_memory=None):
+    '''
+    Args:
+        input_file: Path of the video with the gymnast to be analysed.
+        output_file: Path where the annotated video is written.
+        mode: Pose inference mode, one of the keys of POSE_MODES.
+        track_path: Optional path of a .npz file the landmark track is saved to.
+        encoder: Output video encoder, one of ENCODERS.
+        roi: When true, the pose is detected in a crop around the gymnast.
+        sample_interval: Frames per inferred frame in the run-up and after the vault.
+        segment: Output of the two-pass analysis, one of SEGMENT_OUTPUTS, or None to analyse every frame.
+        encoding: Optional dict of ffmpeg encoder settings, with keys of ENCODING_OPTIONS.
+        render: When false, no output video is written, only the track and the annotations.
+        annotations_path: Optional path of a .json or .json.gz file the per-frame annotations are saved to.
+        smoothing: When true, the landmarks are smoothed and the phase transitions need several frames.
+        rules: Path of the pose rule table, the default one when None.
+        frame_memory: Optional bytes of memory of the frames held at a time, see VaultAnalyzer.
+    Returns:
+        stats: Number of frames processed, elapsed seconds, frames per second, frames inferred and analysed window.
+    '''
+    with VaultAnalyzer(mode, encoder=encoder, roi=roi, sample_interval=sample_interval, segment=segment,
+                       encoding=encoding, render=render, smoothing=smoothing, rules=rules,
+                       frame_memory=frame_memory) as analyzer:
+        return analyzer.analyze(input_file, output_file, track_path=track_path, annotations_path=annotations_path)
+
+
+# Function to add the command line options of the ffmpeg encoders
+def addEncodingArguments(parser):
+    '''
+    Args:
+        parser: The argparse.ArgumentParser the options are added to.
+    '''
+    parser.add_argument('--output-height', type=int, default=None,
+                        help='scale the output video down to this height (ffmpeg encoders)')
+    parser.add_argument('--crf', type=int, default=None, help='constant rate factor of the h264 and h265 encoders')
+    parser.add_argument('--bitrate', default=None, help="target bitrate like '2M', instead of the rate factor")
+    parser.add_argument('--preset', default=None, help="speed preset of the h264 and h265 encoders, like 'veryfast'")
+    parser.add_argument('--no-faststart', action='store_true', help='leave the index at the end of the output file')
+
+
+# Function to collect the encoding settings given on the command line
+def encodingFromArguments(args):
+    '''
+    Args:
+        args: Arguments parsed by a parser with the options of addEncodingArguments.
+    Returns:
+        encoding: Dict of the given encoding settings, or None when none was given.
+    '''
+    encoding = {'height': args.output_height, 'crf': args.crf, 'bitrate': args.bitrate, 'preset': args.preset,
+                'faststart': False if args.no_faststart else None}
+    return {name: value for name, value in encoding.items() if value is not None} or None
+
+
+# Command line entry point
+def main(argv=None):
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(description='Analyse a vault video and write the annotated output video.')
+    parser.add_argument('input_path', nargs='?', default='Input Videos/input.mp4')
+    parser.add_argument('output_path', nargs='?', default='Output Videos/output_video.mp4',
+                        help='output video file, or a folder to write output_video.mp4 into')
+    parser.add_argument('--mode', choices=sorted(POSE_MODES), default='tracking')
+    parser.add_argument('--track', default=None, help='also save the landmark track to this .npz file')
+    parser.add_argument('--annotations', default=None,
+                        help='also save the per-frame annotations to this .json or .json.gz file')
+    parser.add_argument('--no-render', action='store_true',
+                        help='do not draw and encode an output video, only save the track and annotations')
+    parser.add_argument('--smooth', action='store_true',
+                        help='smooth the landmarks over time and confirm phase transitions over several frames')
+    parser.add_argument('--rules', default=None, help='.json or .yaml pose rule table, see pose_rules.json')
+    parser.add_argument('--frame-memory', type=int, default=None, help='MB of memory for the frames held at a time')
+    parser.add_argument('--encoder', choices=ENCODERS, default='opencv')
+    parser.add_argument('--roi', action='store_true', help='detect the pose in a crop around the gymnast')
+    parser.add_argument('--sample-interval', type=int, default=1,
+                        help='infer only every Nth frame in the run-up and after the vault')
+    parser.add_argument('--segment', choices=SEGMENT_OUTPUTS, default=None,
+                        help='find the vault with a quick first pass and only analyse it')
+    addEncodingArguments(parser)
+    args = parser.parse_args(argv)
 
-    # Write the frame to the output video
-    out.write(frame)
+    # Keep accepting an output folder, as the old subprocess call passed one.
+    output_path = args.output_path
+    if os.path.isdir(output_path):
+        output_path = os.path.join(output_path, 'output_video.mp4')
 
-# Release the VideoWriter and VideoCapture objects.
-out.release()
-video.release()
+    stats = processVideo(args.input_path, output_path, mode=args.mode, track_path=args.track, encoder=args.encoder,
+                         roi=args.roi, sample_interval=args.sample_interval, segment=args.segment,
+                         encoding=encodingFromArguments(args), render=not args.no_render,
+                         annotations_path=args.annotations, smoothing=args.smooth, rules=args.rules,
+                         frame_memory=args.frame_memory * 2 ** 20 if args.frame_memory else None)
+    print(f"Processed {stats['frames']} frames in {stats['seconds']:.2f} seconds ({stats['fps']:.2f} fps), "
+          f"{stats['inferred']} frames inferred.")
+    print(f"Score {stats['report']['score']:.2f} after {stats['report']['total_deduction']:.2f} of deductions.")
 
-# Close any remaining windows.
-cv2.destroyAllWindows()
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+# Per-frame annotation files, for the app to draw the analysis over the original video
+import gzip
+import json
+import numpy as np
+
+from landmark_tracks import summarizePhases
+
+# Version of the annotation file format
+ANNOTATIONS_VERSION = 1
+
+# Decimals the normalized landmark coordinates and visibilities are rounded to, 0.001 is about a pixel at 1080p
+LANDMARK_DECIMALS = 3
+
+
+class AnnotationWriter:
+    '''
+    Collects the phase label, landmarks and deductions of every analysed frame and saves them as a JSON
+    file, gzipped when the path ends in '.gz'. The file holds the 'fps', the 'width' and 'height' of the
+    original video, the pose 'connections' to draw between the landmarks, the 'phases' with their largest
+    deductions (see landmark_tracks.summarizePhases) and the 'frames'. Each frame has its 'frame' index,
+    'timestamp' in seconds, 'label', and, when a gymnast was detected, its 'landmarks' as [x, y, visibility]
+    with x and y normalized to the original, unflipped video, and its 'deductions'.
+    Args:
+        path: Path of the .json or .json.gz file to write.
+        fps: Frame rate of the video, used for the timestamps.
+        frame_size: (width, height) of the analysed frames the landmarks are in.
+        source_size: (width, height) of the original video.
+        connections: Pairs of landmark indices connected in the drawing of the pose.
+        flipped: Whether the analysed frames were flipped horizontally, see Vault_Gymnast.prepareFrame.
+        capacity: Initial number of frames with landmarks to allocate room for.
+    '''
+
+    def __init__(self, path, fps, frame_size, source_size, connections=(), flipped=True, capacity=1024):
+        self.path = path
+        self.fps = fps
+        self.frame_size = frame_size
+        self.source_size = source_size
+        self.connections = sorted(sorted(connection) for connection in connections)
+        self.flipped = flipped
+        self.frames = []
+
+        # The landmarks are kept in one array until the file is written, rather than as lists of floats
+        # per frame, which take several times the memory over a long video.
+        self.count = 0
+        self.points = np.empty((capacity, 33, 3))
+
+    def append(self, frame_index, landmarks, label=None, deductions=None):
+        '''
+        Args:
+            frame_index: Index of the frame in the video.
+            landmarks: (33, 4) array of the landmarks in pixels of the analysed frame with their visibility,
+                       or an empty array when none were detected.
+            label: Classified pose label of the frame.
+            deductions: Dict of the deductions of the pose, as returned by Vault_Gymnast.poseDeductions.
+        '''
+        frame = {'frame': int(frame_index), 'timestamp': frame_index / self.fps if self.fps else 0.0,
+                 'label': label.strip() if label else None}
+
+        if len(landmarks):
+            # Double the buffer when it is full.
+            if self.count == len(self.points):
+                self.points = np.resize(self.points, (2 * len(self.points), 33, 3))
+
+            width, height = self.frame_size
+            x = landmarks[:, 0] / width
+            self.points[self.count] = np.column_stack((1 - x if self.flipped else x, landmarks[:, 1] / height,
+                                                       landmarks[:, 3]))
+
+            # The frame holds the row of its landmarks until they are written.
+            frame['landmarks'] = self.count
+            frame['deductions'] = deductions or {}
+            self.count += 1
+        self.frames.append(frame)
+
+    def close(self):
+        '''
+        Writes the annotation file.
+        '''
+        # The phases are summarised over the frames the gymnast was classified in.
+        phases = summarizePhases([{**frame, 'label': frame['label'] or ''} for frame in self.frames
+                                  if 'landmarks' in frame])
+        width, height = self.source_size
+        header = {'version': ANNOTATIONS_VERSION, 'fps': self.fps, 'width': width, 'height': height,
+                  'connections': self.connections, 'phases': phases}
+        points = np.round(self.points[:self.count], LANDMARK_DECIMALS)
+
+        # The frames are written one by one, the whole document is never held in memory.
+        with (gzip.open(self.path, 'wt') if self.path.endswith('.gz') else open(self.path, 'w')) as f:
+            f.write(json.dumps(header, separators=(',', ':'))[:-1] + ',"frames":[')
+            for index, frame in enumerate(self.frames):
+                if 'landmarks' in frame:
+                    frame = dict(frame, landmarks=points[frame['landmarks']].tolist())
+                f.write((',' if index else '') + json.dumps(frame, separators=(',', ':')))
+            f.write(']}')
+
+
+# Function to load an annotation file
+def loadAnnotations(path):
+    '''
+    Args:
+        path: Path of the .json or .json.gz file written by AnnotationWriter.
+    Returns:
+        annotations: The annotations as a dict.
+    '''
+    with (gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')) as f:
+        return json.load(f)
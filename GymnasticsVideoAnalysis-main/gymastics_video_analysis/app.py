@@ -1,23 +1,37 @@
+import time
+
+# The startup of the service is timed from here, see vault_startup_seconds
+startup_started = time.perf_counter()
+
 import os
+import shutil
+import tempfile
 import urllib.parse
-import firebase_admin
-from firebase_admin import credentials, storage, firestore
-import sys
-import time
-import subprocess
+import uuid
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from google.api_core.exceptions import NotFound
 import datetime
+from contextlib import contextmanager
 from flask import Flask, request, jsonify
 from flask_sslify import SSLify
+from Vault_Gymnast import VaultAnalyzer, analyzerSettings
+from batch import BatchAnalyzer
+from jobs import FairScheduler, JobQueue, JobWorkers, VideoProgress
+from result_cache import ResultCache, cache_key
+from streaming_io import isFastStart, makePipe, streamBlobs
+from metrics import FPS_BUCKETS, FRAME_BUCKETS, MetricsRegistry, timed
+from firebase_clients import BatchedWrites, configure_firebase, get_bucket, get_db
 
 # Set the path for the gymnastics_analysis folder on the desktop
 gymnastics_analysis_folder = os.path.join(os.path.expanduser("~"), "Desktop", "gymnastics_analysis")
 
-# Set the path for the input videos folder within gymnastics_analysis
-input_folder = os.path.join(gymnastics_analysis_folder, "Input Videos")
+# Set the path for the scratch folder within gymnastics_analysis, holding one directory per video being processed
+scratch_folder = os.environ.get('SCRATCH_DIR') or os.path.join(gymnastics_analysis_folder, "scratch")
 
-# Set the path for the output videos folder within gymnastics_analysis
-output_folder = os.path.join(gymnastics_analysis_folder, "Output Videos")
+# Scratch directories older than this many seconds are left over from a crashed process, and removed on startup
+stale_scratch_age = 24 * 60 * 60
 
 # Set the path to the service account key JSON file within gymnastics_analysis
 service_account_key_path = os.path.join(gymnastics_analysis_folder, "gymnastics-analysis-543bc-firebase-adminsdk-bogtx-aa762a6ac2.json")
@@ -28,9 +42,109 @@ ssl_key = os.path.join(gymnastics_analysis_folder, "private.key")
 # Set the path for the certificate.crt file within gymnastics_analysis
 ssl_cert = os.path.join(gymnastics_analysis_folder, "certificate.crt")
 
-# Initialize Firebase
-cred = credentials.Certificate(service_account_key_path)
-firebase_admin.initialize_app(cred, {
+# Number of videos analysed in parallel, one worker process each
+analysis_workers = int(os.environ.get('ANALYSIS_WORKERS', os.cpu_count() or 1))
+
+# Pose inference mode of the analysis, one of the keys of Vault_Gymnast.POSE_MODES: 'tracking', 'accurate' or 'lite'
+analysis_mode = os.environ.get('ANALYSIS_MODE', 'tracking')
+
+# Detect the pose in a crop around the gymnast, falling back to the whole frame when they are lost
+analysis_roi = os.environ.get('ANALYSIS_ROI', '0') == '1'
+
+# Infer only every Nth frame in the run-up and after the vault, 1 infers every frame
+analysis_sample_interval = int(os.environ.get('ANALYSIS_SAMPLE_INTERVAL', 1))
+
+# Find the vault with a quick first pass and analyse only it: 'trim' uploads just the vault,
+# 'overlay' the whole video with the analysis drawn on the vault. Empty analyses every frame.
+analysis_segment = os.environ.get('ANALYSIS_SEGMENT') or None
+
+# Stream videos from and to Firebase Storage instead of staging whole files.
+# The output is then encoded with ffmpeg, as a fragmented MP4 can be uploaded while it is written.
+streaming_io = os.environ.get('STREAMING_IO', '0') == '1'
+
+# Output video encoder, one of Vault_Gymnast.ENCODERS. 'h264' and 'h265' give several times smaller videos,
+# which upload faster and play on the phones.
+analysis_encoder = os.environ.get('ANALYSIS_ENCODER') or ('ffmpeg' if streaming_io else 'opencv')
+
+# Output height, constant rate factor, bitrate and speed preset of the ffmpeg encoders. Unset ones keep
+# the defaults of the encoder.
+analysis_encoding = {name: convert(os.environ[variable]) for name, variable, convert in (
+    ('height', 'ANALYSIS_OUTPUT_HEIGHT', int), ('crf', 'ANALYSIS_CRF', int),
+    ('bitrate', 'ANALYSIS_BITRATE', str), ('preset', 'ANALYSIS_PRESET', str)) if os.environ.get(variable)} or None
+
+# Draw the analysis on an output video. With 0 no video is encoded, the app draws the uploaded
+# annotations over the original video instead.
+analysis_render = os.environ.get('ANALYSIS_RENDER', '1') == '1'
+
+# Smooth the landmarks over time and confirm the phase transitions over several frames, against the
+# jitter of the lighter pose models
+analysis_smoothing = os.environ.get('ANALYSIS_SMOOTHING', '0') == '1'
+
+# Pose rule table (.json or .yaml) the phases are classified with, to tune the thresholds without a deploy.
+# It is read when the analysis workers start.
+# Empty uses the default pose_rules.json.
+analysis_rules = os.environ.get('ANALYSIS_RULES') or None
+
+# Memory the decoded frames of one analysis may take, in MB. The analysis holds back decoding when it is
+# reached, keeping its memory flat however long the video. Empty holds as many frames as the queues allow.
+analysis_frame_memory = (int(os.environ['ANALYSIS_FRAME_MEMORY_MB']) * 2 ** 20
+                         if os.environ.get('ANALYSIS_FRAME_MEMORY_MB') else None)
+
+# Field of the video documents holding the result: the output video, or the annotations when not rendering
+result_field = 'outputVideoUrl' if analysis_render else 'annotationsUrl'
+
+# Set the path for the analysis result cache database within gymnastics_analysis
+results_db_path = os.path.join(gymnastics_analysis_folder, "results.sqlite3")
+
+# Set the path for the job queue database within gymnastics_analysis
+jobs_db_path = os.path.join(gymnastics_analysis_folder, "jobs.sqlite3")
+
+# Number of queued jobs processed at the same time
+job_workers = int(os.environ.get('JOB_WORKERS', 2))
+
+# Order in which the videos of the running jobs get the analysis workers: 'round_robin' takes turns between
+# the athletes, shortest video first within an athlete, and 'shortest' runs the shortest video first
+analysis_scheduling = os.environ.get('ANALYSIS_SCHEDULING', 'round_robin')
+
+# Estimated memory of one analysis and memory all running analyses may use together, in MB. Without a
+# budget only the number of analysis workers limits how many videos are analysed at the same time.
+analysis_memory = int(os.environ.get('ANALYSIS_MEMORY_MB', 512)) * 2 ** 20
+analysis_memory_budget = (int(os.environ['ANALYSIS_MEMORY_BUDGET_MB']) * 2 ** 20
+                          if os.environ.get('ANALYSIS_MEMORY_BUDGET_MB') else None)
+
+# Start the analysis workers, connect to Firebase and start the job queue in the background as soon as the
+# service is loaded, rather than on the first request. With 0 everything is started on first use.
+prewarm = os.environ.get('PREWARM', '1') == '1'
+
+# Video documents updated together in one Firestore batched write. A video's result shows up in the
+# app once its batch is committed, at the latest when the job ends.
+firestore_batch_size = int(os.environ.get('FIRESTORE_BATCH_SIZE', analysis_workers))
+
+# Fields of the video documents read by the service, the rest of each document is not fetched
+video_fields = ['videoUrl', 'outputVideoUrl', 'annotationsUrl', 'analysisKey']
+
+# Metrics of the service, exposed at /metrics
+service_metrics = MetricsRegistry()
+videos_processed = service_metrics.counter('vault_videos_processed_total',
+                                           'Videos handled, by result (analysed, skipped, cached or failed)')
+stage_seconds = service_metrics.histogram('vault_stage_seconds', 'Seconds spent on one video or job in each stage')
+stage_failures = service_metrics.counter('vault_stage_failures_total', 'Stages that failed with an error, by stage')
+frames_processed = service_metrics.counter('vault_frames_processed_total', 'Video frames analysed')
+analysis_fps = service_metrics.histogram('vault_analysis_fps', 'Frames per second of the analysis of each video',
+                                         FPS_BUCKETS)
+frame_stage_seconds = service_metrics.histogram('vault_frame_stage_seconds',
+                                                'Seconds per frame in each stage of the analysis loop, decode and '
+                                                'encode being the waits on the decoding and encoding threads',
+                                                FRAME_BUCKETS)
+queue_depth = service_metrics.gauge('vault_job_queue_depth', 'Jobs waiting in the queue',
+                                    lambda: job_queue.depth() if job_queue is not None else 0)
+analyses_waiting = service_metrics.gauge('vault_analyses_waiting', 'Videos of running jobs waiting for an analysis worker',
+                                         lambda: analysis_scheduler.waiting_count())
+startup = service_metrics.gauge('vault_startup_seconds', 'Seconds the service took to load, imports included',
+                                lambda: startup_seconds)
+
+# Firebase is initialized with the service account key when its clients are first needed
+configure_firebase(service_account_key_path, {
     'storageBucket': 'gymnastics-analysis-543bc.appspot.com'
 })
 
@@ -40,18 +154,167 @@ sslify = SSLify(app)
 # Load SSL certificate files
 ssl_context = (ssl_cert, ssl_key)
 
+# The vault analyzer is loaded once per process and shared by all requests
+analyzer = None
+analyzer_lock = threading.Lock()
+
+def analyze_video(input_file, output_file, track_file=None, annotations_file=None):
+    global analyzer
+
+    # The MediaPipe graph is not thread-safe, so requests take turns using it
+    with analyzer_lock:
+        if analyzer is None:
+            analyzer = VaultAnalyzer(analysis_mode, encoder=analysis_encoder, roi=analysis_roi,
+                                     sample_interval=analysis_sample_interval, segment=analysis_segment,
+                                     encoding=analysis_encoding, render=analysis_render,
+                                     smoothing=analysis_smoothing, rules=analysis_rules,
+                                     frame_memory=analysis_frame_memory)
+        return analyzer.analyze(input_file, output_file, track_path=track_file, annotations_path=annotations_file)
+
+# The analyses of all running jobs share the worker pool through one scheduler
+analysis_scheduler = FairScheduler(analysis_workers, analysis_memory_budget, analysis_scheduling)
+
+# The batch worker pool is started once per process, when warming up or on the first request
+batch_analyzer = None
+batch_lock = threading.Lock()
+
+def get_batch_analyzer():
+    global batch_analyzer
+
+    with batch_lock:
+        if batch_analyzer is None:
+            batch_analyzer = BatchAnalyzer(analysis_workers, analysis_mode, analysis_encoder, analysis_roi,
+                                           analysis_sample_interval, analysis_segment, analysis_encoding, analysis_render,
+                                           analysis_smoothing, analysis_rules, analysis_frame_memory)
+        return batch_analyzer
+
+def analyze_video_in_pool(input_file, output_file, track_file=None, progress=None, annotations_file=None):
+    # Each worker process keeps its own MediaPipe model, so jobs run side by side
+    return get_batch_analyzer().submit(input_file, output_file, progress, track_file, annotations_file).result()
+
+# The result cache is opened once per process, on the first video
+result_cache = None
+result_cache_lock = threading.Lock()
+
+def get_result_cache():
+    global result_cache
+
+    with result_cache_lock:
+        if result_cache is None:
+            os.makedirs(gymnastics_analysis_folder, exist_ok=True)
+            result_cache = ResultCache(results_db_path)
+        return result_cache
+
+# The job queue and its workers are started once per process, when warming up or on the first request
+job_queue = None
+job_runner = None
+job_lock = threading.Lock()
+
+def get_job_runner():
+    global job_queue, job_runner
+
+    with job_lock:
+        if job_runner is None:
+            os.makedirs(gymnastics_analysis_folder, exist_ok=True)
+            remove_stale_scratch()
+            job_queue = JobQueue(jobs_db_path)
+            job_runner = JobWorkers(job_queue, run_job, workers=job_workers)
+            job_runner.start()
+        return job_runner
+
+def run_job(job, queue, db=None, bucket=None):
+    # Firestore and Storage can be replaced with local stand-ins
+    if db is None:
+        db = get_db()
+
+    # Retrieve the fields used of all video documents of the athlete and record them in the job
+    with timed(stage_seconds, stage_failures, stage='list_videos'):
+        athlete_ref = db.collection('athletes').document(job['athlete_id'])
+        video_docs = list(athlete_ref.collection('videos').select(video_fields).get())
+    for video_number, video_doc in enumerate(video_docs, start=1):
+        queue.add_video(job['id'], video_doc.id, video_number)
+
+    # The results of the videos are written to Firestore in batches
+    writes = BatchedWrites(db, firestore_batch_size)
+
+    # Process the videos in parallel and collect the results as they finish
+    try:
+        with timed(stage_seconds, stage='job'), ThreadPoolExecutor(max_workers=analysis_workers) as executor:
+            futures = {
+                executor.submit(run_job_video, job, queue, video_doc, bucket, writes): video_doc
+                for video_doc in video_docs
+            }
+
+            for future in as_completed(futures):
+                if future.result():
+                    print("Video processed successfully.")
+                else:
+                    print("Error processing video:", futures[future].id)
+    finally:
+        # Commit the results still waiting for a full batch
+        with timed(stage_seconds, stage_failures, stage='database'):
+            writes.flush()
+
+    # A video is done once its result is committed, which can fail after it was processed
+    failures = sum(video['status'] != 'done' for video in queue.get(job['id'])['videos'])
+    if failures:
+        stage_failures.inc(stage='job')
+        raise RuntimeError(f"{failures} of {len(video_docs)} videos could not be processed.")
+
+def run_job_video(job, queue, video_doc, bucket=None, writes=None):
+    queue.update_video(job['id'], video_doc.id, status='running')
+
+    # The analysis workers record the frames processed directly in the job queue
+    progress = VideoProgress(queue.db_path, job['id'], video_doc.id)
+
+    # The video waits for an analysis worker once it is downloaded. Streamed videos count as the shortest,
+    # their download is held up until they are analysed.
+    def analyze(input_file, output_file, track_file=None, annotations_file=None):
+        size = os.path.getsize(input_file) if os.path.isfile(input_file) else 0
+        with analysis_scheduler.slot(job['athlete_id'], size, analysis_memory):
+            return analyze_video_in_pool(input_file, output_file, track_file, progress, annotations_file)
+
+    # The video is only done once its result is in the database, when the batch holding it is committed
+    def committed(error):
+        if error is None:
+            queue.update_video(job['id'], video_doc.id, status='done', error=None)
+        else:
+            videos_processed.inc(result='failed')
+            queue.update_video(job['id'], video_doc.id, status='failed',
+                               error="Error updating the video document: " + str(error))
+
+    try:
+        processed = process_single_video(video_doc, job['athlete_id'], analyze, bucket, force=job['force'], writes=writes,
+                                         committed=committed)
+    except NotFound:
+        error_message = "Error downloading the video: The requested object was not found."
+        processed = False
+    except Exception as e:
+        error_message = "An error occurred: " + str(e)
+        processed = False
+    else:
+        error_message = None if processed else "Error downloading the video: The downloaded file is empty."
+
+    if not processed:
+        videos_processed.inc(result='failed')
+        queue.update_video(job['id'], video_doc.id, status='failed', error=error_message)
+    return processed
+
 @app.route('/process_video', methods=['POST'])
 def process_video():
     athlete_id = request.form['athlete_id']
 
+    # Already analysed videos are skipped unless reprocessing is forced
+    force = request.form.get('force', '').lower() in ('1', 'true', 'yes')
+
     if not athlete_id:
         error_message = "Athlete ID not provided."
         print(error_message)
         return jsonify({'error': error_message}), 400
 
     try:
-        # Initialize Firestore
-        db = firestore.client()
+        # The Firestore client is shared by all requests
+        db = get_db()
 
         # Retrieve the athlete document with the given ID
         athlete_ref = db.collection('athletes').document(athlete_id)
@@ -61,40 +324,151 @@ def process_video():
             print(error_message)
             return jsonify({'error': error_message}), 404
 
-        # Retrieve the videos subcollection for the athlete
-        videos_ref = athlete_ref.collection('videos')
+        # Queue the job, the videos are processed in the background
+        runner = get_job_runner()
+        job_id = job_queue.enqueue(athlete_id, force=force)
+        runner.notify()
+
+        print("Job queued:", job_id)
+        return jsonify({'message': 'Videos queued for processing.', 'job_id': job_id,
+                        'status_url': f'/jobs/{job_id}'}), 202
+
+    except Exception as e:
+        error_message = "An error occurred: " + str(e)
+        print(error_message)
+        return jsonify({'error': error_message}), 500
 
-        # Retrieve all video documents in the subcollection
-        video_docs = videos_ref.get()
+@app.route('/process_videos', methods=['POST'])
+def process_videos():
+    # The athletes are given as an 'athlete_ids' list, in a JSON body or as repeated or comma-separated form fields
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body, dict):
+        error_message = "The JSON body must be an object."
+        print(error_message)
+        return jsonify({'error': error_message}), 400
 
-        video_number = 0
+    athlete_ids = body.get('athlete_ids')
+    if athlete_ids is None:
+        athlete_ids = [athlete_id for value in request.form.getlist('athlete_ids') for athlete_id in value.split(',')]
+    elif not (isinstance(athlete_ids, list) and all(isinstance(athlete_id, str) for athlete_id in athlete_ids)):
+        error_message = "athlete_ids must be a list of strings."
+        print(error_message)
+        return jsonify({'error': error_message}), 400
+    athlete_ids = list(dict.fromkeys(athlete_id.strip() for athlete_id in athlete_ids if athlete_id.strip()))
 
-        for video_doc in video_docs:
-            video_number += 1
-            if process_single_video(video_doc, video_number, athlete_id):
-                print("Video processed successfully.")
-            else:
-                print("Error processing video:", video_doc.id)
+    # Or by a query: 'missing_results' selects the athletes with videos without a result
+    query = body.get('query') or request.form.get('query')
 
-        return jsonify({'message': 'Videos processed successfully.'})
+    # Already analysed videos are skipped unless reprocessing is forced
+    force = str(body.get('force', request.form.get('force', ''))).lower() in ('1', 'true', 'yes')
 
-    except NotFound as e:
-        error_message = "Error downloading the video: The requested object was not found."
+    if bool(athlete_ids) == bool(query):
+        error_message = "Provide either athlete IDs or a query."
+        print(error_message)
+        return jsonify({'error': error_message}), 400
+    if query and query != 'missing_results':
+        error_message = f"Unknown query '{query}'."
         print(error_message)
-        return jsonify({'error': error_message}), 404
+        return jsonify({'error': error_message}), 400
+
+    try:
+        # The Firestore client is shared by all requests
+        db = get_db()
+
+        if query:
+            athlete_ids = athletes_missing_results(db)
+        else:
+            # Retrieve the athlete documents with the given IDs in one request
+            references = [db.collection('athletes').document(athlete_id) for athlete_id in athlete_ids]
+            missing = [snapshot.id for snapshot in db.get_all(references) if not snapshot.exists]
+            if missing:
+                error_message = "Athletes not found: " + ", ".join(sorted(missing))
+                print(error_message)
+                return jsonify({'error': error_message}), 404
+
+        if not athlete_ids:
+            return jsonify({'message': 'No videos to process.', 'job_ids': {}}), 200
+
+        # Queue one job per athlete, the scheduler shares the analysis workers between them and other requests
+        runner = get_job_runner()
+        batch_id, job_ids = job_queue.enqueue_batch(athlete_ids, force=force)
+        runner.notify()
+
+        print(f"Batch queued: {batch_id} ({len(job_ids)} athletes)")
+        return jsonify({'message': 'Videos queued for processing.', 'batch_id': batch_id, 'job_ids': job_ids,
+                        'status_url': f'/batches/{batch_id}'}), 202
+
     except Exception as e:
         error_message = "An error occurred: " + str(e)
         print(error_message)
         return jsonify({'error': error_message}), 500
 
-def process_single_video(video_data, video_number, athlete_id):
+def athletes_missing_results(db):
+    # Firestore cannot query for a missing field, so the result field of every video is read and checked here
+    with timed(stage_seconds, stage_failures, stage='list_videos'):
+        video_docs = db.collection_group('videos').select([result_field]).get()
+
+    athlete_ids = (video_doc.reference.parent.parent for video_doc in video_docs
+                   if not (video_doc.to_dict() or {}).get(result_field))
+    return list(dict.fromkeys(athlete.id for athlete in athlete_ids if athlete is not None))
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return service_metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    get_job_runner()
+    job = job_queue.get(job_id)
+
+    if job is None:
+        return jsonify({'error': "Job not found."}), 404
+
+    return jsonify(job)
+
+@app.route('/batches/<batch_id>', methods=['GET'])
+def batch_status(batch_id):
+    get_job_runner()
+    batch = job_queue.get_batch(batch_id)
+
+    if batch is None:
+        return jsonify({'error': "Batch not found."}), 404
+
+    return jsonify(batch)
+
+@contextmanager
+def scratch_directory(job_id):
+    # Every file of a video is written to its own directory, removed with everything in it however the video ends
+    os.makedirs(scratch_folder, exist_ok=True)
+    directory = tempfile.mkdtemp(prefix=f'video_{job_id}_', dir=scratch_folder)
+    try:
+        yield directory
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def remove_stale_scratch():
+    # Directories of videos still being processed are younger, a process that was killed leaves its own behind
+    if not os.path.isdir(scratch_folder):
+        return
+    cutoff = time.time() - stale_scratch_age
+    for entry in os.scandir(scratch_folder):
+        if entry.is_dir(follow_symlinks=False) and entry.stat().st_mtime < cutoff:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+def process_single_video(video_data, athlete_id, analyze=analyze_video, bucket=None, force=False, writes=None,
+                         committed=None):
+    # committed is called with None once the result is in the database, or with the error of a batched write.
+    # Fields missing from the document read as None
+    fields = video_data.to_dict()
+
     # Print the videoUrl
-    print("Video URL:", video_data.get('videoUrl'))
+    print("Video URL:", fields.get('videoUrl'))
+
+    # Every job gets its own scratch directory so several videos can be processed at the same time
+    job_id = uuid.uuid4().hex
 
     # Retrieve the video URL from the video document
-    video_url = video_data.get('videoUrl')
-    video_name = f'input.mp4'
-    video_path = os.path.join(input_folder, video_name)
+    video_url = fields.get('videoUrl')
 
     parsed_url = urllib.parse.urlparse(video_url)
     blob_path = urllib.parse.unquote(parsed_url.path)
@@ -106,81 +480,213 @@ def process_single_video(video_data, video_number, athlete_id):
     # Construct the full blob name with the folder path
     blob_full_path = os.path.join(folder_path, blob_name)
 
-    # Initialize Firebase Storage
-    bucket = storage.bucket()
+    # The Storage bucket is shared by all videos
+    if bucket is None:
+        bucket = get_bucket()
 
     video_blob = bucket.blob(blob_full_path)
 
-    # Download the video file
-    print("Downloading video...")
-    start_time = time.time()
-    video_blob.download_to_filename(video_path)
-    end_time = time.time()
-    download_time = end_time - start_time
-
-    if os.path.getsize(video_path) > 0:
-        print(f"Video downloaded successfully in {download_time:.2f} seconds.")
-        print(f"Video saved as '{video_name}' successfully.")
-    else:
-        print("Error downloading the video: The downloaded file is empty.")
-        return False
-
-    # Set the paths for the Vault_Gymnast.py script, input videos folder, and output videos folder
-    script_folder = os.path.dirname(os.path.abspath(__file__))
-    script_path = os.path.join(script_folder, "Vault_Gymnast.py")
-    output_folder = os.path.join(gymnastics_analysis_folder, "Output Videos")
-
-    # Specify the path to the input and output video file
-    input_file = video_path
-    output_file = os.path.join(output_folder, f"output_video.mp4")
-
-    # Create the output folder if it doesn't exist
-    os.makedirs(output_folder, exist_ok=True)
-
-    # Change the current working directory to the script folder
-    os.chdir(script_folder)
-
-    # Run the Vault_Gymnast.py script with the input and output paths as command line arguments
-    subprocess.run([sys.executable, script_path, input_file, output_folder])
-
-    print("Processing completed!")
-
-    # Specify the path to the processed video file
-    processed_video_path = output_file
+    # Identify the analysis by the content of the video and the analyzer settings
+    with timed(stage_seconds, stage_failures, stage='metadata'):
+        video_blob.reload()
+    settings = analyzerSettings(analysis_mode, analysis_encoder, analysis_roi, analysis_sample_interval, analysis_segment,
+                                analysis_encoding, analysis_render, analysis_smoothing, analysis_rules)
+    result_key = cache_key(video_blob, settings)
+
+    # Skip the download, analysis and upload when this video was already analysed
+    if not force:
+        if fields.get('analysisKey') == result_key and fields.get(result_field):
+            videos_processed.inc(result='skipped')
+            print("Video already processed, skipping.")
+            if committed is not None:
+                committed(None)
+            return True
+
+        cached_result_url = get_result_cache().get(result_key)
+        if cached_result_url:
+            cached_fields = {result_field: cached_result_url, 'analysisKey': result_key}
+            cached_report = get_result_cache().report(result_key)
+            if cached_report is not None:
+                cached_fields['scoreReport'] = cached_report
+
+            # The landmark track and annotations of the analysis are shared with the video it was cached for
+            cached_track_path, cached_annotations_path = get_result_cache().paths(result_key)
+            if cached_track_path is not None:
+                cached_fields['landmarkTrackPath'] = cached_track_path
+            if cached_annotations_path is not None:
+                cached_fields['annotationsPath'] = cached_annotations_path
+
+            # The video counts as cached once the database has the result, a failed write counts it as failed
+            def cached_committed(error):
+                if error is None:
+                    videos_processed.inc(result='cached')
+                if committed is not None:
+                    committed(error)
+
+            with timed(stage_seconds, stage_failures, stage='database'):
+                update_video_document(video_data.reference, cached_fields, writes, cached_committed)
+            print("Cached result found, result URL confirmed in the database.")
+            return True
 
     # Specify the output folder path in Firebase Storage
     output_folder_path = 'output'
 
-    # Construct the full blob name with the output folder path and video ID
-    output_blob_name = f"output_{athlete_id}_video{video_number}.mp4"
-    output_blob_path = os.path.join(output_folder_path, output_blob_name)
+    # Name the results by the video document and the analysis, so a result never overwrites the one of
+    # another video or analysis that a document or the result cache still points to
+    result_name = f"{video_data.id}_{result_key[:16]}"
 
-    # Rename the processed video file with the desired name
-    renamed_processed_video_path = os.path.join(output_folder, output_blob_name)
-    os.rename(processed_video_path, renamed_processed_video_path)
-
-    # Upload the renamed processed video to Firebase Storage
+    # Construct the full blob name with the output folder path, athlete ID and result name
+    output_blob_path = os.path.join(output_folder_path, athlete_id, f"{result_name}.mp4")
     output_blob = bucket.blob(output_blob_path)
-    output_blob.upload_from_filename(renamed_processed_video_path)
 
-    print("Processed video uploaded to Firebase Storage.")
+    with scratch_directory(job_id) as scratch:
+        stats = analyze_in_scratch(video_blob, output_blob, analyze, scratch)
+        if stats is None:
+            return False
+
+        # Upload the landmark track next to the processed video
+        track_blob_path = os.path.join('tracks', athlete_id, f"{result_name}.npz")
+        with timed(stage_seconds, stage_failures, stage='track_upload'):
+            bucket.blob(track_blob_path).upload_from_filename(os.path.join(scratch, 'track.npz'))
+
+        print("Landmark track uploaded to Firebase Storage.")
+
+        # Upload the annotations next to the original video, gzipped. Storage serves them decompressed.
+        annotations_blob_path = os.path.join(folder_path, f"{os.path.splitext(blob_name)[0]}.{result_key[:16]}.annotations.json")
+        annotations_blob = bucket.blob(annotations_blob_path)
+        annotations_blob.content_encoding = 'gzip'
+        with timed(stage_seconds, stage_failures, stage='annotations_upload'):
+            annotations_blob.upload_from_filename(os.path.join(scratch, 'annotations.json.gz'),
+                                                  content_type='application/json')
+
+        print("Annotations uploaded to Firebase Storage.")
+
+    # Get the URL of the uploaded processed video, or of the annotations when no video was rendered
+    result_url = output_blob.public_url if analysis_render else annotations_blob.public_url
+
+    record_analysis(stats)
+
+    # The result is only cached, and the video counted as analysed, once the database has it
+    def result_committed(error):
+        if error is None:
+            get_result_cache().put(result_key, result_url, stats['report'], track_blob_path, annotations_blob_path)
+            videos_processed.inc(result='analysed')
+        if committed is not None:
+            committed(error)
+
+    # Update the video document in the Firestore database with the result URL and the score report of the attempt
+    with timed(stage_seconds, stage_failures, stage='database'):
+        update_video_document(video_data.reference, {
+            result_field: result_url,
+            'landmarkTrackPath': track_blob_path,
+            'annotationsPath': annotations_blob_path,
+            'scoreReport': stats['report'],
+            'analysisKey': result_key
+        }, writes, result_committed)
+
+    print(f"Result URL and score report ({stats['report']['score']:.2f}) updated in the database.")
+    return True
 
-    # Get the URL of the uploaded processed video
-    output_video_url = output_blob.public_url
+def analyze_in_scratch(video_blob, output_blob, analyze, scratch):
+    # The landmark track is kept so the video can be re-scored without re-analysing it, and the
+    # annotations let the app draw the analysis itself. Both are written next to the videos.
+    track_file = os.path.join(scratch, 'track.npz')
+    annotations_file = os.path.join(scratch, 'annotations.json.gz')
 
-    # Update the video document in the Firestore database with the output video URL
-    video_data.reference.update({
-        'outputVideoUrl': output_video_url
-    })
+    # Videos with their index at the front are decoded while they download. The two-pass analysis
+    # reads the video twice, so it needs the whole file, and cv2.VideoWriter cannot write to a pipe.
+    if (streaming_io and analysis_render and analysis_segment is None and analysis_encoder != 'opencv'
+            and isFastStart(video_blob)):
+        print("Streaming video...")
+        with timed(stage_seconds, stage_failures, stage='stream'):
+            stats = stream_video(video_blob, output_blob, analyze, scratch, track_file, annotations_file)
 
-    print("Processed video URL updated in the database.")
+        print(f"Processing completed! {stats['frames']} frames at {stats['fps']:.2f} fps.")
+        print("Processed video streamed to Firebase Storage.")
+        return stats
 
-    # Delete input and processed videos
-    os.remove(video_path)
-    os.remove(renamed_processed_video_path)
+    # Download the video file
+    input_file = os.path.join(scratch, 'input.mp4')
+    print("Downloading video...")
+    start_time = time.time()
+    with timed(stage_seconds, stage_failures, stage='download'):
+        video_blob.download_to_filename(input_file)
+    end_time = time.time()
+    download_time = end_time - start_time
 
-    print("Input and processed videos deleted.")
-    return True
+    if os.path.getsize(input_file) > 0:
+        print(f"Video downloaded successfully in {download_time:.2f} seconds.")
+    else:
+        print("Error downloading the video: The downloaded file is empty.")
+        return None
+
+    # Run the vault analysis with the input and output paths
+    output_file = os.path.join(scratch, 'output.mp4')
+    with timed(stage_seconds, stage_failures, stage='analysis'):
+        stats = analyze(input_file, output_file, track_file, annotations_file)
+
+    print(f"Processing completed! {stats['frames']} frames at {stats['fps']:.2f} fps.")
+
+    # Without rendering there is no processed video, only the annotations
+    if analysis_render:
+        # Upload the processed video to Firebase Storage
+        with timed(stage_seconds, stage_failures, stage='upload'):
+            output_blob.upload_from_filename(output_file)
+
+        print("Processed video uploaded to Firebase Storage.")
+    return stats
+
+def update_video_document(reference, fields, writes=None, committed=None):
+    # Within a job the update joins the job's next batched write and committed is called once the batch is
+    # committed. Otherwise it is sent right away, raising when it fails.
+    if writes is None:
+        reference.update(fields)
+        if committed is not None:
+            committed(None)
+    else:
+        writes.update(reference, fields, committed)
+
+def record_analysis(stats):
+    # The frame timings of the analysis are aggregated in the worker and merged here. The video itself is
+    # counted once its result is committed.
+    frames_processed.inc(stats['frames'])
+    analysis_fps.observe(stats['fps'])
+    frame_stage_seconds.merge(stats['frame_timings'])
+
+def stream_video(video_blob, output_blob, analyze, scratch, track_file, annotations_file):
+    # The decoder reads the download and the encoder writes the upload through named pipes in the scratch
+    # directory, removed with it
+    input_pipe = os.path.join(scratch, 'input.pipe')
+    output_pipe = os.path.join(scratch, 'output.pipe')
+    makePipe(input_pipe)
+    makePipe(output_pipe)
+
+    def analyze_pipes(input_file, output_file):
+        return analyze(input_file, output_file, track_file, annotations_file)
+
+    stats, download, upload = streamBlobs(video_blob, output_blob, input_pipe, output_pipe, analyze_pipes)
+    print(f"Streamed {download.bytes_transferred} bytes in and {upload.bytes_transferred} bytes out.")
+    return stats
+
+def warm_up():
+    # Everything the first job needs is started while the service already serves requests. A part that
+    # fails does not hold up the others, it is tried again on first use.
+    parts = (('job_queue', get_job_runner), ('result_cache', get_result_cache), ('firestore', get_db),
+             ('storage', get_bucket), ('analysis_workers', lambda: get_batch_analyzer().warm_up()))
+    for name, start in parts:
+        try:
+            with timed(stage_seconds, stage_failures, stage=f'warm_up_{name}'):
+                start()
+        except Exception as e:
+            print(f"Warm-up of the {name.replace('_', ' ')} failed:", e)
+    print("Service warmed up.")
+
+startup_seconds = time.perf_counter() - startup_started
+print(f"Service loaded in {startup_seconds:.2f} seconds.")
+
+# The spawned analysis workers load this module again when it is run as a script, only the service warms up
+if prewarm and multiprocessing.parent_process() is None:
+    threading.Thread(target=warm_up, name='warm_up', daemon=True).start()
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=443, ssl_context=ssl_context)
@@ -0,0 +1,170 @@
+# Process-pool batch mode for analysing many vault videos in parallel
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from Vault_Gymnast import (ENCODERS, POSE_MODES, SEGMENT_OUTPUTS, VaultAnalyzer, addEncodingArguments,
+                           analyzerSettings, encodingFromArguments)
+
+# Analyzer owned by the current worker process, built once when the worker starts
+_analyzer = None
+
+
+def _init_worker(mode, encoder, roi, sample_interval, segment, encoding, render, smoothing, rules, frame_memory):
+    global _analyzer
+    _analyzer = VaultAnalyzer(mode, encoder=encoder, roi=roi, sample_interval=sample_interval, segment=segment,
+                              encoding=encoding, render=render, smoothing=smoothing, rules=rules,
+                              frame_memory=frame_memory)
+
+
+def _ready():
+    pass
+
+
+def _analyze(input_path, output_path, progress=None, track_path=None, annotations_path=None):
+    return _analyzer.analyze(input_path, output_path, progress, track_path, annotations_path)
+
+
+class BatchAnalyzer:
+    '''
+    Fans videos out across a pool of worker processes, each keeping its own Pose model.
+    Args:
+        workers: Number of worker processes, defaults to the number of CPU cores.
+        mode: Pose inference mode, one of the keys of Vault_Gymnast.POSE_MODES.
+        encoder: Output video encoder, one of Vault_Gymnast.ENCODERS.
+        roi: When true, the pose is detected in a crop around the gymnast.
+        sample_interval: Frames per inferred frame in the run-up and after the vault.
+        segment: Output of the two-pass analysis, one of Vault_Gymnast.SEGMENT_OUTPUTS, or None.
+        encoding: Optional dict of ffmpeg encoder settings, with keys of Vault_Gymnast.ENCODING_OPTIONS.
+        render: When false, no output videos are written, only the landmark tracks and annotations.
+        smoothing: When true, the landmarks are smoothed and the phase transitions need several frames.
+        rules: Path of the pose rule table, the default one when None.
+        frame_memory: Optional bytes of memory of the frames each worker holds at a time.
+    '''
+
+    def __init__(self, workers=None, mode='tracking', encoder='opencv', roi=False, sample_interval=1, segment=None,
+                 encoding=None, render=True, smoothing=False, rules=None, frame_memory=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.mode = mode
+        self.encoder = encoder
+        self.roi = roi
+        self.sample_interval = sample_interval
+        self.segment = segment
+        self.encoding = encoding
+        self.render = render
+        self.smoothing = smoothing
+        self.rules = rules
+        self.frame_memory = frame_memory
+
+        # Workers are spawned rather than forked, MediaPipe graphs and server threads do not survive a fork.
+        self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                            mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init_worker,
+                                            initargs=(mode, encoder, roi, sample_interval, segment, encoding, render,
+                                                      smoothing, rules, frame_memory))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def settings(self):
+        '''
+        Returns:
+            settings: Dict of the analyzer version and settings used by the workers.
+        '''
+        return analyzerSettings(self.mode, self.encoder, self.roi, self.sample_interval, self.segment, self.encoding,
+                                self.render, self.smoothing, self.rules)
+
+    def warm_up(self):
+        '''
+        Starts every worker process, which builds its Pose model as it starts, and waits until the
+        workers take tasks, so the first videos are not held up by the start of the pool.
+        '''
+        # The pool starts a new worker for each task submitted while none is idle.
+        for future in [self.executor.submit(_ready) for _ in range(self.workers)]:
+            future.result()
+
+    def submit(self, input_path, output_path, progress=None, track_path=None, annotations_path=None):
+        '''
+        Args:
+            input_path: Path of the video with the gymnast to be analysed.
+            output_path: Path where the annotated video is written. Must be unique to the job.
+            progress: Optional picklable progress callback, see VaultAnalyzer.analyze.
+            track_path: Optional path of a .npz file the landmark track is saved to.
+            annotations_path: Optional path of a .json or .json.gz file the annotations are saved to.
+        Returns:
+            future: A concurrent.futures.Future resolving to the analysis stats.
+        '''
+        return self.executor.submit(_analyze, input_path, output_path, progress, track_path, annotations_path)
+
+    def analyze_all(self, jobs):
+        '''
+        Args:
+            jobs: Iterable of (input_path, output_path) pairs, optionally followed by the progress,
+                  track_path and annotations_path arguments of submit.
+        Yields:
+            (job, stats, error): For each job as soon as it finishes, with either the
+            analysis stats or the exception it raised.
+        '''
+        futures = {self.submit(*job): job for job in jobs}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, e
+
+    def close(self):
+        '''
+        Waits for the running jobs and shuts the worker processes down.
+        '''
+        self.executor.shutdown(wait=True)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Analyse many vault videos in parallel.')
+    parser.add_argument('input_paths', nargs='+')
+    parser.add_argument('--output-folder', default='Output Videos')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--mode', choices=sorted(POSE_MODES), default='tracking')
+    parser.add_argument('--encoder', choices=ENCODERS, default='opencv')
+    parser.add_argument('--roi', action='store_true', help='detect the pose in a crop around the gymnast')
+    parser.add_argument('--sample-interval', type=int, default=1,
+                        help='infer only every Nth frame in the run-up and after the vault')
+    parser.add_argument('--segment', choices=SEGMENT_OUTPUTS, default=None,
+                        help='find the vault with a quick first pass and only analyse it')
+    parser.add_argument('--annotations', action='store_true',
+                        help='also save the per-frame annotations of each video to the output folder')
+    parser.add_argument('--no-render', action='store_true',
+                        help='do not draw and encode output videos, only save the annotations')
+    parser.add_argument('--smooth', action='store_true',
+                        help='smooth the landmarks over time and confirm phase transitions over several frames')
+    parser.add_argument('--rules', default=None, help='.json or .yaml pose rule table, see pose_rules.json')
+    parser.add_argument('--frame-memory', type=int, default=None,
+                        help='MB of memory for the frames each worker holds at a time')
+    addEncodingArguments(parser)
+    args = parser.parse_args()
+
+    os.makedirs(args.output_folder, exist_ok=True)
+    jobs = []
+    for path in args.input_paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        annotations_path = None
+        if args.annotations or args.no_render:
+            annotations_path = os.path.join(args.output_folder, f'annotations_{name}.json.gz')
+        jobs.append((path, os.path.join(args.output_folder, 'output_' + os.path.basename(path)), None, None,
+                     annotations_path))
+
+    with BatchAnalyzer(args.workers, args.mode, args.encoder, roi=args.roi, sample_interval=args.sample_interval,
+                       segment=args.segment, encoding=encodingFromArguments(args), render=not args.no_render,
+                       smoothing=args.smooth, rules=args.rules,
+                       frame_memory=args.frame_memory * 2 ** 20 if args.frame_memory else None) as batch:
+        for (input_path, output_path, _, _, annotations_path), stats, error in batch.analyze_all(jobs):
+            if error is None:
+                result_path = annotations_path if args.no_render else output_path
+                print(f"{input_path}: {stats['frames']} frames at {stats['fps']:.2f} fps -> {result_path}")
+            else:
+                print(f"{input_path}: failed: {error}")
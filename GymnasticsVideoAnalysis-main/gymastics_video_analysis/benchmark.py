@@ -0,0 +1,429 @@
+# Benchmark of the pose inference cost per frame in Vault_Gymnast.py
+import os
+import sys
+import json
+import timeit
+import argparse
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from time import time, perf_counter
+
+import Vault_Gymnast as vg
+from landmark_tracks import loadTrack
+from pose_rules import defaultPoseRules
+from synthetic_clips import RESOLUTIONS, syntheticClip, syntheticLandmarks
+
+# Stages of the analysis loop timed by benchmarkStages, in loop order
+STAGES = ('decode', 'prepare', 'convert', 'inference', 'classify', 'overlay', 'encode')
+
+# Slowdown against the baseline above which a measurement counts as a regression
+REGRESSION_TOLERANCE = 0.10
+
+# Seconds the service may take to load, imports included, before it serves requests and takes jobs
+STARTUP_BUDGET = 1.0
+
+
+# Function to read and prepare the frames of a video the same way the analysis loop does
+def loadFrames(input_file, max_frames):
+    '''
+    Args:
+        input_file: Path of the video to benchmark on.
+        max_frames: Maximum number of frames to read.
+    Returns:
+        frames: List of (full resolution frame, flipped and resized frame) pairs.
+    '''
+    video = cv2.VideoCapture(input_file)
+    frames = []
+    while video.isOpened() and len(frames) < max_frames:
+        ok, frame = video.read()
+        if not ok:
+            break
+        frames.append((frame, vg.prepareFrame(frame)))
+    video.release()
+    return frames
+
+
+# Function to time the pose inference of the given frames
+def benchmarkInference(frames, mode, legacy=False, roi=False):
+    '''
+    Args:
+        frames: List of (full resolution frame, flipped and resized frame) pairs.
+        mode: Pose inference mode, one of the keys of Vault_Gymnast.POSE_MODES.
+        legacy: When true, also run the discarded heavy full resolution pass of the old loop.
+        roi: When true, detect the pose in a crop around the gymnast with Vault_Gymnast.ROIPoseDetector.
+    Returns:
+        fps: Frames per second of the inference.
+    '''
+    pose_video = vg.buildPose(mode)
+    pose = vg.buildPose('accurate') if legacy else None
+    roi_detector = vg.ROIPoseDetector(pose_video, mode) if roi else None
+
+    start_time = time()
+    for frame, small in frames:
+        if legacy:
+            pose.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        if roi_detector is not None:
+            roi_detector.detect(small)
+        else:
+            vg.detectPose(small, pose_video, display=False)
+    elapsed = time() - start_time
+
+    pose_video.close()
+    if pose is not None:
+        pose.close()
+    if roi_detector is not None:
+        roi_detector.close()
+    return len(frames) / elapsed if elapsed > 0 else 0.0
+
+
+# Function to time every stage of the analysis loop on a video
+def benchmarkStages(input_file, mode='tracking', landmarks=None):
+    '''
+    The stages run one after the other on a single thread, unlike in VaultAnalyzer, so each
+    one can be timed on its own.
+    Args:
+        input_file: Path of the video to benchmark on.
+        mode: Pose inference mode, one of the keys of Vault_Gymnast.POSE_MODES.
+        landmarks: Optional (N, 33, 3) landmark arrays classified and drawn on the frames where no
+                   gymnast is detected, so synthetic clips still time the classify and overlay stages.
+    Returns:
+        timings: Dict of the milliseconds per frame of every stage in STAGES, with the number of 'frames'.
+    '''
+    pose = vg.buildPose(mode)
+    totals = dict.fromkeys(STAGES, 0.0)
+    frames = 0
+    prev_state = 0
+
+    video = cv2.VideoCapture(input_file)
+    fps = video.get(cv2.CAP_PROP_FPS)
+    out = None
+    with tempfile.TemporaryDirectory() as folder:
+        while True:
+            start = perf_counter()
+            ok, frame = video.read()
+            totals['decode'] += perf_counter() - start
+            if not ok:
+                break
+
+            start = perf_counter()
+            frame = vg.prepareFrame(frame)
+            totals['prepare'] += perf_counter() - start
+
+            start = perf_counter()
+            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            totals['convert'] += perf_counter() - start
+
+            start = perf_counter()
+            results = pose.process(frame_rgb)
+            totals['inference'] += perf_counter() - start
+
+            # Use the detected landmarks, or the given ones when there is no gymnast.
+            height, width, _ = frame.shape
+            if results.pose_landmarks:
+                frame_landmarks = np.trunc(np.array([(landmark.x, landmark.y, landmark.z)
+                                                     for landmark in results.pose_landmarks.landmark]) * (width, height, width))
+            elif landmarks is not None:
+                frame_landmarks = landmarks[frames % len(landmarks)]
+            else:
+                frame_landmarks = None
+
+            if frame_landmarks is not None:
+                start = perf_counter()
+                angles = vg.calculateAngles(frame_landmarks)
+                prev_state, label = vg.classifyState(prev_state, angles)
+                deductions = vg.poseDeductions(label, frame_landmarks, angles)
+                totals['classify'] += perf_counter() - start
+
+                start = perf_counter()
+                if results.pose_landmarks:
+                    vg.mp_drawing.draw_landmarks(image=frame, landmark_list=results.pose_landmarks,
+                                                 connections=vg.mp_pose.POSE_CONNECTIONS)
+                vg.drawPoseLabels(frame, frame_landmarks, label, deductions)
+                cv2.putText(frame, label, (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2, cv2.LINE_AA)
+                totals['overlay'] += perf_counter() - start
+
+            start = perf_counter()
+            if out is None:
+                out = cv2.VideoWriter(os.path.join(folder, 'output.mp4'), cv2.VideoWriter_fourcc(*'mp4v'), fps,
+                                      (width, height))
+            out.write(frame)
+            totals['encode'] += perf_counter() - start
+            frames += 1
+
+        if out is not None:
+            out.release()
+    video.release()
+    pose.close()
+
+    timings = {stage: 1000 * total / frames if frames else 0.0 for stage, total in totals.items()}
+    timings['frames'] = frames
+    return timings
+
+
+# Function to measure the end-to-end throughput of VaultAnalyzer on a video
+def benchmarkEndToEnd(input_file, mode='tracking'):
+    '''
+    Args:
+        input_file: Path of the video to benchmark on.
+        mode: Pose inference mode, one of the keys of Vault_Gymnast.POSE_MODES.
+    Returns:
+        fps: Frames per second of the whole analysis, decoding and encoding included.
+    '''
+    with tempfile.TemporaryDirectory() as folder, vg.VaultAnalyzer(mode) as analyzer:
+        return analyzer.analyze(input_file, os.path.join(folder, 'output.mp4'))['fps']
+
+
+# Function to run the benchmarks of one clip, in a process of its own so its peak memory is its own
+def benchmarkClip(input_file, mode='tracking', landmarks=None):
+    '''
+    Args:
+        input_file: Path of the video to benchmark on.
+        mode: Pose inference mode, one of the keys of Vault_Gymnast.POSE_MODES.
+        landmarks: Optional landmark arrays, see benchmarkStages.
+    Returns:
+        result: Dict of the stage timings, the end-to-end 'fps' and the 'peak_rss_mb' of the process.
+    '''
+    result = {'stages': benchmarkStages(input_file, mode, landmarks)}
+    result['fps'] = benchmarkEndToEnd(input_file, mode)
+
+    # The resident set size peak is reported in kilobytes on Linux.
+    result['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return result
+
+
+# Function to time the import of a module in fresh interpreters, like the start of a service worker
+def benchmarkStartup(module='app', repeat=3, top=10):
+    '''
+    Args:
+        module: Name of the module to import, the service by default.
+        repeat: Number of interpreters started, the fastest import is reported.
+        top: Number of packages reported.
+    Returns:
+        seconds: Seconds of the fastest import of the module.
+        packages: List of (seconds, package) of the slowest top-level packages imported, each with
+                  everything it imported itself, from python -X importtime.
+    '''
+    # The service is loaded without warming up, which goes on in the background.
+    environment = dict(os.environ, PREWARM='0')
+    script = f'import time; started = time.perf_counter(); import {module}; print(time.perf_counter() - started)'
+
+    runs = []
+    for _ in range(repeat):
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-c', script], capture_output=True, text=True,
+                                 cwd=os.path.dirname(os.path.abspath(__file__)), env=environment)
+        if process.returncode != 0:
+            raise RuntimeError(f"Importing '{module}' failed:\n{process.stderr[-2000:]}")
+        runs.append((float(process.stdout.split()[-1]), process.stderr))
+    seconds, report = min(runs)
+
+    # Lines like 'import time:   self [us] | cumulative | package', nested imports being indented and
+    # listed before the import they are part of. Only the packages imported under the module are kept.
+    packages = []
+    for line in report.splitlines():
+        fields = line.split('|')
+        if not line.startswith('import time:') or len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        package = fields[2].strip()
+        if not fields[2].startswith('  '):
+            if package == module:
+                break
+            packages = []
+        elif '.' not in package:
+            packages.append((int(fields[1]) / 1e6, package))
+    return seconds, sorted(packages, reverse=True)[:top]
+
+
+# Function to time a function call in microseconds
+def timeCall(function, *args, repeat=5, number=None):
+    '''
+    Args:
+        function: The function to time.
+        args: The arguments it is called with.
+        repeat: Number of timing runs, the fastest one is reported.
+        number: Calls per run, chosen automatically when None.
+    Returns:
+        microseconds: Microseconds per call.
+    '''
+    timer = timeit.Timer(lambda: function(*args))
+    if number is None:
+        number, _ = timer.autorange()
+    return 1e6 * min(timer.repeat(repeat, number)) / number
+
+
+# Function to benchmark the geometry, classification and deduction helpers on landmark arrays
+def benchmarkMicro(landmarks):
+    '''
+    Args:
+        landmarks: (N, 33, 3) array of recorded or synthetic landmarks.
+    Returns:
+        timings: Dict of the microseconds per call of every helper.
+    '''
+    frame = np.zeros((640, 1137, 3), dtype=np.uint8)
+    points = landmarks[0]
+    angles = vg.calculateAngles(points)
+    clip_angles = vg.calculateAngles(landmarks)
+    rules = defaultPoseRules()
+    shoulder, elbow, wrist = (points[vg.PoseLandmark.LEFT_SHOULDER.value],
+                              points[vg.PoseLandmark.LEFT_ELBOW.value],
+                              points[vg.PoseLandmark.LEFT_WRIST.value])
+
+    return {
+        'calculateAngle': timeCall(vg.calculateAngle, shoulder, elbow, wrist),
+        'calculateAngles': timeCall(vg.calculateAngles, points),
+        f'calculateAngles x{len(landmarks)} (per frame)': timeCall(vg.calculateAngles, landmarks) / len(landmarks),
+        'classifyState': timeCall(vg.classifyState, 0, angles),
+        'candidateState': timeCall(vg.candidateState, angles),
+        f'candidateState x{len(landmarks)} (per frame)': timeCall(rules.classify, clip_angles) / len(landmarks),
+        'classifyPose': timeCall(lambda: vg.classifyPose(0, points, frame.copy(), display=False)),
+        'poseDeductions (2nd Flight)': timeCall(vg.poseDeductions, '2nd Flight', points, angles),
+        'bent_knees': timeCall(vg.bent_knees, 150.0),
+        'shoulder_ang': timeCall(vg.shoulder_ang, 150.0),
+        'leg_d': timeCall(vg.leg_d, 80.0, 120.0),
+        'distance': timeCall(vg.distance, shoulder, wrist),
+    }
+
+
+# Function to run the benchmarks of every synthetic clip
+def runSuite(resolutions, durations, mode='tracking', clips_folder='Benchmark Clips', landmarks=None):
+    '''
+    Args:
+        resolutions: Keys of synthetic_clips.RESOLUTIONS to benchmark.
+        durations: Clip lengths in seconds to benchmark.
+        mode: Pose inference mode, one of the keys of Vault_Gymnast.POSE_MODES.
+        clips_folder: Folder the synthetic clips are written to and reused from.
+        landmarks: (N, 33, 3) landmark arrays for the micro-benchmarks and the classify and overlay stages.
+    Returns:
+        results: Dict of the results of every clip, keyed like '1080p/5s', and of the micro-benchmarks under 'micro'.
+    '''
+    results = {}
+    for resolution in resolutions:
+        for seconds in durations:
+            clip = syntheticClip(clips_folder, resolution, seconds)
+
+            # A fresh process per clip, spawned so it starts without the models of the previous clips.
+            with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                results[f'{resolution}/{seconds}s'] = executor.submit(benchmarkClip, clip, mode, landmarks).result()
+
+    results['micro'] = benchmarkMicro(landmarks)
+    return results
+
+
+# Function to compare benchmark results with a saved baseline
+def compareResults(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    '''
+    Args:
+        results: Results as returned by runSuite.
+        baseline: Results of an earlier run.
+        tolerance: Slowdown above which a measurement counts as a regression.
+    Returns:
+        regressions: List of (name, baseline value, new value) of the measurements that got worse.
+    '''
+    regressions = []
+
+    def check(name, old, new, higher_is_better=False):
+        if old and (new < old * (1 - tolerance) if higher_is_better else new > old * (1 + tolerance)):
+            regressions.append((name, old, new))
+
+    for case, result in results.items():
+        old = baseline.get(case)
+        if old is None:
+            continue
+        if case == 'micro':
+            for name, value in result.items():
+                check(f'micro/{name}', old.get(name), value)
+            continue
+        for stage in STAGES:
+            check(f'{case}/{stage}', old['stages'].get(stage), result['stages'][stage])
+        check(f'{case}/fps', old.get('fps'), result['fps'], higher_is_better=True)
+        check(f'{case}/peak_rss_mb', old.get('peak_rss_mb'), result['peak_rss_mb'])
+    return regressions
+
+
+# Function to print the results of runSuite
+def printResults(results):
+    header = f"{'clip':<12}" + ''.join(f'{stage:>10}' for stage in STAGES) + f"{'fps':>9}{'peak MB':>9}"
+    print(header + '\n' + '-' * len(header) + '   (ms per frame)')
+    for case, result in results.items():
+        if case == 'micro':
+            continue
+        stages = result['stages']
+        print(f'{case:<12}' + ''.join(f'{stages[stage]:10.2f}' for stage in STAGES)
+              + f"{result['fps']:9.2f}{result['peak_rss_mb']:9.0f}")
+
+    print()
+    for name, microseconds in results['micro'].items():
+        print(f'{name:<40}: {microseconds:10.2f} us')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the per-frame pose inference of the vault analysis.')
+    parser.add_argument('input_file', nargs='?', default='Input Videos/input.mp4')
+    parser.add_argument('--frames', type=int, default=150, help='number of frames to benchmark on')
+    parser.add_argument('--suite', action='store_true',
+                        help='benchmark every stage on synthetic clips instead of the inference on input_file')
+    parser.add_argument('--resolutions', nargs='+', choices=sorted(RESOLUTIONS), default=['480p', '1080p', '4k'])
+    parser.add_argument('--durations', nargs='+', type=int, default=[5, 30], help='clip lengths in seconds')
+    parser.add_argument('--mode', choices=sorted(vg.POSE_MODES), default='tracking')
+    parser.add_argument('--clips-folder', default='Benchmark Clips')
+    parser.add_argument('--landmarks', default=None,
+                        help='landmark track .npz to run the micro-benchmarks on, synthetic landmarks by default')
+    parser.add_argument('--baseline', default=None, help='JSON file of an earlier run to compare with')
+    parser.add_argument('--save-baseline', default=None, help='JSON file to save the results to')
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE,
+                        help='slowdown against the baseline reported as a regression, 0.1 is 10%%')
+    parser.add_argument('--startup', nargs='?', const='app', default=None, metavar='MODULE',
+                        help='time the import of the service, or of another module, against the startup budget')
+    parser.add_argument('--startup-budget', type=float, default=STARTUP_BUDGET, help='seconds the import may take')
+    args = parser.parse_args()
+
+    if args.startup is not None:
+        seconds, packages = benchmarkStartup(args.startup)
+        for package_seconds, package in packages:
+            print(f"{package:<38}: {1000 * package_seconds:8.1f} ms")
+        print(f"import {args.startup}: {seconds:.3f} s (budget {args.startup_budget:.3f} s)")
+        raise SystemExit(0 if seconds <= args.startup_budget else 1)
+
+    if args.suite:
+        if args.landmarks is not None:
+            track = loadTrack(args.landmarks)['landmarks']
+            landmarks = track[~np.isnan(track).any(axis=(1, 2)), :, :3].astype(np.float64)
+            if not len(landmarks):
+                raise SystemExit(f"No gymnast was detected in any frame of '{args.landmarks}'.")
+        else:
+            landmarks = syntheticLandmarks(256)
+
+        results = runSuite(args.resolutions, args.durations, args.mode, args.clips_folder, landmarks)
+        printResults(results)
+
+        if args.save_baseline is not None:
+            with open(args.save_baseline, 'w') as f:
+                json.dump(results, f, indent=2)
+
+        if args.baseline is not None:
+            with open(args.baseline) as f:
+                regressions = compareResults(results, json.load(f), args.tolerance)
+            for name, old, new in regressions:
+                print(f'REGRESSION {name}: {old:.2f} -> {new:.2f}')
+            if regressions:
+                raise SystemExit(1)
+        raise SystemExit(0)
+
+    frames = loadFrames(args.input_file, args.frames)
+    if not frames:
+        raise SystemExit(f"No frames could be read from '{args.input_file}'.")
+
+    # The old loop: a discarded heavy pass on the full frame followed by the tracking pass.
+    legacy_fps = benchmarkInference(frames, 'tracking', legacy=True)
+    print(f"legacy (accurate full-res + tracking): {legacy_fps:7.2f} fps")
+
+    for mode in vg.POSE_MODES:
+        mode_fps = benchmarkInference(frames, mode)
+        print(f"{mode:<38}: {mode_fps:7.2f} fps ({mode_fps / legacy_fps:.1f}x)")
+
+        roi_fps = benchmarkInference(frames, mode, roi=True)
+        print(f"{mode + ' + roi':<38}: {roi_fps:7.2f} fps ({roi_fps / legacy_fps:.1f}x)")
@@ -0,0 +1,144 @@
+# Firestore and Storage clients shared by all requests and jobs of a worker process
+import os
+import threading
+
+# Connections kept open to Storage, enough for every analysis worker to download or upload at once
+storage_pool_size = int(os.environ.get('STORAGE_POOL_SIZE', 16))
+
+# Most writes Firestore accepts in one batch
+FIRESTORE_BATCH_LIMIT = 500
+
+# Service account key and options Firebase is initialized with, see configure_firebase
+firebase_credential_path = None
+firebase_options = None
+
+# The clients are created once per process, on first use, after Firebase is initialized
+db = None
+bucket = None
+clients_lock = threading.Lock()
+
+def configure_firebase(credential_path, options=None):
+    # Firebase is only initialized when a client is first needed, the service starts without loading it
+    global firebase_credential_path, firebase_options
+
+    with clients_lock:
+        firebase_credential_path = credential_path
+        firebase_options = options
+
+def _initialize_firebase():
+    # Called with clients_lock held. Without configure_firebase the default app must be initialized already.
+    import firebase_admin
+    from firebase_admin import credentials
+
+    try:
+        return firebase_admin.get_app()
+    except ValueError:
+        return firebase_admin.initialize_app(credentials.Certificate(firebase_credential_path), firebase_options)
+
+def get_db():
+    global db
+
+    with clients_lock:
+        if db is None:
+            _initialize_firebase()
+            from firebase_admin import firestore
+            db = firestore.client()
+        return db
+
+def get_bucket():
+    global bucket
+
+    with clients_lock:
+        if bucket is None:
+            app = _initialize_firebase()
+            import requests
+            from google.auth.transport.requests import AuthorizedSession
+            from google.cloud import storage
+
+            bucket_name = app.options.get('storageBucket')
+            if not bucket_name:
+                raise ValueError("Storage bucket name not specified, set the storageBucket option of Firebase")
+
+            # The Storage client sends every request through one HTTP session, whose default pool
+            # of 10 connections would make the analysis workers reconnect for each transfer, so the
+            # client is built on a session with a larger pool, the way firebase_admin builds its own
+            credential = app.credential.get_credential()
+            session = AuthorizedSession(credential)
+            adapter = requests.adapters.HTTPAdapter(pool_connections=storage_pool_size, pool_maxsize=storage_pool_size)
+            session.mount('https://', adapter)
+            client = storage.Client(project=app.project_id, credentials=credential, _http=session)
+            bucket = client.bucket(bucket_name)
+        return bucket
+
+def use_clients(firestore_db, storage_bucket):
+    # Replace the clients, like with the stand-ins of local_backends.py to run the service offline
+    global db, bucket
+
+    with clients_lock:
+        db = firestore_db
+        bucket = storage_bucket
+
+class BatchedWrites:
+    '''
+    Collects document updates from several threads and sends them to Firestore as batched writes,
+    one round trip per batch instead of one per document. A batch is committed as a whole, so when
+    it fails, like when one of its documents was deleted, its updates are sent again one by one and
+    only the failing ones fail.
+    Args:
+        db: The Firestore client.
+        batch_size: Updates per batch, a batch is committed as soon as it is full.
+    '''
+
+    def __init__(self, db, batch_size=FIRESTORE_BATCH_LIMIT):
+        self.db = db
+        self.batch_size = min(batch_size, FIRESTORE_BATCH_LIMIT)
+        self.lock = threading.Lock()
+        self.pending = []
+
+    def update(self, reference, fields, committed=None):
+        '''
+        Args:
+            reference: Reference of the document to update.
+            fields: Fields to update.
+            committed: Optional function called with None once the update is committed, or with the
+                       error when it failed. Without it, flush raises the error.
+        '''
+        with self.lock:
+            self.pending.append((reference, fields, committed))
+            full = len(self.pending) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        '''
+        Commits the pending updates.
+        '''
+        with self.lock:
+            pending, self.pending = self.pending, []
+        if not pending:
+            return
+        batch = self.db.batch()
+        for reference, fields, _ in pending:
+            batch.update(reference, fields)
+        try:
+            batch.commit()
+        except Exception:
+            errors = []
+            for reference, fields, _ in pending:
+                try:
+                    reference.update(fields)
+                except Exception as e:
+                    errors.append(e)
+                else:
+                    errors.append(None)
+        else:
+            errors = [None] * len(pending)
+
+        unreported = None
+        for (_, _, committed), error in zip(pending, errors):
+            if committed is not None:
+                committed(error)
+            elif error is not None and unreported is None:
+                unreported = error
+        if unreported is not None:
+            raise unreported
@@ -0,0 +1,467 @@
+# Persistent job queue for the video processing requests
+import heapq
+import time
+import uuid
+import sqlite3
+import itertools
+import threading
+from contextlib import contextmanager
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    athlete_id TEXT NOT NULL,
+    force INTEGER NOT NULL DEFAULT 0,
+    batch_id TEXT,
+    status TEXT NOT NULL,
+    error TEXT,
+    worker_id TEXT,
+    lease_expires_at REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job_videos (
+    job_id TEXT NOT NULL,
+    video_id TEXT NOT NULL,
+    video_number INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    frames_done INTEGER NOT NULL DEFAULT 0,
+    frames_total INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    PRIMARY KEY (job_id, video_id)
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+'''
+
+# Jobs are claimed from the batch with the fewest running jobs first, a job without a batch being its own
+# batch, so a single athlete's request does not wait behind the whole squad of a batch queued before it.
+_CLAIM_QUERY = '''
+SELECT * FROM jobs AS queued WHERE status = 'queued'
+ORDER BY (SELECT COUNT(*) FROM jobs AS running WHERE running.status = 'running'
+          AND COALESCE(running.batch_id, running.id) = COALESCE(queued.batch_id, queued.id)), created_at
+LIMIT 1
+'''
+
+# Seconds a claimed job stays leased to its worker without a renewal, see JobWorkers
+LEASE_SECONDS = 60
+
+# Fields of a video's progress that may be updated
+_VIDEO_FIELDS = ('status', 'frames_done', 'frames_total', 'error')
+
+
+class JobQueue:
+    '''
+    Job queue stored in a local SQLite file, so queued jobs survive a restart of the service.
+    Jobs go from 'queued' to 'running' to 'done' or 'failed', and each job keeps the
+    progress of its videos. Jobs queued together for several athletes share a batch ID.
+    Several processes may share the same file: a claimed job is leased to the queue that claimed it,
+    and is only queued again once its lease runs out without being renewed, when its process has stopped.
+    Args:
+        db_path: Path of the SQLite database file.
+        lease_seconds: Seconds a claimed job stays leased without a renewal.
+    '''
+
+    def __init__(self, db_path, lease_seconds=LEASE_SECONDS):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.worker_id = uuid.uuid4().hex
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(_SCHEMA)
+
+        # Add the columns introduced after the database file was created.
+        columns = {row['name'] for row in self.conn.execute('PRAGMA table_info(jobs)')}
+        if 'force' not in columns:
+            self.conn.execute('ALTER TABLE jobs ADD COLUMN force INTEGER NOT NULL DEFAULT 0')
+        if 'batch_id' not in columns:
+            self.conn.execute('ALTER TABLE jobs ADD COLUMN batch_id TEXT')
+        if 'worker_id' not in columns:
+            self.conn.execute('ALTER TABLE jobs ADD COLUMN worker_id TEXT')
+        if 'lease_expires_at' not in columns:
+            self.conn.execute('ALTER TABLE jobs ADD COLUMN lease_expires_at REAL')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch_id)')
+
+    def close(self):
+        self.conn.close()
+
+    def enqueue(self, athlete_id, force=False, batch_id=None):
+        '''
+        Args:
+            athlete_id: ID of the athlete whose videos are to be processed.
+            force: When true, videos are analysed again even if a cached result exists.
+            batch_id: Optional ID of the batch the job belongs to.
+        Returns:
+            job_id: ID of the queued job.
+        '''
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self.lock:
+            self.conn.execute('INSERT INTO jobs (id, athlete_id, force, batch_id, status, created_at, updated_at) '
+                              'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                              (job_id, athlete_id, int(force), batch_id, 'queued', now, now))
+        return job_id
+
+    def enqueue_batch(self, athlete_ids, force=False):
+        '''
+        Args:
+            athlete_ids: IDs of the athletes whose videos are to be processed, one job each.
+            force: When true, videos are analysed again even if a cached result exists.
+        Returns:
+            batch_id: ID of the batch.
+            job_ids: Dict of the ID of the queued job of each athlete.
+        '''
+        batch_id = uuid.uuid4().hex
+        now = time.time()
+        job_ids = {athlete_id: uuid.uuid4().hex for athlete_id in athlete_ids}
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                self.conn.executemany('INSERT INTO jobs (id, athlete_id, force, batch_id, status, created_at, updated_at) '
+                                      'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                      [(job_id, athlete_id, int(force), batch_id, 'queued', now, now)
+                                       for athlete_id, job_id in job_ids.items()])
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+        return batch_id, job_ids
+
+    def claim(self):
+        '''
+        Marks the next queued job as running and leases it to this queue, the oldest of the batch with
+        the fewest running jobs. Running jobs whose lease ran out are queued again first.
+        Returns:
+            job: The claimed job as a dict, or None when the queue is empty.
+        '''
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                now = time.time()
+                self._requeue_expired(now)
+                row = self.conn.execute(_CLAIM_QUERY).fetchone()
+                if row is not None:
+                    self.conn.execute("UPDATE jobs SET status = 'running', worker_id = ?, lease_expires_at = ?, updated_at = ? "
+                                      "WHERE id = ?", (self.worker_id, now + self.lease_seconds, now, row['id']))
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                raise
+        if row is None:
+            return None
+        return dict(row, status='running', force=bool(row['force']), worker_id=self.worker_id)
+
+    def renew(self, job_ids):
+        '''
+        Extends the lease of running jobs claimed by this queue.
+        Args:
+            job_ids: IDs of the jobs.
+        '''
+        now = time.time()
+        with self.lock:
+            self.conn.executemany("UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND status = 'running' AND worker_id = ?",
+                                  [(now + self.lease_seconds, job_id, self.worker_id) for job_id in job_ids])
+
+    def requeue_expired(self):
+        '''
+        Puts the running jobs whose lease ran out, left by a stopped service, back in the queue.
+        Returns:
+            count: Number of requeued jobs.
+        '''
+        with self.lock:
+            return self._requeue_expired(time.time())
+
+    def _requeue_expired(self, now):
+        # Called with the lock held. Jobs claimed before leases were recorded have none and are requeued.
+        cursor = self.conn.execute("UPDATE jobs SET status = 'queued', worker_id = NULL, lease_expires_at = NULL, updated_at = ? "
+                                   "WHERE status = 'running' AND (lease_expires_at IS NULL OR lease_expires_at < ?)",
+                                   (now, now))
+        return cursor.rowcount
+
+    def finish(self, job_id, error=None):
+        '''
+        Args:
+            job_id: ID of the job.
+            error: Error message when the job failed, None when it succeeded.
+        '''
+        with self.lock:
+            self.conn.execute('UPDATE jobs SET status = ?, error = ?, lease_expires_at = NULL, updated_at = ? WHERE id = ?',
+                              ('failed' if error else 'done', error, time.time(), job_id))
+
+    def add_video(self, job_id, video_id, video_number):
+        '''
+        Args:
+            job_id: ID of the job.
+            video_id: ID of the video document.
+            video_number: Position of the video within the athlete's videos.
+        '''
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO job_videos (job_id, video_id, video_number, status) VALUES (?, ?, ?, ?)',
+                              (job_id, video_id, video_number, 'queued'))
+
+    def update_video(self, job_id, video_id, **fields):
+        '''
+        Args:
+            job_id: ID of the job.
+            video_id: ID of the video document.
+            fields: New values for any of status, frames_done, frames_total and error.
+        '''
+        unknown = set(fields) - set(_VIDEO_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown video fields {sorted(unknown)}")
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        with self.lock:
+            self.conn.execute(f'UPDATE job_videos SET {assignments} WHERE job_id = ? AND video_id = ?',
+                              (*fields.values(), job_id, video_id))
+
+    def get(self, job_id):
+        '''
+        Args:
+            job_id: ID of the job.
+        Returns:
+            job: The job with the progress of its videos as a dict, or None when it does not exist.
+        '''
+        with self.lock:
+            row = self.conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None:
+                return None
+            videos = self.conn.execute('SELECT video_id, video_number, status, frames_done, frames_total, error '
+                                       'FROM job_videos WHERE job_id = ? ORDER BY video_number', (job_id,)).fetchall()
+        job = dict(row)
+        job['videos'] = [dict(video) for video in videos]
+        return job
+
+    def get_batch(self, batch_id):
+        '''
+        Args:
+            batch_id: ID of the batch.
+        Returns:
+            batch: The batch with the status of its jobs as a dict, or None when it does not exist.
+        '''
+        with self.lock:
+            rows = self.conn.execute('SELECT id, athlete_id, status, error, created_at, updated_at FROM jobs '
+                                     'WHERE batch_id = ? ORDER BY created_at, athlete_id', (batch_id,)).fetchall()
+        if not rows:
+            return None
+
+        jobs = [dict(row) for row in rows]
+        counts = {}
+        for job in jobs:
+            counts[job['status']] = counts.get(job['status'], 0) + 1
+
+        # The batch is running until none of its jobs is queued or running
+        if counts.get('queued', 0) + counts.get('running', 0):
+            status = 'running' if len(counts) > 1 or 'running' in counts else 'queued'
+        else:
+            status = 'failed' if 'failed' in counts else 'done'
+        return {'id': batch_id, 'status': status, 'counts': counts, 'jobs': jobs}
+
+    def depth(self):
+        '''
+        Returns:
+            count: Number of jobs waiting in the queue.
+        '''
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+
+
+class VideoProgress:
+    '''
+    Progress callback recording the frames processed for one video of a job. It only holds
+    the database path, so it can be passed to the analysis worker processes.
+    Args:
+        db_path: Path of the job queue database file.
+        job_id: ID of the job.
+        video_id: ID of the video document.
+    '''
+
+    def __init__(self, db_path, job_id, video_id):
+        self.db_path = db_path
+        self.job_id = job_id
+        self.video_id = video_id
+        self._queue = None
+
+    def __getstate__(self):
+        return {'db_path': self.db_path, 'job_id': self.job_id, 'video_id': self.video_id, '_queue': None}
+
+    def __call__(self, frames_done, frames_total):
+        if self._queue is None:
+            self._queue = JobQueue(self.db_path)
+        self._queue.update_video(self.job_id, self.video_id, frames_done=frames_done, frames_total=frames_total)
+
+
+class JobWorkers:
+    '''
+    Threads draining a JobQueue. Each claimed job is passed to the handler, which raises to mark it failed.
+    The leases of the running jobs are renewed by a heartbeat thread, every third of the lease.
+    Args:
+        queue: The JobQueue to drain.
+        handler: Function called as handler(job, queue) for every claimed job.
+        workers: Number of jobs processed at the same time.
+        poll_interval: Seconds to wait before looking at an empty queue again.
+    '''
+
+    def __init__(self, queue, handler, workers=1, poll_interval=1.0):
+        self.queue = queue
+        self.handler = handler
+        self.poll_interval = poll_interval
+        self.stop_event = threading.Event()
+        self.wake_event = threading.Event()
+        self.running = set()
+        self.running_lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._run, name=f'JobWorker-{i}', daemon=True) for i in range(workers)]
+        self.threads.append(threading.Thread(target=self._heartbeat, name='JobHeartbeat', daemon=True))
+
+    def start(self):
+        # Jobs interrupted by a previous shutdown are picked up again once their lease has run out, the
+        # jobs of the other processes sharing the queue are left to them.
+        self.queue.requeue_expired()
+        for thread in self.threads:
+            thread.start()
+
+    def notify(self):
+        '''
+        Wakes the idle workers up after a job was queued.
+        '''
+        self.wake_event.set()
+
+    def stop(self):
+        self.stop_event.set()
+        self.wake_event.set()
+        for thread in self.threads:
+            thread.join()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            job = self.queue.claim()
+            if job is None:
+                self.wake_event.wait(self.poll_interval)
+                self.wake_event.clear()
+                continue
+
+            with self.running_lock:
+                self.running.add(job['id'])
+            try:
+                self.handler(job, self.queue)
+            except Exception as e:
+                print(f"Job {job['id']} failed:", e)
+                self.queue.finish(job['id'], error=str(e))
+            else:
+                self.queue.finish(job['id'])
+            finally:
+                with self.running_lock:
+                    self.running.discard(job['id'])
+
+    def _heartbeat(self):
+        while not self.stop_event.wait(self.queue.lease_seconds / 3):
+            with self.running_lock:
+                job_ids = list(self.running)
+            if not job_ids:
+                continue
+            try:
+                self.queue.renew(job_ids)
+            except Exception as e:
+                print("Renewing the job leases failed:", e)
+
+
+class FairScheduler:
+    '''
+    Shares the analysis slots of the service between the videos of all running jobs. At most `slots`
+    analyses run at the same time and their estimated memory stays within the budget, a single analysis
+    larger than the budget running alone. The waiting analyses get the free slots in the order of the policy:
+    'round_robin' takes turns between the groups, the athletes, each group's own analyses going shortest
+    first, so a squad of athletes cannot hold back a single one; 'shortest' runs the shortest waiting
+    analysis of any group first.
+    Args:
+        slots: Number of analyses running at the same time.
+        memory_budget: Bytes of memory the running analyses may use together, or None for no limit.
+        policy: One of POLICIES.
+    '''
+
+    POLICIES = ('round_robin', 'shortest')
+
+    def __init__(self, slots, memory_budget=None, policy='round_robin'):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown scheduling policy {policy!r}, expected one of {self.POLICIES}")
+        self.slots = slots
+        self.memory_budget = memory_budget
+        self.policy = policy
+        self.condition = threading.Condition()
+        self.running = 0
+        self.memory = 0
+
+        # Heap of the waiting analyses of each group, as [cost, order, memory, granted] entries
+        self.waiting = {}
+
+        # Running analyses of each group, and when each group waiting or running was last given a slot
+        self.group_running = {}
+        self.served = {}
+        self.order = itertools.count()
+
+    @contextmanager
+    def slot(self, group, cost=0, memory=0):
+        '''
+        Waits for a slot and holds it for the duration of the with block.
+        Args:
+            group: Key the analyses take turns by, the athlete ID.
+            cost: Estimated cost of the analysis, the size of the video, shorter ones go first.
+            memory: Estimated bytes of memory of the analysis.
+        '''
+        entry = [cost, next(self.order), memory, False]
+        with self.condition:
+            heapq.heappush(self.waiting.setdefault(group, []), entry)
+            self._dispatch()
+            while not entry[3]:
+                self.condition.wait()
+
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.running -= 1
+                self.memory -= memory
+                self.group_running[group] -= 1
+                if not self.group_running[group]:
+                    del self.group_running[group]
+                    if group not in self.waiting:
+                        del self.served[group]
+                self._dispatch()
+
+    def waiting_count(self):
+        '''
+        Returns:
+            count: Number of analyses waiting for a slot.
+        '''
+        with self.condition:
+            return sum(len(entries) for entries in self.waiting.values())
+
+    def _next_group(self):
+        if self.policy == 'shortest':
+            return min(self.waiting, key=lambda group: self.waiting[group][0][:2])
+
+        # The group given a slot longest ago goes next, a new group first, and ties go to the longest waiting.
+        return min(self.waiting, key=lambda group: (self.served.get(group, -1), self.waiting[group][0][1]))
+
+    def _dispatch(self):
+        # Called with the condition held, grants the free slots to the next waiting analyses.
+        granted = False
+        while self.waiting and self.running < self.slots:
+            group = self._next_group()
+            entry = self.waiting[group][0]
+            if (self.memory_budget is not None and self.running
+                    and self.memory + entry[2] > self.memory_budget):
+                break
+
+            heapq.heappop(self.waiting[group])
+            if not self.waiting[group]:
+                del self.waiting[group]
+            entry[3] = True
+            self.running += 1
+            self.memory += entry[2]
+            self.group_running[group] = self.group_running.get(group, 0) + 1
+            self.served[group] = next(self.order)
+            granted = True
+
+        if granted:
+            self.condition.notify_all()
@@ -0,0 +1,166 @@
+# Landmark track files, for re-scoring analysed videos without running the pose detection again
+import json
+import numpy as np
+
+# Number of pose landmarks per frame and values stored per landmark (x, y, z, visibility)
+NUM_LANDMARKS = 33
+LANDMARK_VALUES = 4
+
+
+class LandmarkTrackWriter:
+    '''
+    Collects the landmarks of every frame of a video and saves them as a compressed NPZ file
+    with one column per field: 'frame' (N,), 'timestamp' (N,) in seconds and 'landmarks'
+    (N, 33, 4) float64 holding x, y and z in pixels of the analysed frame and the visibility.
+    Frames without a detected gymnast have NaN landmarks. The landmarks are the ones classified, smoothed
+    when the analysis smooths them, in the precision they were classified in, so that re-scoring finds
+    the same angles at the bounds of the rules. A 'transition' field holds the (required, window) frames
+    of the TransitionHysteresis the analysis used, if any.
+    Args:
+        path: Path of the .npz file to write.
+        fps: Frame rate of the video, used for the timestamps.
+        frame_size: (width, height) of the analysed frames.
+        capacity: Initial number of frames to allocate room for.
+        transition: Optional (required, window) of the TransitionHysteresis of the analysis.
+    '''
+
+    def __init__(self, path, fps, frame_size=(0, 0), capacity=1024, transition=None):
+        self.path = path
+        self.fps = fps
+        self.frame_size = frame_size
+        self.transition = transition
+        self.count = 0
+        self.frames = np.empty(capacity, dtype=np.int32)
+        self.landmarks = np.empty((capacity, NUM_LANDMARKS, LANDMARK_VALUES), dtype=np.float64)
+
+    def append(self, frame_index, landmarks):
+        '''
+        Args:
+            frame_index: Index of the frame in the video.
+            landmarks: (33, 4) array of the detected landmarks, or an empty array when none were detected.
+        '''
+
+        # Double the buffers when they are full.
+        if self.count == len(self.frames):
+            self.frames = np.resize(self.frames, 2 * len(self.frames))
+            self.landmarks = np.resize(self.landmarks, (2 * len(self.landmarks), NUM_LANDMARKS, LANDMARK_VALUES))
+
+        self.frames[self.count] = frame_index
+        self.landmarks[self.count] = landmarks if len(landmarks) else np.nan
+        self.count += 1
+
+    def close(self):
+        '''
+        Writes the track file.
+        '''
+        frames = self.frames[:self.count]
+        timestamps = frames / self.fps if self.fps else np.zeros(self.count)
+        extra = {} if self.transition is None else {'transition': np.asarray(self.transition)}
+        np.savez_compressed(self.path, frame=frames, timestamp=timestamps, landmarks=self.landmarks[:self.count],
+                            fps=self.fps, frame_size=np.asarray(self.frame_size), **extra)
+
+
+# Function to load a landmark track file
+def loadTrack(path):
+    '''
+    Args:
+        path: Path of the .npz file written by LandmarkTrackWriter.
+    Returns:
+        track: Dict of the 'frame', 'timestamp', 'landmarks', 'fps' and 'frame_size' arrays, and the
+               'transition' of smoothed analyses.
+    '''
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+
+# Function to rebuild the phase labels and deductions of a video from its landmark track
+def rescoreTrack(track, rules=None):
+    '''
+    Args:
+        track: Dict of arrays, as returned by loadTrack.
+        rules: The pose_rules.PoseRules to classify the poses with, the default rule table when None.
+    Returns:
+        results: List with one dict per frame with a detected gymnast, holding its 'frame',
+                 'timestamp', 'label' and 'deductions', as the analysis would have produced them.
+    '''
+    # Imported here, as the analyzer itself imports this module to write the tracks.
+    from Vault_Gymnast import TransitionHysteresis, advanceState, calculateAngles, poseDeductions
+    from pose_rules import defaultPoseRules
+
+    # Tracks written before the landmarks were kept in float64 hold float32.
+    landmarks = track['landmarks'].astype(np.float64)
+    detected = ~np.isnan(landmarks).any(axis=(1, 2))
+    points = landmarks[detected, :, :3]
+
+    # The angles and matched poses of every frame are calculated at once, only the state machine runs frame by frame.
+    angles = calculateAngles(points)
+    states = (rules or defaultPoseRules()).classify(angles)
+
+    # Tracks of smoothed analyses confirm the transitions the same way.
+    hysteresis = TransitionHysteresis(*track['transition'].tolist()) if 'transition' in track else None
+
+    results = []
+    prev_state = 0
+    for frame, timestamp, frame_points, frame_angles, state in zip(track['frame'][detected],
+                                                                   track['timestamp'][detected], points, angles, states):
+        prev_state, label = advanceState(prev_state, state, hysteresis)
+        results.append({'frame': int(frame), 'timestamp': float(timestamp), 'label': label,
+                        'deductions': poseDeductions(label, frame_points, frame_angles)})
+    return results
+
+
+# Function to summarise the rescored frames per phase
+def summarizePhases(results):
+    '''
+    Args:
+        results: Per-frame results, as returned by rescoreTrack.
+    Returns:
+        phases: List of dicts with the 'label', 'start' and 'end' timestamps and the largest
+                'deductions' of each phase, in the order the phases were reached.
+    '''
+    phases = []
+    for result in results:
+        if not phases or phases[-1]['label'] != result['label']:
+            phases.append({'label': result['label'], 'start': result['timestamp'], 'deductions': {}})
+        phase = phases[-1]
+        phase['end'] = result['timestamp']
+        for name, value in result['deductions'].items():
+            phase['deductions'][name] = max(value, phase['deductions'].get(name, 0))
+    return phases
+
+
+# Function to build the score report of a video from its rescored frames
+def scoreResults(results, fps):
+    '''
+    Args:
+        results: Per-frame results, as returned by rescoreTrack.
+        fps: Frame rate of the video.
+    Returns:
+        report: The score report of the attempt, see scoring.PhaseScorer.report.
+    '''
+    from scoring import PhaseScorer
+
+    scorer = PhaseScorer(fps)
+    for result in results:
+        scorer.add(result['frame'], result['label'], result['deductions'])
+    return scorer.report()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Re-score an analysed video from its landmark track file.')
+    parser.add_argument('track_path')
+    parser.add_argument('--frames', action='store_true', help='print the result of every frame instead of the phases')
+    parser.add_argument('--report', action='store_true', help='print the score report instead of the phases')
+    parser.add_argument('--rules', default=None, help='.json or .yaml pose rule table to re-score with')
+    args = parser.parse_args()
+
+    from pose_rules import loadPoseRules
+
+    track = loadTrack(args.track_path)
+    results = rescoreTrack(track, loadPoseRules(args.rules) if args.rules else None)
+    if args.report:
+        print(json.dumps(scoreResults(results, float(track['fps'])), indent=2))
+    else:
+        print(json.dumps(results if args.frames else summarizePhases(results), indent=2))
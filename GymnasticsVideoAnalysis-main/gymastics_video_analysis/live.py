@@ -0,0 +1,262 @@
+# Live analysis of a vault from a camera or a network stream, reporting the phases and deductions as they happen
+import os
+import json
+import cv2
+from time import perf_counter
+
+from Vault_Gymnast import (POSE_MODES, SMOOTHING_BETA, SMOOTHING_D_CUTOFF, SMOOTHING_MIN_CUTOFF,
+                           TRANSITION_FRAMES, TRANSITION_WINDOW, TransitionHysteresis, VaultAnalyzer,
+                           calculateAngles, classifyState, detectPose, drawLandmarks, drawPoseLabels,
+                           poseDeductions, prepareFrame)
+from video_io import LatestFrameReader
+from scoring import PhaseScorer
+from smoothing import LandmarkSmoother
+from metrics import FRAME_BUCKETS, LATENCY_BUCKETS, Histogram, timed
+
+# Frame rate assumed for sources that do not report theirs
+LIVE_DEFAULT_FPS = 30.0
+
+# Seconds the Complete pose is followed before the attempt is reported, when the gymnast stays in view
+LIVE_COMPLETE_SECONDS = 1.0
+
+# Seconds without a gymnast after which an attempt that was started is reported as it is
+LIVE_LOST_SECONDS = 2.0
+
+
+# Function to open a live source
+def openSource(source):
+    '''
+    Args:
+        source: Index of a camera, like 0 or '0', or the URL of a stream, like 'rtsp://...'. A path of a
+                video file stands in for a camera, its frames are replayed at the frame rate of the video.
+    Returns:
+        video: The opened cv2.VideoCapture.
+        fps: Frame rate of the source.
+        replay_fps: The frame rate a video file is replayed at, or None for sources that are live themselves.
+    '''
+    if isinstance(source, int) or str(source).isdigit():
+        video = cv2.VideoCapture(int(source))
+        is_file = False
+    else:
+        is_file = os.path.isfile(source)
+        video = cv2.VideoCapture(source)
+    if not video.isOpened():
+        raise IOError(f"Could not open live source '{source}'")
+
+    # Keep as few frames as possible buffered by the capture itself, they would only add to the latency.
+    if not is_file:
+        video.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+    fps = video.get(cv2.CAP_PROP_FPS) or LIVE_DEFAULT_FPS
+    return video, fps, fps if is_file else None
+
+
+class LiveAnalysis:
+    '''
+    Follows the vault state machine over the frames of a live source, one attempt after the other, and
+    turns it into events. Every event is a dict with its 'type', the 'frame' index and 'timestamp' in
+    seconds since the start of the source and the end-to-end 'latency' in seconds from the capture of
+    the frame to the event:
+        'phase': the gymnast reached the phase 'label'.
+        'deduction': the deduction 'name' of the phase 'label' reached the 'value', sent whenever it
+                     gets larger within the phase.
+        'attempt': the attempt ended, with its score 'report' (see scoring.PhaseScorer.report). It ends
+                   LIVE_COMPLETE_SECONDS after the Complete pose or once the gymnast is lost, and the
+                   analysis waits for the next Jump.
+    Args:
+        analyzer: The VaultAnalyzer whose pose model, rules and smoothing are used.
+        fps: Frame rate of the source, for the timestamps of the reports.
+        on_event: Function called with every event, on the analysis thread.
+    '''
+
+    def __init__(self, analyzer, fps, on_event):
+        self.analyzer = analyzer
+        self.fps = fps
+        self.on_event = on_event
+        self.smoother = self.hysteresis = None
+        if analyzer.smoothing:
+            self.smoother = LandmarkSmoother(SMOOTHING_MIN_CUTOFF, SMOOTHING_BETA, SMOOTHING_D_CUTOFF)
+            self.hysteresis = TransitionHysteresis(TRANSITION_FRAMES, TRANSITION_WINDOW)
+        self.attempts = 0
+        self._newAttempt()
+
+    def _newAttempt(self):
+        self.prev_state = 0
+        self.label = None
+        self.reported = {}
+        self.complete_time = None
+        self.seen_time = None
+        self.scorer = PhaseScorer(self.fps)
+        if self.hysteresis is not None:
+            self.hysteresis.reset()
+
+    def _emit(self, event_type, index, timestamp, captured, **fields):
+        event = {'type': event_type, 'frame': index, 'timestamp': round(timestamp, 3), **fields}
+        event['latency'] = perf_counter() - captured
+        self.on_event(event)
+
+    def _endAttempt(self, index, timestamp, captured):
+        self.attempts += 1
+        self._emit('attempt', index, timestamp, captured, report=self.scorer.report())
+        self._newAttempt()
+
+    def update(self, index, timestamp, captured, landmarks):
+        '''
+        Args:
+            index: Index of the frame in the source.
+            timestamp: Seconds since the start of the source.
+            captured: time.perf_counter() at which the frame was captured.
+            landmarks: (33, 4) array of the detected landmarks of the frame, or an empty array.
+        Returns:
+            label: The phase label of the frame, or None without a gymnast.
+            deductions: Dict of the deductions of the frame, or None without a gymnast.
+            landmarks: The landmarks, smoothed when the analyzer smooths them.
+        '''
+        if self.smoother is not None:
+            landmarks = self.smoother(landmarks, timestamp)
+
+        # Without a gymnast, a started attempt ends once they are gone for long enough, at once after the Complete pose.
+        if not len(landmarks):
+            if self.prev_state > 0 and (self.prev_state == 5 or timestamp - self.seen_time >= LIVE_LOST_SECONDS):
+                self._endAttempt(index, timestamp, captured)
+            return None, None, landmarks
+        self.seen_time = timestamp
+
+        angles = calculateAngles(landmarks[:, :3])
+        self.prev_state, label = classifyState(self.prev_state, angles, self.hysteresis, self.analyzer.rules)
+        deductions = poseDeductions(label, landmarks[:, :3], angles)
+        self.scorer.add(index, label, deductions)
+
+        if self.prev_state == 0:
+            return label, deductions, landmarks
+
+        # Report the phase when it is reached, and each deduction of the phase when it gets worse.
+        if label != self.label:
+            self.label = label
+            self.reported = {}
+            self._emit('phase', index, timestamp, captured, label=label)
+        for name, value in deductions.items():
+            if value > self.reported.get(name, 0):
+                self.reported[name] = value
+                self._emit('deduction', index, timestamp, captured, label=label, name=name, value=value)
+
+        if self.prev_state == 5:
+            if self.complete_time is None:
+                self.complete_time = timestamp
+            elif timestamp - self.complete_time >= LIVE_COMPLETE_SECONDS:
+                self._endAttempt(index, timestamp, captured)
+        return label, deductions, landmarks
+
+    def finish(self, index, timestamp, captured):
+        '''
+        Reports the attempt in progress at the end of the source, if any.
+        '''
+        if self.prev_state > 0:
+            self._endAttempt(index, timestamp, captured)
+
+
+# Function to analyse a live source until it ends or is stopped
+def analyzeLive(analyzer, source, on_event, stop_event=None, display=False, max_seconds=None):
+    '''
+    Args:
+        analyzer: The VaultAnalyzer whose pose model, ROI detection, rules and smoothing are used. Its frame
+                  sampling is not, frames are dropped instead whenever the analysis falls behind.
+        source: Camera index, stream URL or video file, see openSource.
+        on_event: Function called with every event, see LiveAnalysis.
+        stop_event: Optional threading.Event that stops the analysis.
+        display: When true, the analysed frames are shown in a window with the landmarks and labels
+                 drawn, pressing q stops the analysis.
+        max_seconds: Optional number of seconds after which the analysis stops.
+    Returns:
+        stats: Number of frames 'read' from the source, frames 'analysed' and 'dropped', elapsed 'seconds',
+               analysed frames per second, number of 'attempts', the 'frame_timings' histogram snapshot of
+               the seconds per frame of each stage and the 'latency' histogram snapshot of the seconds
+               from the capture of each analysed frame to the end of its analysis.
+    '''
+    video, fps, replay_fps = openSource(source)
+
+    # Restart the graph so no tracking state leaks from the previous video.
+    analyzer.pose.reset()
+    if analyzer.roi_detector is not None:
+        analyzer.roi_detector.reset()
+
+    frame_timings = Histogram('vault_frame_stage_seconds', buckets=FRAME_BUCKETS)
+    latency = Histogram('vault_live_latency_seconds', buckets=LATENCY_BUCKETS)
+    analysis = LiveAnalysis(analyzer, fps, on_event)
+
+    reader = LatestFrameReader(video, replay_fps)
+    analysed = 0
+    index = captured = 0
+    try:
+        for index, captured, frame in reader:
+            timestamp = captured - reader.start
+
+            with timed(frame_timings, stage='prepare'):
+                frame = prepareFrame(frame)
+
+            with timed(frame_timings, stage='inference'):
+                if analyzer.roi_detector is not None:
+                    _, landmarks = analyzer.roi_detector.detect(frame)
+                else:
+                    _, landmarks = detectPose(frame, analyzer.pose, display=False, visibility=True, draw=False)
+
+            with timed(frame_timings, stage='classify'):
+                label, deductions, classified = analysis.update(index, timestamp, captured, landmarks)
+            latency.observe(perf_counter() - captured)
+            analysed += 1
+
+            if display:
+                if len(landmarks):
+                    drawLandmarks(frame, landmarks)
+                    drawPoseLabels(frame, classified[:, :3], label, deductions)
+                    cv2.putText(frame, label, (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2, cv2.LINE_AA)
+                cv2.imshow('Vault', frame)
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
+
+            if stop_event is not None and stop_event.is_set():
+                break
+            if max_seconds is not None and timestamp >= max_seconds:
+                break
+
+        analysis.finish(index, captured - reader.start, captured)
+    finally:
+        reader.close()
+        video.release()
+        if display:
+            cv2.destroyAllWindows()
+
+    elapsed = perf_counter() - reader.start
+    return {'read': reader.read, 'analysed': analysed, 'dropped': reader.dropped,
+            'seconds': elapsed, 'fps': analysed / elapsed if elapsed > 0 else 0.0, 'attempts': analysis.attempts,
+            'frame_timings': frame_timings.snapshot(), 'latency': latency.snapshot()}
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Analyse vaults live from a camera or a stream, printing the '
+                                                 'phase, deduction and attempt events as JSON lines.')
+    parser.add_argument('source', nargs='?', default='0',
+                        help='camera index, stream URL like rtsp://..., or a video file replayed in real time')
+    parser.add_argument('--mode', choices=sorted(POSE_MODES), default='tracking',
+                        help='pose inference mode, see Vault_Gymnast.POSE_MODES')
+    parser.add_argument('--roi', action='store_true', help='detect the pose in a crop around the gymnast')
+    parser.add_argument('--smooth', action='store_true',
+                        help='smooth the landmarks over time and confirm phase transitions over several frames')
+    parser.add_argument('--rules', default=None, help='.json or .yaml pose rule table, see pose_rules.json')
+    parser.add_argument('--display', action='store_true', help='show the analysed frames in a window')
+    parser.add_argument('--seconds', type=float, default=None, help='stop after this many seconds')
+    args = parser.parse_args()
+
+    def printEvent(event):
+        print(json.dumps(event), flush=True)
+
+    with VaultAnalyzer(args.mode, roi=args.roi, smoothing=args.smooth, rules=args.rules, render=False) as analyzer:
+        stats = analyzeLive(analyzer, args.source, printEvent, display=args.display, max_seconds=args.seconds)
+
+    # The latency of every analysed frame is in one series, without labels.
+    _, _, latency_sum, latency_count = stats['latency']['series'][0] if stats['latency']['series'] else (0, 0, 0, 0)
+    print(f"Analysed {stats['analysed']} of {stats['read']} frames ({stats['dropped']} dropped) at "
+          f"{stats['fps']:.2f} fps, {1000 * latency_sum / max(latency_count, 1):.1f} ms mean latency, "
+          f"{stats['attempts']} attempts.")
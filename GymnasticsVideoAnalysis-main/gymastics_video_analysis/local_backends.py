@@ -0,0 +1,294 @@
+# Local stand-ins for the Firebase services, for running and measuring the service offline
+import os
+import base64
+import shutil
+import hashlib
+import threading
+
+from google.api_core.exceptions import NotFound
+
+
+class LocalBucket:
+    '''
+    Storage bucket kept in a local folder, with the parts of the google.cloud.storage
+    Bucket interface used by the service.
+    Args:
+        root: Folder holding the blobs, blob names are paths relative to it.
+    '''
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def blob(self, blob_name):
+        return LocalBlob(self, blob_name)
+
+    def get_blob(self, blob_name):
+        blob = self.blob(blob_name)
+        if not blob.exists():
+            return None
+        blob.reload()
+        return blob
+
+
+class LocalBlob:
+    '''
+    Blob of a LocalBucket, with the parts of the google.cloud.storage Blob interface used by the service.
+    Args:
+        bucket: The LocalBucket holding the blob.
+        name: Name of the blob.
+    '''
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.md5_hash = None
+        self.crc32c = None
+        self.generation = None
+        self.size = None
+
+    @property
+    def path(self):
+        return os.path.join(self.bucket.root, self.name)
+
+    @property
+    def public_url(self):
+        return 'file://' + os.path.abspath(self.path)
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def reload(self):
+        '''
+        Loads the metadata of the blob, like the MD5 hash Storage computes on upload.
+        '''
+        if not self.exists():
+            raise NotFound(f"No such object: {self.name}")
+        md5 = hashlib.md5()
+        with open(self.path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                md5.update(chunk)
+        stat = os.stat(self.path)
+        self.md5_hash = base64.b64encode(md5.digest()).decode()
+        self.generation = stat.st_mtime_ns
+        self.size = stat.st_size
+
+    def download_to_filename(self, filename):
+        if not self.exists():
+            raise NotFound(f"No such object: {self.name}")
+        shutil.copyfile(self.path, filename)
+
+    def download_as_bytes(self, start=None, end=None):
+        if not self.exists():
+            raise NotFound(f"No such object: {self.name}")
+        with open(self.path, 'rb') as f:
+            f.seek(start or 0)
+            return f.read() if end is None else f.read(end + 1 - (start or 0))
+
+    def upload_from_filename(self, filename, content_type=None):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        shutil.copyfile(filename, self.path)
+
+    def open(self, mode='r', chunk_size=None, **kwargs):
+        '''
+        Opens the blob for chunked reading ('rb') or writing ('wb'). A written blob only
+        appears once the writer is closed, like a resumable upload.
+        '''
+        if mode == 'rb':
+            if not self.exists():
+                raise NotFound(f"No such object: {self.name}")
+            return open(self.path, 'rb')
+        if mode == 'wb':
+            return _LocalBlobWriter(self.path)
+        raise ValueError(f"Unsupported mode '{mode}'")
+
+
+class _LocalBlobWriter:
+    # Writes to a temporary file that replaces the blob when closed, or is discarded by terminate().
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.file = open(path + '.partial', 'wb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+    def write(self, data):
+        return self.file.write(data)
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+            os.replace(self.path + '.partial', self.path)
+
+    def terminate(self):
+        if not self.file.closed:
+            self.file.close()
+            os.remove(self.path + '.partial')
+
+
+class LocalFirestore:
+    '''
+    Firestore database kept in memory, with the parts of the google.cloud.firestore Client
+    interface used by the service. Every request that would go to Firestore is counted in round_trips.
+    '''
+
+    def __init__(self):
+        self.documents = {}
+        self.round_trips = 0
+        self.lock = threading.Lock()
+
+    def collection(self, name):
+        return LocalCollection(self, name)
+
+    def collection_group(self, name):
+        return LocalCollection(self, name, group=True)
+
+    def get_all(self, references, field_paths=None):
+        self._request()
+        return [self._snapshot(reference.path, field_paths) for reference in references]
+
+    def batch(self):
+        return LocalWriteBatch(self)
+
+    def _request(self):
+        with self.lock:
+            self.round_trips += 1
+
+    def _snapshot(self, path, fields=None):
+        with self.lock:
+            data = self.documents.get(path)
+            if data is not None:
+                data = dict(data) if fields is None else {k: v for k, v in data.items() if k in fields}
+        return LocalDocumentSnapshot(LocalDocument(self, path), data)
+
+    def _update(self, updates):
+        # Like a Firestore write batch, either all the updates are applied or none.
+        with self.lock:
+            for path, _ in updates:
+                if path not in self.documents:
+                    raise NotFound(f"No document to update: {path}")
+            for path, fields in updates:
+                self.documents[path].update(fields)
+
+
+class LocalCollection:
+    '''
+    Collection of a LocalFirestore, also standing for a query returning only the given fields,
+    or for the collection group of all collections with the name.
+    Args:
+        db: The LocalFirestore holding the collection.
+        path: Path of the collection, or its name for a collection group.
+        fields: Field paths returned by get(), or None for whole documents.
+        group: Whether the query is over the collection group.
+    '''
+
+    def __init__(self, db, path, fields=None, group=False):
+        self.db = db
+        self.path = path
+        self.fields = fields
+        self.group = group
+        self.id = path.split('/')[-1]
+
+    @property
+    def parent(self):
+        if '/' not in self.path:
+            return None
+        return LocalDocument(self.db, self.path.rsplit('/', 1)[0])
+
+    def document(self, document_id):
+        return LocalDocument(self.db, f'{self.path}/{document_id}')
+
+    def select(self, field_paths):
+        return LocalCollection(self.db, self.path, list(field_paths), self.group)
+
+    def get(self):
+        self.db._request()
+        with self.db.lock:
+            paths = sorted(path for path in self.db.documents if self._contains(path))
+        return [self.db._snapshot(path, self.fields) for path in paths]
+
+    def _contains(self, path):
+        collection = path.rsplit('/', 1)[0]
+        if self.group:
+            return collection.split('/')[-1] == self.path
+        return collection == self.path
+
+
+class LocalDocument:
+    '''
+    Document reference of a LocalFirestore.
+    Args:
+        db: The LocalFirestore holding the document.
+        path: Path of the document.
+    '''
+
+    def __init__(self, db, path):
+        self.db = db
+        self.path = path
+        self.id = path.split('/')[-1]
+
+    @property
+    def parent(self):
+        return LocalCollection(self.db, self.path.rsplit('/', 1)[0])
+
+    def collection(self, name):
+        return LocalCollection(self.db, f'{self.path}/{name}')
+
+    def get(self):
+        self.db._request()
+        return self.db._snapshot(self.path)
+
+    def set(self, fields):
+        self.db._request()
+        with self.db.lock:
+            self.db.documents[self.path] = dict(fields)
+
+    def update(self, fields):
+        self.db._request()
+        self.db._update([(self.path, fields)])
+
+
+class LocalDocumentSnapshot:
+    '''
+    Document read from a LocalFirestore. Like Firestore, get() raises KeyError for a field the document does not have.
+    '''
+
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return None if self._data is None else dict(self._data)
+
+    def get(self, field_path):
+        if self._data is None or field_path not in self._data:
+            raise KeyError(field_path)
+        return self._data[field_path]
+
+
+class LocalWriteBatch:
+    '''
+    Write batch of a LocalFirestore, its updates are sent in one request on commit().
+    '''
+
+    def __init__(self, db):
+        self.db = db
+        self.updates = []
+
+    def update(self, reference, fields):
+        self.updates.append((reference.path, dict(fields)))
+
+    def commit(self):
+        self.db._request()
+        updates, self.updates = self.updates, []
+        self.db._update(updates)
@@ -0,0 +1,232 @@
+# Counters, gauges and histograms of the service, exposed in the Prometheus text format
+import math
+import threading
+from time import perf_counter
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the buckets of per-frame timings
+FRAME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# Upper bounds in seconds of the buckets of per-video stage timings
+STAGE_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+# Upper bounds in seconds of the buckets of the latency of live analysis, from the capture of a frame to its result
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.15, 0.25, 0.5, 1.0, 2.5)
+
+# Upper bounds of the buckets of frames per second
+FPS_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 45, 60, 90, 120)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key):
+    if not key:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in key)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(key, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    '''
+    Monotonically increasing count, per combination of label values.
+    Args:
+        name: Metric name, ending in '_total' by convention.
+        help: Description of the metric.
+    '''
+    type = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, key, value) for key, value in self.values.items()]
+
+
+class Gauge:
+    '''
+    Value that goes up and down, either set directly or read from a function when the metrics are rendered.
+    Args:
+        name: Metric name.
+        help: Description of the metric.
+        function: Optional function returning the current value.
+    '''
+    type = 'gauge'
+
+    def __init__(self, name, help, function=None):
+        self.name = name
+        self.help = help
+        self.function = function
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[_label_key(labels)] = value
+
+    def samples(self):
+        if self.function is not None:
+            return [(self.name, (), self.function())]
+        with self.lock:
+            return [(self.name, key, value) for key, value in self.values.items()]
+
+
+class Histogram:
+    '''
+    Distribution of observed values in cumulative buckets, per combination of label values.
+    Histograms filled in another process are added with merge().
+    Args:
+        name: Metric name.
+        help: Description of the metric.
+        buckets: Sorted upper bounds of the buckets, a +Inf bucket is always added.
+    '''
+    type = 'histogram'
+
+    def __init__(self, name, help='', buckets=STAGE_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets) + (math.inf,)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _series(self, key):
+        # Per bucket counts, the sum and the count of the observations
+        if key not in self.values:
+            self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+        return self.values[key]
+
+    def observe(self, value, **labels):
+        with self.lock:
+            series = self._series(_label_key(labels))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self):
+        '''
+        Returns:
+            snapshot: Picklable copy of the observations, for merge().
+        '''
+        with self.lock:
+            return {'buckets': self.buckets[:-1],
+                    'series': [(dict(key), list(counts), total, count) for key, (counts, total, count) in self.values.items()]}
+
+    def merge(self, snapshot, **labels):
+        '''
+        Args:
+            snapshot: Observations of a histogram with the same buckets, as returned by snapshot().
+            labels: Labels added to the merged series.
+        '''
+        if tuple(snapshot['buckets']) != self.buckets[:-1]:
+            raise ValueError(f"Histogram '{self.name}' has other buckets than the merged observations")
+        with self.lock:
+            for series_labels, counts, total, count in snapshot['series']:
+                series = self._series(_label_key({**series_labels, **labels}))
+                series[0] = [a + b for a, b in zip(series[0], counts)]
+                series[1] += total
+                series[2] += count
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, (counts, total, count) in self.values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    samples.append((self.name + '_bucket', key + (('le', _format_value(bound)),), cumulative))
+                samples.append((self.name + '_sum', key, total))
+                samples.append((self.name + '_count', key, count))
+        return samples
+
+
+class MetricsRegistry:
+    '''
+    The metrics of a process, rendered together for the /metrics endpoint.
+    '''
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help):
+        return self.register(Counter(name, help))
+
+    def gauge(self, name, help, function=None):
+        return self.register(Gauge(name, help, function))
+
+    def histogram(self, name, help, buckets=STAGE_BUCKETS):
+        return self.register(Histogram(name, help, buckets))
+
+    def render(self):
+        '''
+        Returns:
+            text: The metrics in the Prometheus text exposition format.
+        '''
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, key, value in metric.samples():
+                lines.append(f'{name}{_format_labels(key)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+@contextmanager
+def timed(histogram, failures=None, **labels):
+    '''
+    Times the block into the histogram, and counts it in failures when it raises.
+    Args:
+        histogram: Histogram the seconds spent in the block are observed in.
+        failures: Optional Counter incremented when the block raises.
+        labels: Labels of the observation, like the stage.
+    '''
+    start = perf_counter()
+    try:
+        yield
+    except BaseException:
+        if failures is not None:
+            failures.inc(**labels)
+        raise
+    finally:
+        histogram.observe(perf_counter() - start, **labels)
+
+
+def timed_iter(iterable, histogram, **labels):
+    '''
+    Yields the items of the iterable, observing the seconds spent waiting for each of them.
+    Args:
+        iterable: The iterable to time.
+        histogram: Histogram the waiting times are observed in.
+        labels: Labels of the observations.
+    '''
+    iterator = iter(iterable)
+    while True:
+        start = perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        histogram.observe(perf_counter() - start, **labels)
+        yield item
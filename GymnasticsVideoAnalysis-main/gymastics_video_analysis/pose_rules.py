@@ -0,0 +1,157 @@
+# Table-driven rules of the vault poses, compiled to NumPy interval masks
+import os
+import json
+import hashlib
+import numpy as np
+
+# Version of the rule table format
+RULES_VERSION = 1
+
+# Rule table used when no other is given, next to this module
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pose_rules.json')
+
+# Rule table loaded from DEFAULT_RULES_PATH, on first use
+_default_rules = None
+
+# Joint angles the rules test, in the order returned by Vault_Gymnast.calculateAngles.
+ANGLE_NAMES = ('left_elbow', 'right_elbow', 'left_shoulder', 'right_shoulder',
+               'left_knee', 'right_knee', 'left_hip', 'right_hip')
+
+
+class PoseRules:
+    '''
+    Rule table of the vault poses, compiled into interval masks that classify the joint angles of any
+    number of frames in a few array operations. Each rule gives the 'state' of a pose, its 'phase' name,
+    an 'all' dict of angle intervals that must all hold, and an 'any' list of groups of alternative
+    interval dicts, one alternative of every group having to hold. The angles are named as in
+    ANGLE_NAMES and the intervals are [low, high] in degrees, exclusive, with None for an
+    open side. When several rules match a frame, the last one wins.
+    Args:
+        table: Dict of the rule table, with its 'rules' list, as loaded by loadPoseRules.
+    '''
+
+    def __init__(self, table):
+        rules = table.get('rules') if isinstance(table, dict) else None
+        if not rules:
+            raise ValueError("The rule table has no 'rules'")
+        self.table = table
+        self.angle_names = ANGLE_NAMES
+
+        # Every rule is a list of clauses that must all hold, and every clause a list of alternative
+        # interval sets of which one must hold. The alternatives of all the rules are stacked in one
+        # table of lower and upper bounds, with the angles each one tests.
+        alternatives = []
+        clause_starts = []
+        rule_starts = []
+        states = []
+        for index, rule in enumerate(rules):
+            state = rule.get('state')
+            if not isinstance(state, int) or isinstance(state, bool) or state < 1:
+                raise ValueError(f"Rule {index} needs a positive integer 'state', got {state!r}")
+            clauses = ([[rule['all']]] if rule.get('all') else []) + list(rule.get('any') or [])
+            if not clauses:
+                raise ValueError(f"Rule {index} ({rule.get('phase', state)}) has no intervals")
+
+            rule_starts.append(len(clause_starts))
+            states.append(state)
+            for clause in clauses:
+                if not clause:
+                    raise ValueError(f"Rule {index} ({rule.get('phase', state)}) has an empty 'any' group")
+                clause_starts.append(len(alternatives))
+                alternatives.extend(self._bounds(index, intervals) for intervals in clause)
+
+        self.lower = np.array([lower for lower, _, _ in alternatives])
+        self.upper = np.array([upper for _, upper, _ in alternatives])
+        self.tested = np.array([tested for _, _, tested in alternatives])
+        self.clause_starts = np.array(clause_starts, dtype=np.intp)
+        self.rule_starts = np.array(rule_starts, dtype=np.intp)
+        self.states = np.array(states, dtype=np.int64)
+
+    def _bounds(self, index, intervals):
+        lower = np.full(len(self.angle_names), -np.inf)
+        upper = np.full(len(self.angle_names), np.inf)
+        tested = np.zeros(len(self.angle_names), dtype=bool)
+        for name, interval in intervals.items():
+            if name not in self.angle_names:
+                raise ValueError(f"Rule {index} tests unknown angle {name!r}, expected one of {self.angle_names}")
+            if not isinstance(interval, (list, tuple)) or len(interval) != 2:
+                raise ValueError(f"Rule {index} needs a [low, high] interval for {name}, got {interval!r}")
+            low, high = (-np.inf if interval[0] is None else float(interval[0]),
+                         np.inf if interval[1] is None else float(interval[1]))
+            if not low < high:
+                raise ValueError(f"Rule {index} has an empty interval for {name}: {interval!r}")
+            column = self.angle_names.index(name)
+            lower[column], upper[column], tested[column] = low, high, True
+        return lower, upper, tested
+
+    def digest(self):
+        '''
+        Returns:
+            digest: Hex digest identifying the rules, for the cache keys of the results.
+        '''
+        return hashlib.sha256(json.dumps(self.table, sort_keys=True).encode()).hexdigest()[:16]
+
+    def matches(self, angles):
+        '''
+        Args:
+            angles: (N, 8) array of the joint angles of N frames, as returned by Vault_Gymnast.calculateAngles.
+        Returns:
+            matches: (N, R) boolean array of the rules each frame matches.
+        '''
+        angles = np.asarray(angles, dtype=np.float64)[:, None, :]
+
+        # An angle outside its interval fails the alternative, NaN angles fail every interval they are tested by.
+        inside = ((angles > self.lower) & (angles < self.upper)) | ~self.tested
+        alternatives = inside.all(axis=2)
+        clauses = np.logical_or.reduceat(alternatives, self.clause_starts, axis=1)
+        return np.logical_and.reduceat(clauses, self.rule_starts, axis=1)
+
+    def classify(self, angles):
+        '''
+        Args:
+            angles: (8,) array of the joint angles of one frame, or (N, 8) for a whole clip.
+        Returns:
+            states: The state of the pose matched by the frame, 0 when none matches, or an (N,) array of them.
+        '''
+        angles = np.asarray(angles, dtype=np.float64)
+        matches = self.matches(angles.reshape(-1, len(self.angle_names)))
+
+        # The last matching rule wins.
+        last = matches.shape[1] - 1 - np.argmax(matches[:, ::-1], axis=1)
+        states = np.where(matches.any(axis=1), self.states[last], 0)
+        return int(states[0]) if angles.ndim == 1 else states
+
+
+# Function to load a rule table file
+def loadPoseRules(path=None):
+    '''
+    Args:
+        path: Path of a .json, .yaml or .yml rule table, DEFAULT_RULES_PATH when None. YAML needs PyYAML.
+    Returns:
+        rules: The compiled PoseRules.
+    '''
+    path = path or DEFAULT_RULES_PATH
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            # PyYAML is only needed for YAML rule tables.
+            import yaml
+            table = yaml.safe_load(f)
+        else:
+            table = json.load(f)
+
+    version = table.get('version', RULES_VERSION) if isinstance(table, dict) else None
+    if version != RULES_VERSION:
+        raise ValueError(f"Unsupported rule table version {version!r} in {path}")
+    return PoseRules(table)
+
+
+# Function to get the rules of DEFAULT_RULES_PATH, loaded once per process
+def defaultPoseRules():
+    '''
+    Returns:
+        rules: The compiled PoseRules of the default rule table.
+    '''
+    global _default_rules
+    if _default_rules is None:
+        _default_rules = loadPoseRules()
+    return _default_rules
@@ -0,0 +1,107 @@
+# Cache of analysed videos, keyed by the content of the input video and the analyzer settings
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    output_video_url TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    report TEXT,
+    track_path TEXT,
+    annotations_path TEXT
+);
+'''
+
+
+def cache_key(video_blob, settings):
+    '''
+    Args:
+        video_blob: The Storage blob of the input video, with its metadata loaded.
+        settings: Dict of the analyzer version and settings, see Vault_Gymnast.analyzerSettings.
+    Returns:
+        key: Hex digest identifying the input content together with the analysis settings.
+    '''
+
+    # The MD5 hash identifies the content, composite uploads only have a CRC32C and the generation is the last resort.
+    content = video_blob.md5_hash or video_blob.crc32c or f'generation:{video_blob.generation}'
+    payload = json.dumps({'content': content, 'settings': settings}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResultCache:
+    '''
+    Output video URLs, score reports and Storage paths of the landmark tracks and annotations of
+    finished analyses stored in a local SQLite file.
+    Args:
+        db_path: Path of the SQLite database file.
+    '''
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(_SCHEMA)
+
+        # Databases created before the score reports and the paths get the columns added.
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(results)')]
+        for column in ('report', 'track_path', 'annotations_path'):
+            if column not in columns:
+                self.conn.execute(f'ALTER TABLE results ADD COLUMN {column} TEXT')
+
+    def close(self):
+        self.conn.close()
+
+    def get(self, key):
+        '''
+        Args:
+            key: Cache key of the analysis.
+        Returns:
+            output_video_url: URL of the analysed video, or None when it is not cached.
+        '''
+        with self.lock:
+            row = self.conn.execute('SELECT output_video_url FROM results WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def report(self, key):
+        '''
+        Args:
+            key: Cache key of the analysis.
+        Returns:
+            report: Score report of the analysis, or None when it is not cached or has no report.
+        '''
+        with self.lock:
+            row = self.conn.execute('SELECT report FROM results WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def paths(self, key):
+        '''
+        Args:
+            key: Cache key of the analysis.
+        Returns:
+            track_path: Storage path of the landmark track of the analysis, or None when it is not cached
+                        or was cached without it.
+            annotations_path: Storage path of the annotations of the analysis, or None likewise.
+        '''
+        with self.lock:
+            row = self.conn.execute('SELECT track_path, annotations_path FROM results WHERE key = ?', (key,)).fetchone()
+        return tuple(row) if row else (None, None)
+
+    def put(self, key, output_video_url, report=None, track_path=None, annotations_path=None):
+        '''
+        Args:
+            key: Cache key of the analysis.
+            output_video_url: URL of the analysed video.
+            report: Optional score report of the analysis, see scoring.PhaseScorer.
+            track_path: Optional Storage path of the landmark track of the analysis.
+            annotations_path: Optional Storage path of the annotations of the analysis.
+        '''
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO results (key, output_video_url, created_at, report, track_path, '
+                              'annotations_path) VALUES (?, ?, ?, ?, ?, ?)',
+                              (key, output_video_url, time.time(), json.dumps(report) if report is not None else None,
+                               track_path, annotations_path))
@@ -0,0 +1,104 @@
+# Score report of a vault attempt, aggregated per phase while the video is analysed
+import numpy as np
+
+# Version of the score report format
+REPORT_VERSION = 1
+
+# Phases of the vault in the order they are reached, as labelled by Vault_Gymnast.classifyState
+PHASE_LABELS = ('Jump', '1st Flight', 'Repulsion', '2nd Flight', 'Complete')
+
+# Deductions of Vault_Gymnast.poseDeductions, and the values they can take
+DEDUCTION_NAMES = ('bent_knees', 'leg_separation', 'shoulder_angle', 'body_alignment', 'layout_failure')
+DEDUCTION_VALUES = (0, 0.1, 0.3, 0.5)
+
+# Execution score a vault starts from, before its deductions
+START_SCORE = 10.0
+
+
+class PhaseScorer:
+    '''
+    Keeps running aggregates of the deductions of every phase of a vault attempt as its frames are
+    classified: the frames and first and last frame of each phase, and per deduction the number of
+    frames it had each of DEDUCTION_VALUES. The structure has a fixed size, the frames themselves are
+    not kept, and the counts give the exact median as the deductions take only a few values.
+    Args:
+        fps: Frame rate of the video, for the timestamps of the report.
+    '''
+
+    def __init__(self, fps):
+        self.fps = fps
+        self.frames = np.zeros(len(PHASE_LABELS), dtype=np.int64)
+        self.first = np.full(len(PHASE_LABELS), -1, dtype=np.int64)
+        self.last = np.full(len(PHASE_LABELS), -1, dtype=np.int64)
+
+        # Frames per phase, deduction and value. Frames without the deduction count as 0.
+        self.counts = np.zeros((len(PHASE_LABELS), len(DEDUCTION_NAMES), len(DEDUCTION_VALUES)), dtype=np.int64)
+
+        # Whether a deduction was assessed at all in a phase
+        self.assessed = np.zeros((len(PHASE_LABELS), len(DEDUCTION_NAMES)), dtype=bool)
+
+    def add(self, frame_index, label, deductions):
+        '''
+        Args:
+            frame_index: Index of the frame in the video.
+            label: Classified pose label of the frame, frames before the Jump are ignored.
+            deductions: Dict of the deductions of the frame, as returned by Vault_Gymnast.poseDeductions.
+        '''
+        label = label.strip()
+        if label not in PHASE_LABELS:
+            return
+        phase = PHASE_LABELS.index(label)
+
+        if self.first[phase] < 0:
+            self.first[phase] = frame_index
+        self.last[phase] = frame_index
+        self.frames[phase] += 1
+
+        values = np.zeros(len(DEDUCTION_NAMES), dtype=np.intp)
+        for name, value in deductions.items():
+            deduction = DEDUCTION_NAMES.index(name)
+            values[deduction] = DEDUCTION_VALUES.index(value)
+            self.assessed[phase, deduction] = True
+        self.counts[phase, np.arange(len(DEDUCTION_NAMES)), values] += 1
+
+    def _timestamp(self, frame_index):
+        return float(frame_index / self.fps) if self.fps else 0.0
+
+    def report(self):
+        '''
+        Returns:
+            report: Dict with 'phases', one per phase reached with its 'label', 'start' and 'end' timestamps,
+                    'duration' in seconds, 'frames' and the 'max' and 'median' of each of its 'deductions';
+                    the 'deductions' of the attempt, the sum of the phase medians per deduction; the
+                    'total_deduction', the execution 'score' and whether the vault was 'completed'.
+        '''
+        values = np.asarray(DEDUCTION_VALUES, dtype=np.float64)
+        phases = []
+        totals = dict.fromkeys(DEDUCTION_NAMES, 0.0)
+        for phase, label in enumerate(PHASE_LABELS):
+            frames = int(self.frames[phase])
+            if not frames:
+                continue
+
+            deductions = {}
+            for deduction, name in enumerate(DEDUCTION_NAMES):
+                if not self.assessed[phase, deduction]:
+                    continue
+                counts = self.counts[phase, deduction]
+
+                # The median is the mean of the middle two values, looked up in the cumulative counts.
+                cumulative = np.cumsum(counts)
+                middle = values[np.searchsorted(cumulative, [(frames - 1) // 2 + 1, frames // 2 + 1])]
+                deductions[name] = {'max': float(values[np.flatnonzero(counts)[-1]]),
+                                    'median': round(float(middle.mean()), 2)}
+                totals[name] += deductions[name]['median']
+
+            start, end = self.first[phase], self.last[phase]
+            phases.append({'label': label, 'start': self._timestamp(start), 'end': self._timestamp(end),
+                           'duration': self._timestamp(end - start + 1), 'frames': frames, 'deductions': deductions})
+
+        total = round(sum(totals.values()), 2)
+        return {'version': REPORT_VERSION, 'phases': phases,
+                'deductions': {name: round(value, 2) for name, value in totals.items() if value},
+                'total_deduction': total, 'score': round(max(START_SCORE - total, 0.0), 2),
+                'completed': bool(self.frames[-1])}
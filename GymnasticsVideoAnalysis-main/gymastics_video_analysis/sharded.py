@@ -0,0 +1,453 @@
+# Frame-sharded analysis of a single long video across a pool of worker processes
+import os
+import shutil
+import tempfile
+import multiprocessing
+from time import time
+from itertools import islice
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+import numpy as np
+
+from Vault_Gymnast import (ENCODERS, POSE_MODES, SMOOTHING_BETA, SMOOTHING_D_CUTOFF, SMOOTHING_MIN_CUTOFF,
+                           TRANSITION_FRAMES, TRANSITION_WINDOW, TransitionHysteresis, VaultAnalyzer,
+                           addEncodingArguments, advanceState, analyzerSettings, calculateAngles, checkSettings,
+                           drawLandmarks, drawPoseLabels, encodingFromArguments, loadMediapipe, openWriter,
+                           poseDeductions, prepareFrame, preparedSize)
+from video_io import FrameReader, FrameWriter, SizedWriter, concatVideos, keyframeIndices
+from landmark_tracks import LANDMARK_VALUES, NUM_LANDMARKS, LandmarkTrackWriter
+from annotations import AnnotationWriter
+from scoring import PhaseScorer
+from smoothing import LandmarkSmoother
+from pose_rules import defaultPoseRules, loadPoseRules
+from metrics import FRAME_BUCKETS, Histogram, timed, timed_iter
+
+# Chunks per worker process, so a worker that finishes early takes over some of the work of the others
+SHARD_CHUNKS_PER_WORKER = 2
+
+# Fewest frames of a chunk, shorter videos are split into fewer chunks
+SHARD_MIN_FRAMES = 150
+
+# Landmarks of a frame without a gymnast
+_NO_LANDMARKS = np.empty((0, LANDMARK_VALUES))
+
+# Analyzer owned by the current worker process, built once when the worker starts
+_analyzer = None
+
+
+def _init_worker(mode, encoder, roi, encoding, rules):
+    global _analyzer
+    _analyzer = VaultAnalyzer(mode, encoder=encoder, roi=roi, encoding=encoding, rules=rules)
+
+
+def _ready():
+    pass
+
+
+def _openChunk(input_path, start):
+    video = cv2.VideoCapture(input_path)
+    if not video.isOpened():
+        raise IOError(f"Could not open video '{input_path}'")
+    if start and not video.set(cv2.CAP_PROP_POS_FRAMES, start):
+        video.release()
+        raise IOError(f"Could not seek to frame {start} of '{input_path}'")
+    return video
+
+
+def _readChunk(input_path, start, end, frame_timings):
+    # Decode the frames of the chunk on their own thread, in the buffers of the analyzer's pool.
+    video = _openChunk(input_path, start)
+    pool = _analyzer.frame_pool
+    pool.reset()
+    reader = FrameReader(video, preprocess=prepareFrame, max_queued=_analyzer.queue_size, pool=pool)
+    try:
+        yield from islice(timed_iter(reader, frame_timings, stage='decode'), end - start)
+    finally:
+        reader.close()
+        video.release()
+
+
+def _sharedArray(memory, frames):
+    return np.ndarray((frames, NUM_LANDMARKS, LANDMARK_VALUES), dtype=np.float64, buffer=memory.buf)
+
+
+def _detectChunk(input_path, start, end, memory_name, frames_total):
+    '''
+    Detects the landmarks of the frames [start, end) and stores them in the shared landmark array,
+    NaN for frames without a gymnast.
+    Returns:
+        frames: Number of frames decoded, fewer than the chunk has when the video ends early.
+        frame_timings: Histogram snapshot of the seconds per frame of each stage.
+    '''
+    # The pose model starts over at the chunk, as it would at the start of a video.
+    _analyzer.pose.reset()
+    if _analyzer.roi_detector is not None:
+        _analyzer.roi_detector.reset()
+
+    frame_timings = Histogram('vault_frame_stage_seconds', buckets=FRAME_BUCKETS)
+    landmarks = np.full((end - start, NUM_LANDMARKS, LANDMARK_VALUES), np.nan)
+    frames = 0
+    for frame in _readChunk(input_path, start, end, frame_timings):
+        with timed(frame_timings, stage='inference'):
+            _, detected = _analyzer.detect(frame)
+        if len(detected):
+            landmarks[frames] = detected
+        _analyzer.frame_pool.release(frame)
+        frames += 1
+
+    # The landmarks of the chunk are copied into the shared array at once, rather than sent back pickled.
+    memory = shared_memory.SharedMemory(name=memory_name)
+    try:
+        _sharedArray(memory, frames_total)[start:start + frames] = landmarks[:frames]
+    finally:
+        memory.close()
+    return frames, frame_timings.snapshot()
+
+
+def _renderChunk(input_path, start, end, detected_name, classified_name, frames_total, labels, deductions,
+                 output_path, fps, default_size, encoding):
+    '''
+    Draws the landmarks and the classified labels on the frames [start, end) and encodes them into
+    their own video file.
+    Returns:
+        frame_timings: Histogram snapshot of the seconds per frame of each stage.
+    '''
+    detected_memory = shared_memory.SharedMemory(name=detected_name)
+    classified_memory = shared_memory.SharedMemory(name=classified_name)
+    try:
+        detected = _sharedArray(detected_memory, frames_total)[start:end].copy()
+        classified = _sharedArray(classified_memory, frames_total)[start:end].copy()
+    finally:
+        detected_memory.close()
+        classified_memory.close()
+
+    frame_timings = Histogram('vault_frame_stage_seconds', buckets=FRAME_BUCKETS)
+    out = SizedWriter(lambda frame_size: openWriter(output_path, fps, frame_size, _analyzer.encoder, encoding),
+                      default_size)
+    writer = FrameWriter(out, max_queued=_analyzer.queue_size, release=_analyzer.frame_pool.release)
+    completed = False
+    try:
+        for offset, frame in enumerate(_readChunk(input_path, start, end, frame_timings)):
+            with timed(frame_timings, stage='overlay'):
+                if not np.isnan(detected[offset, 0, 0]):
+                    drawLandmarks(frame, detected[offset])
+                label = labels[offset]
+                if label is not None:
+                    drawPoseLabels(frame, classified[offset, :, :3], label, deductions[offset])
+                    cv2.putText(frame, label, (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2, cv2.LINE_AA)
+            with timed(frame_timings, stage='encode'):
+                writer.write(frame)
+        completed = True
+    finally:
+        try:
+            writer.close()
+        finally:
+            out.release(completed)
+    return frame_timings.snapshot()
+
+
+def _releaseMemory(memory):
+    memory.unlink()
+    try:
+        memory.close()
+    except BufferError:
+        # An array of a failed analysis still refers to it, the memory is unmapped with the array.
+        pass
+
+
+# Function to split a video into chunks that start at keyframes
+def planChunks(frames_total, chunks, keyframes=(), min_frames=SHARD_MIN_FRAMES):
+    '''
+    Args:
+        frames_total: Number of frames of the video.
+        chunks: Number of chunks wanted, fewer are made when they would be shorter than min_frames.
+        keyframes: Sorted indices of the keyframes of the video, see video_io.keyframeIndices. Each chunk
+                   starts at the keyframe nearest to an even split, so its decoding starts there and
+                   no frames before it are decoded in vain. A split without a keyframe within a quarter
+                   of a chunk is kept, the chunk is then decoded from the keyframe before it.
+        min_frames: Fewest frames of a chunk.
+    Returns:
+        chunks: List of (start, end) frame ranges, in order and covering every frame.
+    '''
+    chunks = max(1, min(chunks, frames_total // max(min_frames, 1)))
+    keyframes = [keyframe for keyframe in keyframes if 0 < keyframe < frames_total]
+
+    starts = [0]
+    for chunk in range(1, chunks):
+        split = chunk * frames_total // chunks
+
+        # The nearest keyframe leaving both chunks long enough, else the even split when it does.
+        candidates = [keyframe for keyframe in keyframes if abs(keyframe - split) <= frames_total / chunks / 4]
+        candidates = [start for start in sorted(candidates, key=lambda keyframe: abs(keyframe - split)) + [split]
+                      if start - starts[-1] >= min_frames and frames_total - start >= min_frames]
+        if candidates:
+            starts.append(candidates[0])
+    return list(zip(starts, starts[1:] + [frames_total]))
+
+
+class ShardedAnalyzer:
+    '''
+    Analyses one video at a time across a pool of worker processes, each keeping its own Pose model, so
+    a long video takes about its analysis time divided by the number of workers. The video is split into
+    chunks starting at keyframes (see planChunks) and analysed in three passes:
+        1. The workers detect the landmarks of the chunks in parallel, into an array in shared memory.
+        2. The smoothing and the vault state machine run over the landmarks of the whole video in order,
+           so a phase spanning two chunks is classified as it would be in one pass.
+        3. The workers draw the analysis on the chunks in parallel and encode each into its own file,
+           which are then joined without encoding them again.
+    Rendering needs the ffmpeg executable (see video_io.FFMPEG) with every encoder, as the encoded chunks
+    are joined by ffmpeg. Without it, the analyzer refuses to render before any worker is started.
+    The pose model starts afresh at each chunk, so the landmarks of the first frames of a chunk are
+    detected rather than tracked, and the frame sampling and two-pass analysis of VaultAnalyzer are not
+    available, every frame is inferred.
+    Args:
+        workers: Number of worker processes, defaults to the number of CPU cores.
+        mode: Pose inference mode, one of the keys of Vault_Gymnast.POSE_MODES.
+        encoder: Output video encoder, one of Vault_Gymnast.ENCODERS.
+        roi: When true, the pose is detected in a crop around the gymnast.
+        encoding: Optional dict of ffmpeg encoder settings, with keys of Vault_Gymnast.ENCODING_OPTIONS.
+        render: When false, no output videos are written, only the landmark tracks and annotations.
+        smoothing: When true, the landmarks are smoothed and the phase transitions need several frames.
+        rules: Path of the pose rule table, the default one when None.
+    '''
+
+    def __init__(self, workers=None, mode='tracking', encoder='opencv', roi=False, encoding=None, render=True,
+                 smoothing=False, rules=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.mode = mode
+        self.encoder = encoder
+        self.roi = roi
+        self.encoding = encoding
+        self.render = render
+        self.smoothing = smoothing
+        self.rules_path = rules
+
+        # The state machine runs in this process, an invalid setting or rule table fails before any worker starts.
+        checkSettings(encoder, encoding=encoding, joined=render)
+        self.rules = loadPoseRules(rules) if rules else defaultPoseRules()
+
+        # Workers are spawned rather than forked, MediaPipe graphs and server threads do not survive a fork.
+        self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                            mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init_worker,
+                                            initargs=(mode, encoder, roi, encoding, rules))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def settings(self):
+        '''
+        Returns:
+            settings: Dict of the analyzer version and settings, with the chunking, which changes where
+                      the pose model starts over.
+        '''
+        settings = analyzerSettings(self.mode, self.encoder, self.roi, encoding=self.encoding, render=self.render,
+                                    smoothing=self.smoothing, rules=self.rules_path)
+        settings['shards'] = {'workers': self.workers, 'per_worker': SHARD_CHUNKS_PER_WORKER,
+                              'min_frames': SHARD_MIN_FRAMES}
+        return settings
+
+    def warm_up(self):
+        '''
+        Starts every worker process, which builds its Pose model as it starts, see BatchAnalyzer.warm_up.
+        '''
+        for future in [self.executor.submit(_ready) for _ in range(self.workers)]:
+            future.result()
+
+    def analyze(self, input_path, output_path, progress=None, track_path=None, annotations_path=None):
+        '''
+        Args:
+            input_path: Path of the video with the gymnast to be analysed. It has to be a seekable file.
+            output_path: Path where the annotated video is written, unused when the analyzer does not render.
+                         A named pipe gets a fragmented MP4 once the chunks are encoded.
+            progress: Optional function called as progress(frames_done, frames_total) as the landmarks of
+                      each chunk are detected, and once at the end.
+            track_path: Optional path of a .npz file the landmarks of every frame are saved to.
+            annotations_path: Optional path of a .json or .json.gz file the per-frame annotations are saved to.
+        Returns:
+            stats: The stats of VaultAnalyzer.analyze, with the (start, end) frame ranges of the 'chunks'.
+        '''
+        start_time = time()
+
+        video = cv2.VideoCapture(input_path)
+        if not video.isOpened():
+            raise IOError(f"Could not open video '{input_path}'")
+        fps = video.get(cv2.CAP_PROP_FPS)
+        width = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        frames_total = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+        video.release()
+        if frames_total <= 0:
+            raise IOError(f"Could not count the frames of '{input_path}', it cannot be split into chunks")
+
+        chunks = planChunks(frames_total, self.workers * SHARD_CHUNKS_PER_WORKER, keyframeIndices(input_path, fps))
+        frame_timings = Histogram('vault_frame_stage_seconds', buckets=FRAME_BUCKETS)
+
+        # The landmarks of every frame, as detected and as classified, are shared with the workers. They are
+        # the same array without smoothing.
+        size = frames_total * NUM_LANDMARKS * LANDMARK_VALUES * np.dtype(np.float64).itemsize
+        detected = shared_memory.SharedMemory(create=True, size=size)
+        classified = shared_memory.SharedMemory(create=True, size=size) if self.smoothing else detected
+        scratch = None
+        try:
+            frames = self._detect(input_path, chunks, detected, frames_total, frame_timings, progress)
+            chunks = [(start, min(end, frames)) for start, end in chunks if start < frames]
+
+            labels, deductions, report = self._classify(detected, classified, frames_total, frames, fps,
+                                                        (width, height), track_path, annotations_path,
+                                                        frame_timings)
+
+            if self.render:
+                scratch = tempfile.mkdtemp(prefix='shards_', dir=os.path.dirname(os.path.abspath(output_path)))
+                self._render(input_path, output_path, chunks, detected, classified, frames_total, labels,
+                             deductions, fps, preparedSize(width, height), scratch, frame_timings)
+        finally:
+            if scratch is not None:
+                shutil.rmtree(scratch, ignore_errors=True)
+            _releaseMemory(detected)
+            if classified is not detected:
+                _releaseMemory(classified)
+
+        elapsed = time() - start_time
+        if progress is not None:
+            progress(frames, frames)
+
+        return {'frames': frames, 'seconds': elapsed, 'fps': frames / elapsed if elapsed > 0 else 0.0,
+                'inferred': frames, 'window': None, 'frame_timings': frame_timings.snapshot(),
+                'report': report, 'chunks': chunks}
+
+    def _detect(self, input_path, chunks, detected, frames_total, frame_timings, progress):
+        futures = {self.executor.submit(_detectChunk, input_path, start, end, detected.name, frames_total): chunk
+                   for chunk, (start, end) in enumerate(chunks)}
+        decoded = [0] * len(chunks)
+        for future in as_completed(futures):
+            chunk = futures[future]
+            decoded[chunk], snapshot = future.result()
+            frame_timings.merge(snapshot)
+            if progress is not None:
+                progress(sum(decoded), frames_total)
+
+        # The frame count of the container may be too large, only the last chunk may end early.
+        for chunk, ((start, end), frames) in enumerate(zip(chunks, decoded)):
+            if start + frames < end and chunk < len(chunks) - 1:
+                raise IOError(f"Could not decode frames {start + frames} to {end} of '{input_path}'")
+        start, end = chunks[-1]
+        return start + decoded[-1]
+
+    def _classify(self, detected, classified, frames_total, frames, fps, source_size, track_path,
+                  annotations_path, frame_timings):
+        # Classify the landmarks of the whole video in order, like VaultAnalyzer.analyze.
+        detected = _sharedArray(detected, frames_total)[:frames]
+        classified = _sharedArray(classified, frames_total)[:frames]
+        frame_size = preparedSize(*source_size)
+
+        # Smooth the landmarks and hold back the phase transitions until they are seen in several frames.
+        hysteresis = None
+        if self.smoothing:
+            smoother = LandmarkSmoother(SMOOTHING_MIN_CUTOFF, SMOOTHING_BETA, SMOOTHING_D_CUTOFF)
+            hysteresis = TransitionHysteresis(TRANSITION_FRAMES, TRANSITION_WINDOW)
+            for index in range(frames):
+                landmarks = smoother(detected[index] if not np.isnan(detected[index, 0, 0]) else _NO_LANDMARKS,
+                                     index / (fps or 30))
+                classified[index] = landmarks if len(landmarks) else np.nan
+
+        track = None
+        if track_path is not None:
+            track = LandmarkTrackWriter(track_path, fps, frame_size,
+                                        transition=(TRANSITION_FRAMES, TRANSITION_WINDOW) if self.smoothing else None)
+        annotations = None
+        if annotations_path is not None:
+            annotations = AnnotationWriter(annotations_path, fps, frame_size, source_size,
+                                           loadMediapipe()[0].POSE_CONNECTIONS)
+        scorer = PhaseScorer(fps)
+
+        # The angles and matched poses of every frame are calculated at once, only the state machine runs
+        # frame by frame, see landmark_tracks.rescoreTrack.
+        found = ~np.isnan(classified[:, 0, 0])
+        points = classified[found, :, :3]
+        angles = calculateAngles(points)
+        matched = zip(points, angles, self.rules.classify(angles))
+
+        labels = [None] * frames
+        deductions = [None] * frames
+        prev_state = 0
+        for index in range(frames):
+            landmarks = _NO_LANDMARKS
+            if found[index]:
+                with timed(frame_timings, stage='classify'):
+                    frame_points, frame_angles, state = next(matched)
+                    prev_state, labels[index] = advanceState(prev_state, state, hysteresis)
+                    deductions[index] = poseDeductions(labels[index], frame_points, frame_angles)
+                    scorer.add(index, labels[index], deductions[index])
+                landmarks = classified[index]
+            if track is not None:
+                track.append(index, landmarks)
+            if annotations is not None:
+                annotations.append(index, landmarks, labels[index], deductions[index])
+
+        if track is not None:
+            track.close()
+        if annotations is not None:
+            annotations.close()
+        return labels, deductions, scorer.report()
+
+    def _render(self, input_path, output_path, chunks, detected, classified, frames_total, labels, deductions,
+                fps, default_size, scratch, frame_timings):
+        # The chunks are joined afterwards, only the whole video gets its index moved to the front.
+        encoding = self.encoding
+        faststart = self.encoder != 'opencv' and (encoding or {}).get('faststart', True)
+        if self.encoder != 'opencv':
+            encoding = {**(encoding or {}), 'faststart': False}
+
+        paths = [os.path.join(scratch, f'chunk_{chunk:04d}.mp4') for chunk in range(len(chunks))]
+        futures = [self.executor.submit(_renderChunk, input_path, start, end, detected.name, classified.name,
+                                        frames_total, labels[start:end], deductions[start:end], path, fps,
+                                        default_size, encoding)
+                   for (start, end), path in zip(chunks, paths)]
+        for future in futures:
+            frame_timings.merge(future.result())
+
+        with timed(frame_timings, stage='join'):
+            concatVideos(paths, output_path, faststart)
+
+    def close(self):
+        '''
+        Waits for the running analysis and shuts the worker processes down.
+        '''
+        self.executor.shutdown(wait=True)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Analyse one long vault video in chunks on several cores. '
+                                                 'Rendering the output video needs ffmpeg.')
+    parser.add_argument('input_path')
+    parser.add_argument('output_path')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--mode', choices=sorted(POSE_MODES), default='tracking')
+    parser.add_argument('--encoder', choices=ENCODERS, default='opencv')
+    parser.add_argument('--roi', action='store_true', help='detect the pose in a crop around the gymnast')
+    parser.add_argument('--track', default=None, help='also save the landmark track to this .npz file')
+    parser.add_argument('--annotations', default=None,
+                        help='also save the per-frame annotations to this .json or .json.gz file')
+    parser.add_argument('--no-render', action='store_true',
+                        help='do not draw and encode an output video, only save the track and annotations')
+    parser.add_argument('--smooth', action='store_true',
+                        help='smooth the landmarks over time and confirm phase transitions over several frames')
+    parser.add_argument('--rules', default=None, help='.json or .yaml pose rule table, see pose_rules.json')
+    addEncodingArguments(parser)
+    args = parser.parse_args()
+
+    with ShardedAnalyzer(args.workers, args.mode, args.encoder, roi=args.roi, encoding=encodingFromArguments(args),
+                         render=not args.no_render, smoothing=args.smooth, rules=args.rules) as sharded:
+        stats = sharded.analyze(args.input_path, args.output_path, track_path=args.track,
+                                annotations_path=args.annotations)
+    print(f"Processed {stats['frames']} frames in {len(stats['chunks'])} chunks in {stats['seconds']:.2f} seconds "
+          f"({stats['fps']:.2f} fps).")
+    print(f"Score {stats['report']['score']:.2f} after {stats['report']['total_deduction']:.2f} of deductions.")
@@ -0,0 +1,90 @@
+# Temporal smoothing of the detected landmarks, against the jitter between frames
+import math
+import numpy as np
+
+
+class OneEuroFilter:
+    '''
+    One Euro filter (Casiez et al., CHI 2012) over NumPy arrays, filtering every element independently in
+    one vectorized step per frame. It is a low-pass filter whose cutoff frequency rises with the speed of
+    the signal: jitter is removed while the gymnast is slow, and fast movement is followed with little lag.
+    Args:
+        min_cutoff: Cutoff frequency in Hz at standstill, lower smooths more.
+        beta: Increase of the cutoff frequency in Hz per unit of speed per second, higher lags less.
+        d_cutoff: Cutoff frequency in Hz of the filtered speed.
+    '''
+
+    def __init__(self, min_cutoff=1.0, beta=0.0, d_cutoff=1.0):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.reset()
+
+    def reset(self):
+        '''
+        Forgets the signal, the next value passes unfiltered.
+        '''
+        self.value = None
+        self.speed = None
+        self.time = None
+
+    @staticmethod
+    def _alpha(cutoff, elapsed):
+        # Smoothing factor of an exponential filter with the cutoff frequency, for the elapsed seconds.
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / elapsed)
+
+    def __call__(self, value, time):
+        '''
+        Args:
+            value: Array of the signal at this time, of the same shape every call.
+            time: Time of the value in seconds.
+        Returns:
+            filtered: The filtered array.
+        '''
+        value = np.asarray(value, dtype=np.float64)
+        if self.value is None or time <= self.time:
+            self.value = value.copy()
+            self.speed = np.zeros_like(value)
+            self.time = time
+            return value.copy()
+
+        elapsed = time - self.time
+        self.speed += self._alpha(self.d_cutoff, elapsed) * ((value - self.value) / elapsed - self.speed)
+        cutoff = self.min_cutoff + self.beta * np.abs(self.speed)
+        self.value += self._alpha(cutoff, elapsed) * (value - self.value)
+        self.time = time
+        return self.value.copy()
+
+
+class LandmarkSmoother:
+    '''
+    Smooths the x, y and z of the landmarks of consecutive frames with a OneEuroFilter, the visibility is
+    kept. The filter starts over when the gymnast is lost, so they do not glide in from where they were.
+    Args:
+        min_cutoff: Cutoff frequency in Hz at standstill.
+        beta: Increase of the cutoff frequency in Hz per pixel per second of speed.
+        d_cutoff: Cutoff frequency in Hz of the speed.
+    '''
+
+    def __init__(self, min_cutoff=1.0, beta=0.0, d_cutoff=1.0):
+        self.filter = OneEuroFilter(min_cutoff, beta, d_cutoff)
+
+    def reset(self):
+        self.filter.reset()
+
+    def __call__(self, landmarks, time):
+        '''
+        Args:
+            landmarks: (33, 3) or (33, 4) array of the landmarks of a frame in pixels, or an empty array.
+            time: Time of the frame in seconds.
+        Returns:
+            landmarks: The smoothed landmarks, of the same shape.
+        '''
+        if not len(landmarks):
+            self.filter.reset()
+            return landmarks
+
+        smoothed = np.array(landmarks, dtype=np.float64)
+        smoothed[:, :3] = self.filter(smoothed[:, :3], time)
+        return smoothed
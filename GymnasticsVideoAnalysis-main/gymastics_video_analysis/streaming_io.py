@@ -0,0 +1,240 @@
+# Streaming transfer of videos between Firebase Storage and the analyzer through named pipes
+import os
+import time
+import struct
+import threading
+
+# Bytes per chunk read from or written to Storage. Resumable uploads need a multiple of 256 KiB.
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# Bytes fetched from the start of a video to find out whether it can be decoded while downloading
+PROBE_SIZE = 64 * 1024
+
+
+# Function to check whether an MP4 video can be decoded front to back
+def isFastStart(video_blob, probe_size=PROBE_SIZE):
+    '''
+    Args:
+        video_blob: The Storage blob of the input video.
+        probe_size: Number of bytes fetched from the start of the video.
+    Returns:
+        fast_start: True when the 'moov' index comes before the 'mdat' media data, so the video
+                    can be decoded from a pipe. Phone recordings usually have it at the end.
+    '''
+    header = video_blob.download_as_bytes(start=0, end=probe_size - 1)
+
+    # Walk over the top level boxes, each starting with its 32 bit size and 4 character type.
+    offset = 0
+    while offset + 8 <= len(header):
+        size, box = struct.unpack('>I4s', header[offset:offset + 8])
+        if box == b'moov':
+            return True
+        if box == b'mdat':
+            return False
+        if size == 1:
+            # A 64 bit size follows the type.
+            if offset + 16 > len(header):
+                break
+            size = struct.unpack('>Q', header[offset + 8:offset + 16])[0]
+        if size < 8:
+            break
+        offset += size
+    return False
+
+
+# Function to create a named pipe
+def makePipe(path):
+    '''
+    Args:
+        path: Path of the named pipe, it must not exist yet.
+    Returns:
+        path: The same path.
+    '''
+    os.mkfifo(path)
+    return path
+
+
+# Downloading stage
+class BlobDownloadPipe:
+    '''
+    Downloads a blob in chunks into a named pipe on a background thread, so the decoder
+    reading the pipe starts on the first chunks while the download continues.
+    Args:
+        blob: The Storage blob to download.
+        pipe_path: Path of the named pipe.
+        chunk_size: Bytes per download request.
+    '''
+
+    def __init__(self, blob, pipe_path, chunk_size=CHUNK_SIZE):
+        self.blob = blob
+        self.pipe_path = pipe_path
+        self.chunk_size = chunk_size
+        self.bytes_transferred = 0
+        self.aborted = False
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name='BlobDownloadPipe', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            # Opening the pipe waits until the decoder opens it for reading.
+            with self.blob.open('rb', chunk_size=self.chunk_size) as source, open(self.pipe_path, 'wb') as pipe:
+                while not self.aborted:
+                    chunk = source.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    pipe.write(chunk)
+                    self.bytes_transferred += len(chunk)
+        except BrokenPipeError as e:
+            # The decoder stopped reading, which is only an error if the analysis did not fail first.
+            if not self.aborted:
+                self.error = e
+        except Exception as e:
+            self.error = e
+
+        # After a failed download the decoder may try to open the pipe again, so every attempt
+        # is let through to an empty pipe until the analysis gives up and aborts the download.
+        while self.error is not None and not self.aborted:
+            try:
+                os.close(os.open(self.pipe_path, os.O_WRONLY | os.O_NONBLOCK))
+            except OSError:
+                # Nobody is opening the pipe for reading at this moment.
+                pass
+            time.sleep(0.1)
+
+    def abort(self):
+        '''
+        Stops the download, also when the decoder never opened the pipe.
+        '''
+        self.aborted = True
+
+        # Open and close the reading end until the thread exits, so a writer blocked in open() continues
+        # and hits a broken pipe. It is repeated in case the thread had not reached open() yet.
+        while self.thread.is_alive():
+            os.close(os.open(self.pipe_path, os.O_RDONLY | os.O_NONBLOCK))
+            self.thread.join(0.1)
+
+    def join(self):
+        '''
+        Waits for the download to finish.
+        '''
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+# Uploading stage
+class BlobUploadPipe:
+    '''
+    Uploads what the encoder writes into a named pipe as a chunked resumable upload on a
+    background thread, so the upload runs while the video is still being encoded. The upload
+    is only committed by join(), once the caller knows the video is complete, and discarded by abort().
+    Args:
+        blob: The Storage blob to upload to.
+        pipe_path: Path of the named pipe.
+        chunk_size: Bytes per upload request, a multiple of 256 KiB.
+        content_type: Content type of the uploaded file.
+    '''
+
+    def __init__(self, blob, pipe_path, chunk_size=CHUNK_SIZE, content_type='video/mp4'):
+        self.blob = blob
+        self.pipe_path = pipe_path
+        self.chunk_size = chunk_size
+        self.content_type = content_type
+        self.bytes_transferred = 0
+        self.aborted = False
+        self.error = None
+        self.finished = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='BlobUploadPipe', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        target = None
+        try:
+            # Opening the pipe waits until the encoder opens it for writing.
+            with open(self.pipe_path, 'rb') as pipe:
+                target = self.blob.open('wb', chunk_size=self.chunk_size, content_type=self.content_type)
+                while True:
+                    chunk = pipe.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    target.write(chunk)
+                    self.bytes_transferred += len(chunk)
+
+            # The encoder also closes the pipe when the analysis fails, so the caller decides whether the
+            # video is complete. Only a complete video is committed, an aborted upload is discarded.
+            self.finished.wait()
+            if self.aborted:
+                target.terminate()
+            else:
+                target.close()
+        except Exception as e:
+            self.error = e
+            if target is not None:
+                target.terminate()
+
+    def abort(self):
+        '''
+        Discards the upload, also when the encoder never opened the pipe.
+        '''
+        self.aborted = True
+        self.finished.set()
+
+        # Open and close the writing end until the thread exits, so a reader blocked in open() continues
+        # and sees the end of the file. It is repeated in case the thread had not reached open() yet.
+        while self.thread.is_alive():
+            try:
+                os.close(os.open(self.pipe_path, os.O_WRONLY | os.O_NONBLOCK))
+            except OSError:
+                # Nobody has the pipe open for reading at this moment.
+                pass
+            self.thread.join(0.1)
+
+    def join(self):
+        '''
+        Commits the upload once the encoder closed the pipe and waits for it.
+        '''
+        self.finished.set()
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+# Function to run an analysis from one blob to another through named pipes
+def streamBlobs(source_blob, target_blob, input_pipe, output_pipe, analyze, chunk_size=CHUNK_SIZE):
+    '''
+    Args:
+        source_blob: The Storage blob of the input video.
+        target_blob: The Storage blob the output video is uploaded to. It is only committed when the
+                     analysis succeeded and the whole input was downloaded.
+        input_pipe: Path of the named pipe the input is downloaded into.
+        output_pipe: Path of the named pipe the output is uploaded from.
+        analyze: Function called as analyze(input_pipe, output_pipe), reading and writing the pipes.
+        chunk_size: Bytes per download and upload request.
+    Returns:
+        result: What analyze returned.
+        download: The finished BlobDownloadPipe.
+        upload: The finished BlobUploadPipe.
+    '''
+    download = BlobDownloadPipe(source_blob, input_pipe, chunk_size)
+    upload = BlobUploadPipe(target_blob, output_pipe, chunk_size)
+
+    try:
+        result = analyze(input_pipe, output_pipe)
+    except Exception:
+        download.abort()
+        upload.abort()
+
+        # A failed download explains a failed analysis better than the decoder does
+        if download.error is not None:
+            raise download.error
+        raise
+
+    # Wait for the end of the download, the output is only committed when the whole video was read
+    try:
+        download.join()
+    except Exception:
+        upload.abort()
+        raise
+    upload.join()
+    return result, download, upload
@@ -0,0 +1,110 @@
+# Synthetic vault clips, for benchmarking the analysis without recorded videos
+import os
+import cv2
+import numpy as np
+
+# Frame sizes of the benchmark resolutions
+RESOLUTIONS = {
+    '480p': (854, 480),
+    '1080p': (1920, 1080),
+    '4k': (3840, 2160),
+}
+
+
+# Function to draw a stick figure gymnast running along the runway
+def drawGymnast(image, x, ground, size, phase):
+    '''
+    Args:
+        image: The frame the gymnast is drawn on, in place.
+        x: Horizontal position of the hips in pixels.
+        ground: Vertical position of the feet in pixels.
+        size: Height of the gymnast in pixels.
+        phase: Running phase in radians, swinging the arms and legs.
+    '''
+    thickness = max(int(size / 25), 2)
+    color = (60, 120, 200)
+    hips = np.array([x, ground - size * 0.5])
+    shoulders = hips - (0, size * 0.3)
+    head = shoulders - (0, size * 0.12)
+
+    # Limbs swing in opposite directions, like when running.
+    swing = np.sin(phase) * size * 0.25
+    points = {
+        'left_hand': shoulders + (swing, size * 0.3),
+        'right_hand': shoulders + (-swing, size * 0.3),
+        'left_foot': (hips[0] - swing, ground),
+        'right_foot': (hips[0] + swing, ground),
+    }
+    for limb, end in points.items():
+        start = shoulders if limb.endswith('hand') else hips
+        cv2.line(image, tuple(np.int32(start)), tuple(np.int32(end)), color, thickness)
+    cv2.line(image, tuple(np.int32(hips)), tuple(np.int32(shoulders)), color, thickness)
+    cv2.circle(image, tuple(np.int32(head)), int(size * 0.08), (150, 180, 230), -1)
+
+
+# Function to write a synthetic clip of a gymnast running towards the vault
+def makeSyntheticClip(path, frame_size, seconds, fps=30, seed=0):
+    '''
+    Args:
+        path: Path of the .mp4 file to write.
+        frame_size: (width, height) of the clip.
+        seconds: Length of the clip in seconds.
+        fps: Frame rate of the clip.
+        seed: Seed of the background noise, so the same clip is written every time.
+    Returns:
+        path: The same path.
+    '''
+    width, height = frame_size
+    rng = np.random.default_rng(seed)
+
+    # A noisy background, so the encoder and decoder have some detail to work on.
+    background = np.empty((height, width, 3), dtype=np.uint8)
+    background[:] = (200, 200, 190)
+    background[int(height * 0.8):] = (70, 90, 140)
+    background = cv2.add(background, rng.integers(0, 20, background.shape, dtype=np.uint8))
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    frames = int(seconds * fps)
+    for index in range(frames):
+        frame = background.copy()
+        drawGymnast(frame, x=width * (0.1 + 0.8 * index / max(frames - 1, 1)), ground=height * 0.85,
+                    size=height * 0.45, phase=index * 0.6)
+        out.write(frame)
+    out.release()
+    return path
+
+
+# Function to get a synthetic clip from a folder, writing it the first time
+def syntheticClip(folder, resolution, seconds, fps=30):
+    '''
+    Args:
+        folder: Folder the clips are kept in.
+        resolution: One of the keys of RESOLUTIONS.
+        seconds: Length of the clip in seconds.
+        fps: Frame rate of the clip.
+    Returns:
+        path: Path of the clip.
+    '''
+    path = os.path.join(folder, f'synthetic_{resolution}_{seconds}s_{fps}fps.mp4')
+    if not os.path.exists(path):
+        makeSyntheticClip(path, RESOLUTIONS[resolution], seconds, fps)
+    return path
+
+
+# Function to make landmark arrays for the micro-benchmarks when no recorded track is at hand
+def syntheticLandmarks(count, frame_size=(1137, 640), seed=0):
+    '''
+    Args:
+        count: Number of landmark sets.
+        frame_size: (width, height) of the frames the landmarks lie in.
+        seed: Seed of the random landmarks.
+    Returns:
+        landmarks: (count, 33, 3) array of landmarks in pixels, with x and y truncated like detectPose does.
+    '''
+    width, height = frame_size
+    rng = np.random.default_rng(seed)
+    landmarks = rng.uniform((0.3 * width, 0.1 * height, -0.3 * width), (0.7 * width, 0.9 * height, 0.3 * width),
+                            (count, 33, 3))
+    landmarks[..., :2] = np.trunc(landmarks[..., :2])
+    return landmarks
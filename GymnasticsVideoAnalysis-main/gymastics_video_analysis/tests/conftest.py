@@ -0,0 +1,5 @@
+# The analysis modules are scripts in the folder above, imported by name like the service does
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,7 @@
+# Installs the stand-in pose in the worker processes spawned by the tests, see tests/stand_in_pose.py
+import os
+
+if os.environ.get('VAULT_STAND_IN_POSE'):
+    import stand_in_pose
+
+    stand_in_pose.install(os.environ['VAULT_STAND_IN_POSE'])
@@ -0,0 +1,160 @@
+# Stand-in for the MediaPipe Pose function, returning the landmarks chosen for the index of each frame
+import types
+import cv2
+import numpy as np
+
+import Vault_Gymnast as vg
+
+# Bits of the frame index burned into the frames, as horizontal stripes over the whole height
+INDEX_BITS = 10
+
+# Environment variable with the path of the landmark file, for the spawned worker processes
+STAND_IN_ENV = 'VAULT_STAND_IN_POSE'
+
+# Joint angles of a pose matching each state of the vault with the default rules, 0 matching none of them
+STATE_ANGLES = {
+    0: dict(elbow=100, left_shoulder=100, right_shoulder=100, knee=100),
+    1: dict(elbow=100, left_shoulder=100, right_shoulder=100, knee=250),
+    2: dict(elbow=180, left_shoulder=157, right_shoulder=100, knee=190),
+    3: dict(elbow=150, left_shoulder=250, right_shoulder=100, knee=180),
+    4: dict(elbow=100, left_shoulder=10, right_shoulder=10, knee=100),
+    5: dict(elbow=180, left_shoulder=140, right_shoulder=140, knee=160),
+}
+
+
+# Function to write a clip whose frames carry their index
+def makeIndexedClip(path, frames, frame_size=(320, 180), fps=30):
+    '''
+    Args:
+        path: Path of the .mp4 file to write.
+        frames: Number of frames, at most 2 ** INDEX_BITS.
+        frame_size: (width, height) of the clip, the height a multiple of INDEX_BITS.
+        fps: Frame rate of the clip.
+    Returns:
+        path: The same path.
+    '''
+    width, height = frame_size
+    stripe = height // INDEX_BITS
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, frame_size)
+    for index in range(frames):
+        frame = np.full((height, width, 3), 20, dtype=np.uint8)
+        for bit in range(INDEX_BITS):
+            if index >> bit & 1:
+                frame[bit * stripe:(bit + 1) * stripe] = 230
+        out.write(frame)
+    out.release()
+    return path
+
+
+# Function to read the index of a frame written by makeIndexedClip, also once flipped and resized
+def frameIndex(image):
+    height, width = image.shape[:2]
+    index = 0
+    for bit in range(INDEX_BITS):
+        if image[int((bit + 0.5) * height / INDEX_BITS), width // 2, 0] > 128:
+            index |= 1 << bit
+    return index
+
+
+def _limb(first, middle, angle, length=60.0):
+    # Position of the last landmark of a joint angle, measured at the middle landmark like calculateAngles does.
+    direction = np.arctan2(first[1] - middle[1], first[0] - middle[0]) + np.radians(angle)
+    return middle + length * np.array([np.cos(direction), np.sin(direction)])
+
+
+# Function to build the landmarks of a pose with the given joint angles
+def poseLandmarks(elbow, left_shoulder, right_shoulder, knee, hip=180, centre=(560.0, 250.0)):
+    '''
+    Args:
+        elbow, left_shoulder, right_shoulder, knee, hip: Joint angles in degrees, the same on both sides
+                                                         when there is one for both.
+        centre: Position of the middle of the shoulders in pixels.
+    Returns:
+        landmarks: (33, 4) array of the landmarks in whole pixels with their visibility. The landmarks of
+                   no angle are at the centre.
+    '''
+    L = vg.PoseLandmark
+    centre = np.asarray(centre)
+    points = {L.LEFT_SHOULDER: centre - (20, 0), L.RIGHT_SHOULDER: centre + (20, 0)}
+
+    # Every landmark follows from the ones before it, each angle placing the last landmark of its triplet.
+    points[L.LEFT_ELBOW] = points[L.LEFT_SHOULDER] - (60, 0)
+    points[L.LEFT_HIP] = _limb(points[L.LEFT_ELBOW], points[L.LEFT_SHOULDER], left_shoulder, 120)
+    points[L.RIGHT_HIP] = points[L.RIGHT_SHOULDER] + (0, 120)
+    points[L.RIGHT_ELBOW] = _limb(points[L.RIGHT_HIP], points[L.RIGHT_SHOULDER], right_shoulder)
+    for side in ('LEFT', 'RIGHT'):
+        shoulder, hip_point = points[L[f'{side}_SHOULDER']], points[L[f'{side}_HIP']]
+        points[L[f'{side}_WRIST']] = _limb(shoulder, points[L[f'{side}_ELBOW']], elbow)
+        points[L[f'{side}_KNEE']] = _limb(shoulder, hip_point, hip)
+        points[L[f'{side}_ANKLE']] = _limb(hip_point, points[L[f'{side}_KNEE']], knee)
+
+    landmarks = np.zeros((33, 4))
+    landmarks[:, :2] = centre
+    for landmark, point in points.items():
+        landmarks[landmark, :2] = point
+    landmarks[:, :2] = np.round(landmarks[:, :2])
+    landmarks[:, 3] = 0.9
+    return landmarks
+
+
+# Function to save the landmarks of a vault over a clip, for the stand-in
+def saveVaultPoses(path, frames, vault_start):
+    '''
+    The gymnast stands in a pose that matches none of the vault, goes through the five poses of the vault
+    from vault_start, holding each for five frames, and is missing from a few frames. Every frame is moved
+    by a few pixels, which keeps the joint angles, so the smoothing has something to do.
+    Args:
+        path: Path of the .npz file to write.
+        frames: Number of frames of the clip.
+        vault_start: Index of the frame with the Jump.
+    '''
+    poses = {state: poseLandmarks(**angles) for state, angles in STATE_ANGLES.items()}
+    states = vg.defaultPoseRules().classify(vg.calculateAngles(np.stack(list(poses.values()))[..., :3]))
+    assert list(states) == list(poses), f"The poses match the states {list(states)}, the rules changed"
+
+    landmarks = np.repeat(poses[0][None], frames, axis=0)
+    for state in range(1, 6):
+        start = vault_start + 10 * (state - 1)
+        landmarks[start:start + 5] = poses[state]
+    landmarks[:, :, :2] += (np.arange(frames) * 7 % 5 - 2)[:, None, None]
+    landmarks[3:6] = np.nan
+    landmarks[vault_start + 3] = np.nan
+    np.savez(path, landmarks=landmarks)
+
+
+class StandInPose:
+    '''
+    Takes the place of mp_pose.Pose, detecting the saved landmarks of the index read from each frame.
+    Args:
+        path: Path of the .npz file written by saveVaultPoses.
+    '''
+
+    def __init__(self, path):
+        with np.load(path) as data:
+            self.landmarks = data['landmarks']
+
+    def process(self, image):
+        from mediapipe.framework.formats import landmark_pb2
+
+        landmarks = self.landmarks[frameIndex(image)]
+        if np.isnan(landmarks).any():
+            return types.SimpleNamespace(pose_landmarks=None)
+
+        # Normalized so that detectPose truncates them back to the same pixels.
+        height, width = image.shape[:2]
+        landmark_list = landmark_pb2.NormalizedLandmarkList()
+        for x, y, z, visibility in landmarks:
+            landmark_list.landmark.add(x=(x + 0.25) / width, y=(y + 0.25) / height, z=z / width,
+                                       visibility=visibility)
+        return types.SimpleNamespace(pose_landmarks=landmark_list)
+
+    def reset(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# Function to make Vault_Gymnast build the stand-in instead of the MediaPipe Pose function
+def install(path):
+    vg.buildPose = lambda mode='tracking': StandInPose(path)
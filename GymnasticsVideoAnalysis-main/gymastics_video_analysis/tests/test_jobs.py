@@ -0,0 +1,303 @@
+# Tests of the job queue, the analysis scheduler and the batched Firestore writes of the service
+import time
+import threading
+
+import pytest
+from google.api_core.exceptions import NotFound
+
+from jobs import FairScheduler, JobQueue, JobWorkers
+from firebase_clients import BatchedWrites
+from local_backends import LocalFirestore
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(str(tmp_path / 'jobs.db'))
+    yield queue
+    queue.close()
+
+
+def waitForJob(queue, job_id, timeout=10):
+    # Polls the job until it is done or failed.
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job['status'] in ('done', 'failed'):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"Job {job_id} still {job['status']} after {timeout} s")
+
+
+def test_claim_takes_the_oldest_queued_job(queue):
+    assert queue.claim() is None
+    first = queue.enqueue('athlete-1', force=True)
+    second = queue.enqueue('athlete-2')
+
+    job = queue.claim()
+    assert (job['id'], job['status'], job['force']) == (first, 'running', True)
+    assert queue.get(first)['status'] == 'running'
+    assert queue.depth() == 1
+    assert queue.claim()['id'] == second
+    assert queue.claim() is None
+
+
+def test_claim_prefers_the_batch_with_fewest_running_jobs(queue):
+    batch_id, job_ids = queue.enqueue_batch(['athlete-1', 'athlete-2', 'athlete-3'])
+    single = queue.enqueue('athlete-4')
+
+    # The single job was queued after the batch, but the batch already has a running job.
+    assert queue.claim()['batch_id'] == batch_id
+    assert queue.claim()['id'] == single
+    assert {queue.claim()['id'], queue.claim()['id']} < set(job_ids.values())
+    assert queue.get_batch(batch_id)['counts'] == {'running': 3}
+
+
+def test_each_job_is_claimed_once_by_concurrent_queues(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    queues = [JobQueue(path) for _ in range(4)]
+    job_ids = {queues[0].enqueue(f'athlete-{i}') for i in range(40)}
+
+    claimed = []
+    def drain(queue):
+        while (job := queue.claim()) is not None:
+            claimed.append(job['id'])
+
+    threads = [threading.Thread(target=drain, args=(queue,)) for queue in queues]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for queue in queues:
+        queue.close()
+    assert sorted(claimed) == sorted(job_ids)
+
+
+def test_jobs_left_running_by_a_stopped_service_are_claimed_again(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+
+    # A service claims a job and stops before finishing it, its claim ends with its lease.
+    stopped = JobQueue(path, lease_seconds=0.2)
+    job_id = stopped.enqueue('athlete-1')
+    assert stopped.claim()['id'] == job_id
+    stopped.close()
+
+    queue = JobQueue(path)
+    assert queue.claim() is None
+    time.sleep(0.2)
+    handled = []
+    workers = JobWorkers(queue, lambda job, queue: handled.append(job['id']), poll_interval=0.01)
+    workers.start()
+    try:
+        assert waitForJob(queue, job_id)['status'] == 'done'
+    finally:
+        workers.stop()
+        queue.close()
+    assert handled == [job_id]
+
+
+def test_a_starting_service_leaves_the_running_jobs_of_a_live_one_alone(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    queue = JobQueue(path, lease_seconds=0.2)
+    job_id = queue.enqueue('athlete-1')
+
+    # The job runs for several leases, renewed by the heartbeat of its workers.
+    release = threading.Event()
+    workers = JobWorkers(queue, lambda job, queue: release.wait(10), poll_interval=0.01)
+    workers.start()
+    sibling = JobQueue(path, lease_seconds=0.2)
+    handled = []
+    sibling_workers = JobWorkers(sibling, lambda job, queue: handled.append(job['id']), poll_interval=0.01)
+    try:
+        while queue.get(job_id)['status'] != 'running':
+            time.sleep(0.01)
+        sibling_workers.start()
+        time.sleep(0.6)
+        assert (queue.get(job_id)['status'], queue.get(job_id)['worker_id']) == ('running', queue.worker_id)
+        release.set()
+        assert waitForJob(queue, job_id)['status'] == 'done'
+    finally:
+        release.set()
+        sibling_workers.stop()
+        workers.stop()
+        sibling.close()
+        queue.close()
+    assert handled == []
+
+
+def test_a_failing_job_is_recorded_and_the_next_one_still_runs(queue):
+    def handler(job, queue):
+        if job['athlete_id'] == 'athlete-1':
+            raise RuntimeError('no videos')
+
+    failing = queue.enqueue('athlete-1')
+    working = queue.enqueue('athlete-2')
+    workers = JobWorkers(queue, handler, poll_interval=0.01)
+    workers.start()
+    try:
+        failed = waitForJob(queue, failing)
+        assert (failed['status'], failed['error']) == ('failed', 'no videos')
+        assert waitForJob(queue, working)['status'] == 'done'
+    finally:
+        workers.stop()
+
+    # A failed job stays failed, the client queues it again to retry.
+    assert queue.claim() is None
+    retry = queue.enqueue('athlete-1')
+    assert queue.claim()['id'] == retry
+
+
+def runInSlots(scheduler, analyses):
+    '''
+    Queues the analyses while a first one holds the only slot, then lets them run.
+    Args:
+        scheduler: The FairScheduler.
+        analyses: List of (group, cost) of the analyses, queued in this order.
+    Returns:
+        order: The analyses in the order they were given the slot.
+    '''
+    order = []
+    def analyse(group, cost):
+        with scheduler.slot(group, cost):
+            order.append((group, cost))
+
+    holder = scheduler.slot('holder')
+    holder.__enter__()
+    threads = []
+    for count, (group, cost) in enumerate(analyses, start=1):
+        threads.append(threading.Thread(target=analyse, args=(group, cost)))
+        threads[-1].start()
+
+        # Each analysis is waiting before the next is queued, so they are queued in order.
+        while scheduler.waiting_count() < count:
+            time.sleep(0.001)
+    holder.__exit__(None, None, None)
+    for thread in threads:
+        thread.join()
+    return order
+
+
+def test_round_robin_takes_turns_between_athletes():
+    scheduler = FairScheduler(1)
+    order = runInSlots(scheduler, [('squad', 3), ('squad', 1), ('squad', 2), ('single', 5)])
+    assert order == [('squad', 1), ('single', 5), ('squad', 2), ('squad', 3)]
+    assert (scheduler.running, scheduler.served, scheduler.group_running) == (0, {}, {})
+
+
+def test_shortest_runs_the_shortest_analysis_of_any_athlete():
+    scheduler = FairScheduler(1, policy='shortest')
+    order = runInSlots(scheduler, [('squad', 3), ('squad', 1), ('squad', 2), ('single', 5)])
+    assert order == [('squad', 1), ('squad', 2), ('squad', 3), ('single', 5)]
+
+
+def test_memory_budget_holds_back_an_analysis_with_a_free_slot():
+    scheduler = FairScheduler(2, memory_budget=100)
+    with scheduler.slot('athlete-1', memory=80):
+        started = threading.Event()
+        def analyse():
+            with scheduler.slot('athlete-2', memory=50):
+                started.set()
+
+        thread = threading.Thread(target=analyse)
+        thread.start()
+        while not scheduler.waiting_count():
+            time.sleep(0.001)
+        assert not started.wait(0.05)
+    thread.join()
+    assert started.is_set()
+
+    # An analysis larger than the whole budget runs alone.
+    with scheduler.slot('athlete-3', memory=500):
+        assert scheduler.memory == 500
+
+
+def test_unknown_scheduling_policy_is_rejected():
+    with pytest.raises(ValueError, match='policy'):
+        FairScheduler(1, policy='fifo')
+
+
+def makeDocuments(db, count):
+    videos = db.collection('athletes').document('athlete-1').collection('videos')
+    references = [videos.document(f'video-{i}') for i in range(count)]
+    for reference in references:
+        reference.set({'status': 'queued'})
+    db.round_trips = 0
+    return references
+
+
+def test_batched_writes_commit_full_batches_and_flush_the_rest():
+    db = LocalFirestore()
+    references = makeDocuments(db, 5)
+    writes = BatchedWrites(db, batch_size=2)
+
+    for number, reference in enumerate(references):
+        writes.update(reference, {'status': 'done', 'number': number})
+    assert db.round_trips == 2
+    assert db.documents[references[-1].path] == {'status': 'queued'}
+
+    writes.flush()
+    assert db.round_trips == 3
+
+    # Nothing pending, nothing sent.
+    writes.flush()
+    assert db.round_trips == 3
+    assert [reference.get().to_dict() for reference in references] == [
+        {'status': 'done', 'number': number} for number in range(5)]
+
+
+def test_batched_writes_from_several_threads_are_all_applied():
+    db = LocalFirestore()
+    references = makeDocuments(db, 200)
+    writes = BatchedWrites(db, batch_size=10)
+
+    def update(references):
+        for reference in references:
+            writes.update(reference, {'status': 'done'})
+
+    threads = [threading.Thread(target=update, args=(references[i::8],)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writes.flush()
+
+    assert db.round_trips <= 20
+    assert all(document.to_dict() == {'status': 'done'} for document in db.collection_group('videos').get())
+    assert len(db.collection_group('videos').get()) == 200
+
+
+def test_a_deleted_document_only_fails_its_own_update():
+    db = LocalFirestore()
+    references = makeDocuments(db, 4)
+    del db.documents[references[1].path]
+    writes = BatchedWrites(db, batch_size=10)
+
+    errors = {}
+    def committed(number):
+        return lambda error: errors.__setitem__(number, error)
+
+    for number, reference in enumerate(references):
+        writes.update(reference, {'status': 'done'}, committed(number))
+    assert errors == {}
+    writes.flush()
+
+    # The batch fails as a whole and is sent again one update at a time.
+    assert [number for number, error in sorted(errors.items()) if error is not None] == [1]
+    assert isinstance(errors[1], NotFound)
+    assert [db.documents.get(reference.path) for reference in references] == [
+        {'status': 'done'}, None, {'status': 'done'}, {'status': 'done'}]
+
+
+def test_a_failed_update_without_callback_is_raised_by_flush():
+    db = LocalFirestore()
+    references = makeDocuments(db, 2)
+    del db.documents[references[0].path]
+    writes = BatchedWrites(db)
+    writes.update(references[0], {'status': 'done'})
+    writes.update(references[1], {'status': 'done'})
+    with pytest.raises(NotFound):
+        writes.flush()
+    assert db.documents[references[1].path] == {'status': 'done'}
+
+
+def test_batch_size_is_capped_at_the_firestore_limit():
+    assert BatchedWrites(LocalFirestore(), batch_size=10000).batch_size == 500
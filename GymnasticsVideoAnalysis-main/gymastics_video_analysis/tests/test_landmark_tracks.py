@@ -0,0 +1,44 @@
+# Tests of the landmark track files, see landmark_tracks.py
+import numpy as np
+import pytest
+
+import Vault_Gymnast as vg
+from landmark_tracks import LandmarkTrackWriter, loadTrack, rescoreTrack, scoreResults
+from stand_in_pose import StandInPose, makeIndexedClip, saveVaultPoses
+
+FRAMES = 240
+VAULT_START = 100
+
+
+def test_track_keeps_the_landmarks_as_classified(tmp_path):
+    # Smoothed landmarks are not whole pixels, they are saved without losing any precision.
+    landmarks = np.random.default_rng(0).uniform(0, 720, (3, 33, 4))
+    writer = LandmarkTrackWriter(str(tmp_path / 'track.npz'), 30, (1280, 720), capacity=2)
+    for index in range(3):
+        writer.append(index, landmarks[index])
+    writer.append(3, np.empty((0, 4)))
+    writer.close()
+
+    track = loadTrack(str(tmp_path / 'track.npz'))
+    np.testing.assert_array_equal(track['landmarks'][:3], landmarks)
+    assert np.isnan(track['landmarks'][3]).all()
+    np.testing.assert_array_equal(track['timestamp'], np.arange(4) / 30)
+
+
+@pytest.mark.parametrize('smoothing', [False, True])
+def test_rescoring_a_track_matches_the_analysis(tmp_path, monkeypatch, smoothing):
+    pytest.importorskip('mediapipe')
+    clip = makeIndexedClip(str(tmp_path / 'clip.mp4'), FRAMES)
+    poses = str(tmp_path / 'poses.npz')
+    saveVaultPoses(poses, FRAMES, VAULT_START)
+    monkeypatch.setattr(vg, 'buildPose', lambda mode='tracking': StandInPose(poses))
+
+    analyzer = vg.VaultAnalyzer(smoothing=smoothing, render=False)
+    try:
+        stats = analyzer.analyze(clip, str(tmp_path / 'output.mp4'), track_path=str(tmp_path / 'track.npz'))
+    finally:
+        analyzer.close()
+
+    track = loadTrack(str(tmp_path / 'track.npz'))
+    assert stats['report']['completed']
+    assert scoreResults(rescoreTrack(track), float(track['fps'])) == stats['report']
@@ -0,0 +1,158 @@
+# Tests of the table-driven pose rules, see pose_rules.PoseRules
+import numpy as np
+import pytest
+
+import Vault_Gymnast as vg
+from pose_rules import ANGLE_NAMES, PoseRules, defaultPoseRules
+
+
+# The hand-written rules the default table was written from, to check that it classifies the same
+def referenceState(angles):
+    '''
+    Args:
+        angles: The joint angles of the frame, as returned by Vault_Gymnast.calculateAngles.
+    Returns:
+        state: The state of the matched pose, or 0 when none matches.
+    '''
+    # Initializing the unknown state value with '0'
+    state = 0
+
+    # Unpacking the joint angles, in the order of ANGLE_NAMES.
+    (left_elbow_angle, right_elbow_angle, left_shoulder_angle, right_shoulder_angle,
+     left_knee_angle, right_knee_angle, left_hip_angle, right_hip_angle) = angles
+
+    # Check if the range of elbow and shoulder angles differ from '0' to '360' degree.
+    if left_elbow_angle > 0 and left_elbow_angle < 360 and right_elbow_angle > 0 and right_elbow_angle < 360:
+
+        # Check if shoulders are at the required angle.
+        if left_shoulder_angle > 0 and left_shoulder_angle < 360 and right_shoulder_angle > 0 and right_shoulder_angle < 360:
+
+    # Checking if it is the Jump pose.
+    #----------------------------------------------------------------------------------------------------------------
+
+            # Check if 360-knee_angle is less than 150 degrees.
+            if left_knee_angle > 210  and left_knee_angle < 360 or right_knee_angle > 210 and right_knee_angle < 360:
+
+                # Specify the state of the pose that is Jump pose.
+                state = 1
+                        
+    #----------------------------------------------------------------------------------------------------------------
+    
+    # Check if the both arms are at the required angle.
+    if left_elbow_angle > 0 and left_elbow_angle < 360 and right_elbow_angle > 0 and right_elbow_angle < 360:
+
+        # Check if shoulders are straight down.
+        if left_shoulder_angle > 0 and left_shoulder_angle < 20 and right_shoulder_angle > 0 and right_shoulder_angle < 20:
+
+    # Check if it is the 2nd flight pose.
+    #----------------------------------------------------------------------------------------------------------------
+
+            # Check if both the legs are free.
+            if left_knee_angle > 0  and left_knee_angle < 360 or right_knee_angle > 0 and right_knee_angle < 360:
+
+                # Specify the state of the pose that is 2nd flight pose.
+                state = 4
+    #----------------------------------------------------------------------------------------------------------------
+    
+    # Check if both arms are at the required angles.
+    if left_elbow_angle > 145 and left_elbow_angle < 215 and right_elbow_angle > 145 and right_elbow_angle < 215:
+
+    # Check if it is the 1st flight pose.
+    #----------------------------------------------------------------------------------------------------------------
+        
+        # Check if both the shoulders are straight.
+        if left_shoulder_angle > 145 and left_shoulder_angle < 170 and right_shoulder_angle > 65:
+            # Check if one leg is straight.
+            if left_knee_angle > 165 and left_knee_angle < 195 or right_knee_angle > 165 and right_knee_angle < 195:
+
+                # Specify the state of the pose that is 1st Flight pose.
+                state = 2
+    #----------------------------------------------------------------------------------------------------------------
+    
+    # Check if it is the repulsion pose.
+    #----------------------------------------------------------------------------------------------------------------
+    
+    # Check if both the legs are straight.
+    if left_knee_angle > 170 and left_knee_angle < 190 and right_knee_angle > 170 and right_knee_angle < 190:
+    #----------------------------------------------------------------------------------------------------------------
+
+        # Check if one of the shoulders is greater than 180 degrees.
+        if left_shoulder_angle > 180 or right_shoulder_angle > 180:
+            # Check if one elbow is at the required angle.
+            if left_elbow_angle > 120 and left_elbow_angle < 190 or right_elbow_angle > 120 and right_elbow_angle < 190:
+
+                # Specify the state of the pose that is Repulsion pose.
+                state = 3
+    #----------------------------------------------------------------------------------------------------------------
+    
+    
+    # Check if both the arms are straight.
+    if left_elbow_angle > 165 and left_elbow_angle < 195 and right_elbow_angle > 165 and right_elbow_angle < 195:
+
+        # Check if shoulders are at the required angle.
+        if left_shoulder_angle > 85 and left_shoulder_angle < 195 and right_shoulder_angle > 85 and right_shoulder_angle < 195:
+
+    # Check if it is the ending pose.
+    #----------------------------------------------------------------------------------------------------------------
+
+            # Check if one leg is straight.
+            if left_knee_angle > 135 and left_knee_angle < 180 or right_knee_angle > 135 and right_knee_angle < 180:
+
+                # Specify the state of the pose that is ending pose.
+                state = 5
+    #-----------------------------------------------------------------------------------------------------------------------
+
+    return state
+
+# Function to compare the states of a rule table with referenceState
+def checkRules(rules, samples=100000, seed=0):
+    '''
+    The angles are drawn at random, each of them often set to one of the bounds of the rules or just
+    next to it, where a wrong comparison would show, and sometimes NaN.
+    Args:
+        rules: The PoseRules to check.
+        samples: Number of angle sets compared.
+        seed: Seed of the random angles.
+    Returns:
+        mismatches: List of (angles, state, reference state) of the angle sets classified differently.
+    '''
+    rng = np.random.default_rng(seed)
+    bounds = np.unique(np.concatenate([rules.lower[np.isfinite(rules.lower)], rules.upper[np.isfinite(rules.upper)]]))
+    near = np.concatenate([bounds, np.nextafter(bounds, -np.inf), np.nextafter(bounds, np.inf), [np.nan]])
+
+    shape = (samples, len(rules.angle_names))
+    angles = rng.uniform(0, 360, shape)
+    at_bound = rng.random(shape) < 0.5
+    angles[at_bound] = rng.choice(near, at_bound.sum())
+
+    states = rules.classify(angles)
+    reference = np.array([referenceState(frame_angles) for frame_angles in angles])
+    return [(angles[i], int(states[i]), int(reference[i])) for i in np.flatnonzero(states != reference)]
+
+
+def test_default_rules_classify_like_the_hand_written_rules():
+    mismatches = checkRules(defaultPoseRules())
+    assert not mismatches, f"{len(mismatches)} angle sets classified differently, the first: {mismatches[0]}"
+
+
+def test_a_rule_table_differing_from_the_hand_written_rules_is_caught():
+    table = defaultPoseRules().table
+    rules = [dict(rule, all={**rule['all'], 'left_knee': [170, 190]}) if rule['state'] == 1 else rule
+             for rule in table['rules']]
+    assert checkRules(PoseRules(dict(table, rules=rules)), samples=10000)
+
+
+def test_angle_names_follow_the_angles_of_the_analyzer():
+    assert len(ANGLE_NAMES) == len(vg.ANGLE_TRIPLETS)
+    angles = vg.calculateAngles(np.random.default_rng(0).uniform(0, 500, (4, 33, 3)))
+    assert angles.shape == (4, len(ANGLE_NAMES))
+
+
+@pytest.mark.parametrize('rule, message', [
+    ({'phase': 'Jump', 'all': {'left_knee': [210, 360]}}, 'state'),
+    ({'state': 1, 'all': {'left_ankle': [210, 360]}}, 'unknown angle'),
+    ({'state': 1, 'all': {'left_knee': [360, 210]}}, 'empty interval'),
+])
+def test_invalid_rules_are_rejected(rule, message):
+    with pytest.raises(ValueError, match=message):
+        PoseRules({'rules': [rule]})
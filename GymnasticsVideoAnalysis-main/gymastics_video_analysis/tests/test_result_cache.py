@@ -0,0 +1,29 @@
+# Tests of the cache of analysed videos, see result_cache.py
+import sqlite3
+
+from result_cache import ResultCache
+
+
+def test_cached_result_keeps_its_report_and_paths(tmp_path):
+    cache = ResultCache(str(tmp_path / 'results.db'))
+    assert (cache.get('key'), cache.report('key'), cache.paths('key')) == (None, None, (None, None))
+
+    cache.put('key', 'https://output', {'score': 9.5}, 'tracks/athlete/video.npz', 'videos/video.annotations.json')
+    assert cache.get('key') == 'https://output'
+    assert cache.report('key') == {'score': 9.5}
+    assert cache.paths('key') == ('tracks/athlete/video.npz', 'videos/video.annotations.json')
+    cache.close()
+
+
+def test_results_cached_before_the_paths_are_still_found(tmp_path):
+    path = str(tmp_path / 'results.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE results (key TEXT PRIMARY KEY, output_video_url TEXT NOT NULL, created_at REAL NOT NULL)')
+    conn.execute("INSERT INTO results VALUES ('key', 'https://output', 0)")
+    conn.commit()
+    conn.close()
+
+    cache = ResultCache(path)
+    assert cache.get('key') == 'https://output'
+    assert (cache.report('key'), cache.paths('key')) == (None, (None, None))
+    cache.close()
@@ -0,0 +1,116 @@
+# Tests of the adaptive frame sampling, see Vault_Gymnast.AdaptiveSampler
+import numpy as np
+import pytest
+
+import Vault_Gymnast as vg
+from synthetic_clips import RESOLUTIONS, makeSyntheticClip
+from stand_in_pose import StandInPose, makeIndexedClip, saveVaultPoses
+
+# Frames of the stand-in clip and the frame of its Jump
+FRAMES = 360
+VAULT_START = 160
+
+
+def torsoLandmarks(x=600.0, y=300.0, torso=100.0):
+    landmarks = np.zeros((33, 4))
+    landmarks[:, 0] = x
+    landmarks[:, 1] = y
+    landmarks[:, 3] = 0.9
+    landmarks[[vg.PoseLandmark.LEFT_HIP, vg.PoseLandmark.RIGHT_HIP], 1] = y + torso
+    return landmarks
+
+
+class FakeDetect:
+    # Detection returning the landmarks of each frame index, recording the order of the frames it sees.
+    def __init__(self, landmarks):
+        self.landmarks = landmarks
+        self.seen = []
+
+    def __call__(self, frame):
+        self.seen.append(frame)
+        landmarks = self.landmarks(frame)
+        return frame, landmarks if landmarks is not None else np.empty((0, 4))
+
+
+def runSampler(frames, landmarks, interval=3, advances=lambda landmarks: False):
+    detect = FakeDetect(landmarks)
+    sampler = vg.AdaptiveSampler(detect, interval, draw=False)
+    results = list(sampler.run(range(frames), lambda: True, advances))
+    return results, detect, sampler
+
+
+def test_landmark_motion_is_euclidean_and_independent_of_position():
+    for x in (50.0, 600.0):
+        landmarks = torsoLandmarks(x)
+        moved = landmarks.copy()
+        moved[:, 0] += 3
+        moved[:, 1] += 4
+        assert vg.landmarkMotion(landmarks, moved) == pytest.approx(5 / 100)
+
+
+def test_fast_gymnast_is_inferred_once_per_frame():
+    results, detect, sampler = runSampler(30, lambda frame: torsoLandmarks(600 + 40 * frame))
+    assert [frame for frame, _ in results] == list(range(30))
+
+    # The sampled frame is kept and the frames it skipped are inferred after it.
+    assert detect.seen[:4] == [0, 3, 1, 2]
+    assert sorted(detect.seen) == list(range(30))
+    assert sampler.inferred == 30
+
+
+def test_clip_without_gymnast_is_inferred_densely():
+    results, detect, sampler = runSampler(30, lambda frame: None)
+    assert detect.seen == list(range(30))
+    assert [len(landmarks) for _, landmarks in results] == [0] * 30
+
+
+def test_still_gymnast_is_interpolated_between_sampled_frames():
+    results, detect, sampler = runSampler(30, lambda frame: torsoLandmarks(600 + frame))
+    assert detect.seen == [0, *range(3, 30, 3), 29]
+    assert (sampler.inferred, sampler.interpolated) == (11, 19)
+    np.testing.assert_array_equal(results[13][1][:, 0], np.trunc(np.full(33, 613.0)))
+
+
+def test_gymnast_appearing_between_sampled_frames_is_inferred():
+    # The gymnast leaves after the first frame and is back in view between two later frames.
+    results, detect, sampler = runSampler(9, lambda frame: torsoLandmarks() if frame in (0, 4, 5) else None)
+    assert [len(landmarks) > 0 for _, landmarks in results] == [frame in (0, 4, 5) for frame in range(9)]
+
+
+def analyzeClip(clip, **settings):
+    with vg.VaultAnalyzer('tracking', render=False, **settings) as analyzer:
+        return analyzer.analyze(clip, None)
+
+
+def test_standing_gymnast_is_sampled_with_the_dense_result(tmp_path, monkeypatch):
+    pytest.importorskip('mediapipe')
+    clip = makeIndexedClip(str(tmp_path / 'clip.mp4'), FRAMES)
+    poses = str(tmp_path / 'poses.npz')
+    saveVaultPoses(poses, FRAMES, VAULT_START)
+    monkeypatch.setattr(vg, 'buildPose', lambda mode='tracking': StandInPose(poses))
+
+    # The gymnast stands still before the Jump and after the Complete pose.
+    dense = analyzeClip(clip)
+    sampled = analyzeClip(clip, sample_interval=3)
+    assert dense['report']['completed']
+    assert sampled['report'] == dense['report']
+    assert dense['inferred'] == FRAMES
+    assert sampled['inferred'] < 0.6 * FRAMES
+
+
+@pytest.fixture(scope='module')
+def syntheticClip(tmp_path_factory):
+    pytest.importorskip('mediapipe')
+    return makeSyntheticClip(str(tmp_path_factory.mktemp('clips') / 'synthetic_480p_5s.mp4'), RESOLUTIONS['480p'], 5)
+
+
+def test_sampled_phases_and_score_match_the_dense_run(syntheticClip):
+    dense = analyzeClip(syntheticClip)
+    sampled = analyzeClip(syntheticClip, sample_interval=3)
+
+    # The gymnast runs too fast for any frame to be interpolated, and no frame is inferred twice. The
+    # tracking sees the sampled frames before the frames they skipped, which can move the phase starts.
+    assert [phase['label'] for phase in sampled['report']['phases']] == \
+           [phase['label'] for phase in dense['report']['phases']]
+    assert sampled['report']['score'] == dense['report']['score']
+    assert sampled['inferred'] <= dense['inferred'] == dense['frames']
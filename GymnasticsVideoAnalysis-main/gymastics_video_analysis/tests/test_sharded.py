@@ -0,0 +1,93 @@
+# Tests of the frame-sharded analysis, see sharded.ShardedAnalyzer
+import os
+import gzip
+import json
+import cv2
+import numpy as np
+import pytest
+
+import Vault_Gymnast as vg
+import video_io
+from sharded import ShardedAnalyzer, planChunks
+from stand_in_pose import STAND_IN_ENV, StandInPose, makeIndexedClip, saveVaultPoses
+
+# Frames of the test clip, split into two chunks near frame 180, and the frame of the Jump, before the split
+FRAMES = 360
+VAULT_START = 160
+
+TESTS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture
+def indexedClip(tmp_path, monkeypatch):
+    pytest.importorskip('mediapipe')
+    clip = makeIndexedClip(str(tmp_path / 'clip.mp4'), FRAMES)
+    poses = str(tmp_path / 'poses.npz')
+    saveVaultPoses(poses, FRAMES, VAULT_START)
+
+    # The analysis in this process and in the spawned workers detects the saved landmarks.
+    monkeypatch.setattr(vg, 'buildPose', lambda mode='tracking': StandInPose(poses))
+    monkeypatch.setenv(STAND_IN_ENV, poses)
+    monkeypatch.setenv('PYTHONPATH', os.pathsep.join([os.path.join(TESTS_FOLDER, 'stand_in'), TESTS_FOLDER,
+                                                      os.path.dirname(TESTS_FOLDER), os.environ.get('PYTHONPATH', '')]))
+    return clip
+
+
+def analyzeClip(analyzer, clip, folder):
+    stats = analyzer.analyze(clip, str(folder / 'output.mp4'), track_path=str(folder / 'track.npz'),
+                             annotations_path=str(folder / 'annotations.json.gz'))
+    with gzip.open(folder / 'annotations.json.gz', 'rt') as annotations_file:
+        annotations = json.load(annotations_file)
+    with np.load(folder / 'track.npz') as track:
+        landmarks = track['landmarks']
+    return stats, annotations, landmarks
+
+
+def countFrames(path):
+    video = cv2.VideoCapture(path)
+    frames = 0
+    while video.grab():
+        frames += 1
+    video.release()
+    return frames
+
+
+def test_chunks_start_at_keyframes_near_an_even_split():
+    assert planChunks(600, 4, [0, 250, 500]) == [(0, 150), (150, 300), (300, 450), (450, 600)]
+    assert planChunks(600, 4, range(0, 600, 12), min_frames=100) == [(0, 144), (144, 300), (300, 444), (444, 600)]
+    # A keyframe nearer to the split making a chunk too short is passed over for one that does not
+    assert planChunks(600, 4, range(0, 600, 12)) == [(0, 156), (156, 312), (312, 600)]
+    assert planChunks(600, 4) == [(0, 150), (150, 300), (300, 450), (450, 600)]
+    assert planChunks(100, 4) == [(0, 100)]
+
+
+@pytest.mark.parametrize('smoothing, render', [(False, True), (True, False)])
+def test_sharded_analysis_matches_one_pass(indexedClip, tmp_path, smoothing, render):
+    if render and not video_io.ffmpegAvailable():
+        pytest.skip('joining the chunks of the output video needs ffmpeg')
+    (tmp_path / 'one_pass').mkdir()
+    (tmp_path / 'sharded').mkdir()
+
+    with vg.VaultAnalyzer('tracking', render=render, smoothing=smoothing) as analyzer:
+        expected, expected_annotations, expected_landmarks = analyzeClip(analyzer, indexedClip, tmp_path / 'one_pass')
+    with ShardedAnalyzer(2, render=render, smoothing=smoothing) as analyzer:
+        stats, annotations, landmarks = analyzeClip(analyzer, indexedClip, tmp_path / 'sharded')
+
+    # The vault crosses the split between the chunks, so the state machine has to carry over.
+    (_, split), _ = stats['chunks']
+    assert VAULT_START < split < VAULT_START + 40
+    assert expected['report']['completed']
+
+    assert stats['frames'] == expected['frames'] == FRAMES
+    assert stats['report'] == expected['report']
+    assert annotations == expected_annotations
+    np.testing.assert_array_equal(landmarks, expected_landmarks)
+    if render:
+        assert countFrames(str(tmp_path / 'sharded' / 'output.mp4')) == FRAMES
+
+
+def test_rendering_without_ffmpeg_fails_before_any_work(monkeypatch):
+    monkeypatch.setattr(video_io, 'FFMPEG', 'no-such-ffmpeg')
+    with pytest.raises(ValueError, match='ffmpeg'):
+        ShardedAnalyzer(2)
+    ShardedAnalyzer(2, render=False).close()
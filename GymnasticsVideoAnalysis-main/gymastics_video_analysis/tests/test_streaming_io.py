@@ -0,0 +1,114 @@
+# Tests of the streaming transfers between Storage and the analyzer, see streaming_io.py
+import os
+import time
+import struct
+
+import pytest
+from google.api_core.exceptions import NotFound
+
+from local_backends import LocalBucket
+from streaming_io import isFastStart, makePipe, streamBlobs
+
+CHUNK_SIZE = 1024
+
+
+@pytest.fixture
+def bucket(tmp_path):
+    return LocalBucket(str(tmp_path / 'bucket'))
+
+
+@pytest.fixture
+def pipes(tmp_path):
+    return makePipe(str(tmp_path / 'input.pipe')), makePipe(str(tmp_path / 'output.pipe'))
+
+
+def box(kind, payload=b''):
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+def saveBlob(bucket, name, data):
+    path = os.path.join(bucket.root, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return bucket.blob(name)
+
+
+def openPipes(paths):
+    # The file descriptors of this process still open on one of the pipes.
+    links = []
+    for fd in os.listdir('/proc/self/fd'):
+        try:
+            links.append(os.readlink(os.path.join('/proc/self/fd', fd)))
+        except FileNotFoundError:
+            # The descriptor of the listing itself is closed by now.
+            pass
+    return [link for link in links if link in paths]
+
+
+def stream(bucket, pipes, analyze, source='videos/input.mp4'):
+    return streamBlobs(bucket.blob(source), bucket.blob('output/output.mp4'), *pipes, analyze, CHUNK_SIZE)
+
+
+def test_fast_start_needs_the_index_before_the_media(bucket):
+    assert isFastStart(saveBlob(bucket, 'videos/fast.mp4', box(b'ftyp', b'isom') + box(b'moov') + box(b'mdat', b'x' * 64)))
+    assert not isFastStart(saveBlob(bucket, 'videos/slow.mp4', box(b'ftyp', b'isom') + box(b'mdat', b'x' * 64) + box(b'moov')))
+
+    # A 64 bit size is followed over, and a video whose index lies beyond the probe is not streamed.
+    large = struct.pack('>I4sQ', 1, b'free', 16 + 32) + b'\0' * 32
+    assert isFastStart(saveBlob(bucket, 'videos/large.mp4', box(b'ftyp') + large + box(b'moov')))
+    assert not isFastStart(saveBlob(bucket, 'videos/far.mp4', box(b'ftyp') + box(b'free', b'\0' * 256) + box(b'moov')),
+                           probe_size=128)
+
+
+def test_round_trip_through_the_pipes(bucket, pipes):
+    data = os.urandom(10 * CHUNK_SIZE + 123)
+    saveBlob(bucket, 'videos/input.mp4', data)
+
+    def analyze(input_pipe, output_pipe):
+        with open(input_pipe, 'rb') as source, open(output_pipe, 'wb') as target:
+            while chunk := source.read(777):
+                target.write(chunk)
+        return 'stats'
+
+    result, download, upload = stream(bucket, pipes, analyze)
+    assert result == 'stats'
+    assert download.bytes_transferred == upload.bytes_transferred == len(data)
+    assert bucket.blob('output/output.mp4').download_as_bytes() == data
+    assert not os.path.exists(bucket.blob('output/output.mp4').path + '.partial')
+    assert openPipes(pipes) == []
+
+
+def test_missing_blob_reaches_the_caller(bucket, pipes):
+    def analyze(input_pipe, output_pipe):
+        # The decoder reads an empty input and gives up without opening the output.
+        with open(input_pipe, 'rb') as source:
+            if not source.read():
+                raise IOError("Could not open video")
+
+    with pytest.raises(NotFound):
+        stream(bucket, pipes, analyze, 'videos/missing.mp4')
+    assert openPipes(pipes) == []
+    output = bucket.blob('output/output.mp4')
+    assert not output.exists()
+    assert not os.path.exists(output.path + '.partial')
+
+
+def test_failed_analysis_commits_nothing(bucket, pipes):
+    saveBlob(bucket, 'videos/input.mp4', os.urandom(50 * CHUNK_SIZE))
+
+    def analyze(input_pipe, output_pipe):
+        # The encoder closes the output after a part of the video, then the analysis fails.
+        with open(input_pipe, 'rb') as source, open(output_pipe, 'wb') as target:
+            target.write(source.read(5 * CHUNK_SIZE))
+
+        # The upload reads the end of the output before the failure reaches the caller.
+        time.sleep(0.2)
+        raise RuntimeError("analysis failed")
+
+    with pytest.raises((RuntimeError, BrokenPipeError)):
+        stream(bucket, pipes, analyze)
+    assert openPipes(pipes) == []
+    output = bucket.blob('output/output.mp4')
+    assert not output.exists()
+    assert not os.path.exists(output.path + '.partial')
@@ -0,0 +1,520 @@
+# Threaded video decode and encode stages for the vault analysis loop
+import os
+import re
+import stat
+import shutil
+import queue
+import threading
+import subprocess
+import numpy as np
+from time import perf_counter
+
+# The ffmpeg executable used by FFmpegWriter
+FFMPEG = os.environ.get('FFMPEG_BINARY', 'ffmpeg')
+
+# Marker put on a queue after the last frame
+_END = object()
+
+
+# Function to put an item on a bounded queue without blocking forever once the stage is stopped
+def _put(frame_queue, item, stop_event):
+    while not stop_event.is_set():
+        try:
+            frame_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+# Preallocated frame buffers
+class FramePool:
+    '''
+    Frame buffers allocated once and handed out again and again, so the analysis of a video does not
+    allocate a new array per frame. A buffer is acquired by the decoding thread and released once its
+    frame is encoded or dropped. The number of buffers caps the frames resident in memory, the decoder
+    waits for a free buffer when all are in use.
+    Args:
+        max_count: Largest number of buffers.
+        min_count: Smallest number of buffers, the analysis needs a few in flight to make progress.
+        max_bytes: Optional memory budget of all the buffers together, which lowers the number of
+                   buffers of large frames down to min_count.
+    '''
+
+    def __init__(self, max_count, min_count=1, max_bytes=None):
+        self.max_count = max(max_count, min_count)
+        self.min_count = min_count
+        self.max_bytes = max_bytes
+        self.condition = threading.Condition()
+        self.shape = None
+        self.limit = self.max_count
+        self.free = []
+        self.allocated = 0
+
+    def reset(self):
+        '''
+        Forgets the buffers not released by an interrupted analysis, before the next video.
+        '''
+        with self.condition:
+            self.allocated = len(self.free)
+
+    def acquire(self, shape, stop_event=None):
+        '''
+        Args:
+            shape: Shape of the uint8 frame buffer.
+            stop_event: Optional threading.Event that stops the wait for a free buffer.
+        Returns:
+            buffer: A buffer of the shape, with undefined contents, or None when stopped.
+        '''
+        shape = tuple(shape)
+        with self.condition:
+            # Frames of another size, after a video of another resolution, get new buffers.
+            if shape != self.shape:
+                self.allocated -= len(self.free)
+                self.free = []
+                self.shape = shape
+                self.limit = self.max_count
+                if self.max_bytes is not None:
+                    self.limit = max(self.min_count, min(self.max_count, self.max_bytes // max(int(np.prod(shape)), 1)))
+
+            while not self.free and self.allocated >= self.limit:
+                if stop_event is not None and stop_event.is_set():
+                    return None
+                self.condition.wait(0.1)
+
+            if self.free:
+                return self.free.pop()
+            self.allocated += 1
+        return np.empty(shape, dtype=np.uint8)
+
+    def release(self, buffer):
+        '''
+        Args:
+            buffer: A buffer returned by acquire, which may be handed out again.
+        '''
+        with self.condition:
+            if buffer.shape == self.shape:
+                self.free.append(buffer)
+            else:
+                self.allocated -= 1
+            self.condition.notify()
+
+
+# Decoding stage
+class FrameReader:
+    '''
+    Decodes frames on a background thread into a bounded queue. Iterating over the reader
+    yields the frames in decode order; the decoder waits whenever the queue is full.
+    With a FramePool, every frame is decoded into the same array and preprocessed into a buffer
+    of the pool, the consumer releases the buffers once done with the frames.
+    Args:
+        video: An opened cv2.VideoCapture (or anything with a read() method, taking the array to
+               decode into when a pool is given).
+        preprocess: Optional function applied to each frame on the decoding thread. With a pool it is
+                    called as preprocess(frame, allocate), allocate(shape) returning a buffer of the pool.
+        max_queued: Maximum number of decoded frames waiting to be consumed.
+        pool: Optional FramePool the frames are put in.
+    '''
+
+    def __init__(self, video, preprocess=None, max_queued=8, pool=None):
+        self.video = video
+        self.preprocess = preprocess
+        self.pool = pool
+        self.frames = queue.Queue(maxsize=max_queued)
+        self.stop_event = threading.Event()
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name='FrameReader', daemon=True)
+        self.thread.start()
+
+    def _allocate(self, shape):
+        return self.pool.acquire(shape, self.stop_event)
+
+    def _run(self):
+        decoded = None
+        try:
+            while not self.stop_event.is_set():
+
+                # Read a frame and stop at the end of the video.
+                if self.pool is None:
+                    ok, frame = self.video.read()
+                else:
+                    ok, decoded = self.video.read(decoded)
+                    frame = decoded
+                if not ok:
+                    break
+
+                if self.pool is None:
+                    if self.preprocess is not None:
+                        frame = self.preprocess(frame)
+                elif self.preprocess is not None:
+                    frame = self.preprocess(frame, self._allocate)
+                else:
+                    # The decoded array is reused for the next frame, so the frame is copied out of it.
+                    buffer = self._allocate(frame.shape)
+                    if buffer is None:
+                        return
+                    np.copyto(buffer, frame)
+                    frame = buffer
+
+                if not _put(self.frames, frame, self.stop_event):
+                    return
+        except Exception as e:
+            self.error = e
+        _put(self.frames, _END, self.stop_event)
+
+    def __iter__(self):
+        while True:
+            frame = self.frames.get()
+            if frame is _END:
+                break
+            yield frame
+
+        # Surface a decoding failure to the consumer.
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        '''
+        Stops the decoding thread and waits for it to finish.
+        '''
+        self.stop_event.set()
+        self.thread.join()
+
+
+# Decoding stage of live sources
+class LatestFrameReader:
+    '''
+    Reads frames on a background thread and keeps only the newest one, for live analysis. A frame
+    not taken before the next one is read is dropped, so the consumer always gets the latest frame
+    and its delay behind the source stays bounded however slow it is. Iterating over the reader
+    yields (index, captured, frame) tuples, index counting every frame read including the dropped
+    ones, and captured being the time.perf_counter() the frame was read at. The 'read' and 'dropped'
+    attributes count the frames.
+    Args:
+        video: An opened cv2.VideoCapture of a camera or stream (or anything with a read() method).
+        fps: Optional frame rate at which the frames are released, to replay a video file at the speed
+             of a live source. The captured time of a frame is then the time it was due.
+    '''
+
+    def __init__(self, video, fps=None):
+        self.video = video
+        self.interval = 1.0 / fps if fps else None
+        self.condition = threading.Condition()
+        self.latest = None
+        self.ended = False
+        self.read = 0
+        self.dropped = 0
+        self.start = perf_counter()
+        self.stop_event = threading.Event()
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name='LatestFrameReader', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        index = 0
+        try:
+            while not self.stop_event.is_set():
+                ok, frame = self.video.read()
+                if not ok:
+                    break
+                captured = perf_counter()
+
+                # A replayed file waits until each frame is due, as a camera would.
+                if self.interval is not None:
+                    captured = self.start + index * self.interval
+                    if self.stop_event.wait(max(captured - perf_counter(), 0)):
+                        break
+
+                # Replace the frame not yet taken by the consumer.
+                with self.condition:
+                    if self.latest is not None:
+                        self.dropped += 1
+                    self.latest = (index, captured, frame)
+                    self.condition.notify()
+                index += 1
+                self.read = index
+        except Exception as e:
+            self.error = e
+        with self.condition:
+            self.ended = True
+            self.condition.notify()
+
+    def __iter__(self):
+        while True:
+            with self.condition:
+                while self.latest is None and not self.ended:
+                    self.condition.wait()
+                item, self.latest = self.latest, None
+            if item is None:
+                break
+            yield item
+
+        # Surface a reading failure to the consumer.
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        '''
+        Stops the reading thread and waits for it to finish.
+        '''
+        self.stop_event.set()
+        self.thread.join()
+
+
+# Encoding stage
+class FrameWriter:
+    '''
+    Encodes frames on a background thread from a bounded queue, in the order they were written.
+    write() blocks whenever the queue is full.
+    Args:
+        out: An opened cv2.VideoWriter (or anything with a write() method).
+        max_queued: Maximum number of frames waiting to be encoded.
+        release: Optional function called with each frame once it is encoded, like FramePool.release.
+    '''
+
+    def __init__(self, out, max_queued=8, release=None):
+        self.out = out
+        self.release = release
+        self.frames = queue.Queue(maxsize=max_queued)
+        self.stop_event = threading.Event()
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name='FrameWriter', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            while True:
+                frame = self.frames.get()
+                if frame is _END:
+                    break
+                self.out.write(frame)
+                if self.release is not None:
+                    self.release(frame)
+        except Exception as e:
+            self.error = e
+
+            # Drop the remaining frames so the producer is never blocked.
+            self.stop_event.set()
+
+    def write(self, frame):
+        '''
+        Args:
+            frame: The frame to be encoded.
+        '''
+        if self.error is not None:
+            raise self.error
+        _put(self.frames, frame, self.stop_event)
+
+    def close(self):
+        '''
+        Waits for every queued frame to be encoded and stops the encoding thread.
+        '''
+        _put(self.frames, _END, self.stop_event)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+# Codecs of FFmpegWriter: the ffmpeg encoder, its arguments and its default quality and speed.
+# 'mpeg4' matches the 'mp4v' fourcc of cv2.VideoWriter, 'h264' and 'h265' give outputs several times
+# smaller at the same quality. HEVC is tagged 'hvc1', which Apple players need to play it from an MP4.
+CODECS = {
+    'mpeg4': {'args': ['-c:v', 'mpeg4'], 'quality': ['-q:v', '3'], 'preset': None},
+    'h264': {'args': ['-c:v', 'libx264', '-profile:v', 'high'], 'quality': ['-crf', '23'], 'preset': 'veryfast'},
+    'h265': {'args': ['-c:v', 'libx265', '-tag:v', 'hvc1', '-x265-params', 'log-level=error'],
+             'quality': ['-crf', '28'], 'preset': 'veryfast'},
+}
+
+
+# Function to check whether a path is a named pipe
+def isPipe(path):
+    '''
+    Args:
+        path: Path of a file or named pipe.
+    Returns:
+        pipe: True when the path exists and is a named pipe.
+    '''
+    try:
+        return stat.S_ISFIFO(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+
+# Encoder piping frames to an ffmpeg process
+class FFmpegWriter:
+    '''
+    Drop-in replacement for cv2.VideoWriter that pipes raw frames to ffmpeg. A named pipe is written as a
+    fragmented MP4, which is written strictly front to back, so the file can be uploaded while it is being
+    encoded. A regular file gets its index moved to the front when it is finished (fast start), so players
+    start it before it is fully downloaded.
+    Args:
+        output_path: Path of the output video, or of a named pipe.
+        fps: Frame rate of the output video.
+        frame_size: (width, height) of the frames that will be written.
+        codec: One of the keys of CODECS.
+        crf: Constant rate factor of the h264 and h265 codecs, lower is better quality. Defaults to the codec's.
+        bitrate: Target bitrate like '2M', used instead of the constant rate factor when given.
+        preset: Speed preset of the h264 and h265 codecs, like 'ultrafast' or 'medium'.
+        height: Height the output is scaled down to, keeping the aspect ratio. None keeps the frame size.
+        faststart: When false, a regular file keeps its index at the end, which saves rewriting it once.
+    '''
+
+    def __init__(self, output_path, fps, frame_size, codec='mpeg4', crf=None, bitrate=None, preset=None,
+                 height=None, faststart=True):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec '{codec}', expected one of {sorted(CODECS)}")
+        width, frame_height = frame_size
+        options = CODECS[codec]
+
+        # Most encoders need even dimensions. A scaled down output gets an even width, and the
+        # frames are otherwise padded by one pixel when needed.
+        if height is not None and height < frame_height:
+            scale = f'scale=-2:{height - height % 2}'
+        else:
+            scale = 'pad=ceil(iw/2)*2:ceil(ih/2)*2'
+
+        if bitrate is not None:
+            quality = ['-b:v', str(bitrate)]
+        elif crf is not None and codec != 'mpeg4':
+            quality = ['-crf', str(crf)]
+        else:
+            quality = options['quality']
+        preset = preset or options['preset']
+
+        if isPipe(output_path):
+            movflags = ['-movflags', 'frag_keyframe+empty_moov']
+        else:
+            movflags = ['-movflags', '+faststart'] if faststart else []
+
+        command = [FFMPEG, '-loglevel', 'error', '-y',
+                   '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{frame_height}', '-r', str(fps or 30),
+                   '-i', 'pipe:0', '-vf', scale, *options['args'], *quality,
+                   *(['-preset', preset] if preset and codec != 'mpeg4' else []),
+                   '-pix_fmt', 'yuv420p', *movflags, '-f', 'mp4', output_path]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def isOpened(self):
+        return self.process.poll() is None
+
+    def write(self, frame):
+        '''
+        Args:
+            frame: BGR frame of the size given to the constructor.
+        '''
+        try:
+            self.process.stdin.write(np.ascontiguousarray(frame).data)
+        except BrokenPipeError:
+            raise IOError(f"ffmpeg stopped with exit code {self.process.wait()}")
+
+    def release(self):
+        '''
+        Finishes the output video and waits for ffmpeg to exit.
+        '''
+        if self.process.stdin.closed:
+            return
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        if self.process.wait() != 0:
+            raise IOError(f"ffmpeg stopped with exit code {self.process.returncode}")
+
+
+# Writer opened on the first frame
+class SizedWriter:
+    '''
+    Opens the wrapped writer when the first frame is written, sized to that frame, so the output
+    always has the size of the frames actually produced.
+    Args:
+        open_writer: Function called as open_writer(frame_size) with the (width, height) of the frames,
+                     returning a cv2.VideoWriter or FFmpegWriter.
+        default_size: (width, height) the writer is opened with when a complete video had no frames,
+                      so there still is an output video.
+    '''
+
+    def __init__(self, open_writer, default_size):
+        self.open_writer = open_writer
+        self.default_size = default_size
+        self.out = None
+
+    def write(self, frame):
+        if self.out is None:
+            height, width = frame.shape[:2]
+            self.out = self.open_writer((width, height))
+        self.out.write(frame)
+
+    def release(self, complete=True):
+        '''
+        Args:
+            complete: False after a failed analysis, when no empty output video is opened.
+        '''
+        if self.out is None:
+            if not complete:
+                return
+            self.out = self.open_writer(self.default_size)
+        self.out.release()
+
+
+# Function to check whether the ffmpeg executable can be run
+def ffmpegAvailable():
+    '''
+    Returns:
+        available: True when FFMPEG is found, as a path or on the PATH.
+    '''
+    return shutil.which(FFMPEG) is not None
+
+
+# Function to find the keyframes of a video, where decoding can start without the frames before
+def keyframeIndices(path, fps):
+    '''
+    Args:
+        path: Path of the video file.
+        fps: Frame rate of the video, to turn the timestamps of the keyframes into frame indices.
+    Returns:
+        keyframes: Sorted indices of the keyframes, or an empty list when ffmpeg could not list them.
+    '''
+    # Only the keyframes are decoded, which takes a fraction of a second even for long videos.
+    command = [FFMPEG, '-hide_banner', '-nostats', '-skip_frame', 'nokey', '-i', path,
+               '-map', '0:v:0', '-vf', 'showinfo', '-f', 'null', '-']
+    try:
+        result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    except OSError:
+        return []
+    if result.returncode != 0:
+        return []
+
+    times = [float(value) for value in re.findall(r'pts_time:\s*(-?[0-9.]+)', result.stderr)]
+    if not times or not fps:
+        return []
+    start = min(times)
+    return sorted({round((time - start) * fps) for time in times})
+
+
+# Function to join videos encoded with the same settings into one, without encoding them again
+def concatVideos(paths, output_path, faststart=True):
+    '''
+    Args:
+        paths: Paths of the videos, in order.
+        output_path: Path of the joined video, or of a named pipe it is written to as a fragmented MP4.
+        faststart: Whether the index of a regular output file is moved to its front, see FFmpegWriter.
+    '''
+    # The list of the concat demuxer quotes the paths, a quote in a path is closed, escaped and reopened.
+    list_path = os.path.join(os.path.dirname(os.path.abspath(paths[0])), 'concat.txt')
+    with open(list_path, 'w') as list_file:
+        for path in paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            list_file.write(f"file '{escaped}'\n")
+
+    if isPipe(output_path):
+        movflags = ['-movflags', 'frag_keyframe+empty_moov']
+    else:
+        movflags = ['-movflags', '+faststart'] if faststart else []
+
+    command = [FFMPEG, '-loglevel', 'error', '-y', '-f', 'concat', '-safe', '0', '-i', list_path,
+               '-map', '0:v', '-c', 'copy', *movflags, '-f', 'mp4', output_path]
+    try:
+        result = subprocess.run(command, stderr=subprocess.PIPE, text=True)
+    finally:
+        os.remove(list_path)
+    if result.returncode != 0:
+        raise IOError(f"ffmpeg could not join the videos: {result.stderr.strip()}")